@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import statistics
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 添加模块路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quant
+from quant import calculators, channel, fund_flow, indicator_state, industry, net, response_cache, risk, store, trade_calendar
+import data_analysis
+import strategy_screening
+from benchmarks.synthetic import SyntheticMarket
+
+# 热点路径基准测试 (完全离线)
+#
+# 每个用例在 1 / 100 / 5000 只合成标的上计时 (数据见 benchmarks/synthetic.py)，结果写成 JSON。
+# 绝对耗时随机器与负载变化，不能跨机器比较：每个用例计时后紧接着在同一进程内运行固定的校准负载
+# (numpy / pandas / 纯 Python 混合)，以 "用例中位耗时 / 校准中位耗时" 的相对值 (units) 与 baseline.json 比较，
+# 相对值超过 基线 × threshold 且折算的差值超过 MIN_DELTA 记为回归。
+# 筛选流水线使用临时目录中的本地 K 线仓库、工作日交易日历与预置的行业行情，不访问网络。
+#   python benchmarks/run.py                          运行全部用例并与基线比较 (有回归时退出码为 1)
+#   python benchmarks/run.py --cases macd,hv --scales 1,100
+#   python benchmarks/run.py --update-baseline        以本次结果覆盖基线
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SCALES = (1, 100, 5000)
+DAYS = 250
+SEED = 20240101
+INDUSTRY_NAME = "合成行业"
+
+# 回归阈值 (相对值之比)：单标的用例受计时噪声影响大，放宽
+THRESHOLDS = {1: 2.0, 100: 1.6, 5000: 1.5}
+MIN_DELTA = 0.002
+# 每个 (用例, 规模) 的最多运行次数与计时预算 (秒)；至少运行 MIN_RUNS 次，取中位数
+REPEATS = {1: 30, 100: 9, 5000: 5}
+MIN_RUNS = 3
+TIME_BUDGET = 10.0
+CALIBRATION_RUNS = 7
+
+def _history_frames(market, days=150):
+    """与 get_history_detail 相同的形态：最近 days 根 K 线，日期倒序"""
+    return [market.bars(code).tail(days).sort_values('日期', ascending=False) for code in market.codes]
+
+def _analysis_results(market):
+    """与 run_analysis 输出结构相同的结果 (含 numpy 标量与资金流向明细)"""
+    results = []
+    for code in market.codes:
+        details = fund_flow.analyze_flow_details(market.fund_flow(code))
+        results.append({
+            "symbol": code,
+            "name": f"合成{code[-4:]}",
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "risk": {"hv20": np.float64(0.2315), "hv60": np.float64(0.2871)},
+            "liquidity": {"bid_depth": np.int64(120300), "ask_depth": np.int64(98100), "score": "充裕"},
+            "fund_flow": {
+                "details": details.to_dict(orient='records'),
+                "rose_chart": fund_flow.prepare_rose_chart_data(details),
+                "weekly_main_net": np.float64(details['主力'].sum()),
+            },
+            "fundamentals": {"deduct_net_profit": "1.23亿", "report_period": "2024-09-30"},
+            "industry": {"name": INDUSTRY_NAME, "correlation": np.float64(0.71)},
+        })
+    return results
+
+# 用例：(说明, setup)；setup(market, workdir) 返回被计时的无参函数
+def _case_macd(market, workdir):
+    frames = list(market.bar_frames().values())
+    return lambda: [calculators.calculate_macd(df) for df in frames]
+
+def _case_divergence(market, workdir):
+    frames = list(market.bar_frames().values())
+    return lambda: [calculators.check_bottom_divergence(df) for df in frames]
+
+def _case_hv(market, workdir):
+    frames = _history_frames(market)
+    return lambda: [risk.calculate_hv(df, 20) for df in frames]
+
+def _case_flow_details(market, workdir):
+    frames = [market.fund_flow(code) for code in market.codes]
+    return lambda: [fund_flow.analyze_flow_details(df) for df in frames]
+
+def _case_industry_correlation(market, workdir):
+    frames = _history_frames(market)
+    return lambda: [industry.calculate_industry_correlation(df, INDUSTRY_NAME) for df in frames]
+
+def _case_screening(market, workdir):
+    path = os.path.join(workdir, f"snapshot_{len(market.codes)}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(market.snapshot(), f, ensure_ascii=False)
+    return lambda: strategy_screening.run_strategy_screening(path, rule=strategy_screening.DEFAULT_RULE)
+
+def _case_json_payload(market, workdir):
+    rows = market.snapshot()
+    return lambda: channel.Payload(rows).json_bytes
+
+def _case_json_analysis(market, workdir):
+    results = _analysis_results(market)
+    return lambda: json.dumps(results, cls=data_analysis.MyEncoder, ensure_ascii=False)
+
+CASES = {
+    'macd': ("calculators.calculate_macd 逐只计算", _case_macd),
+    'bottom_divergence': ("calculators.check_bottom_divergence 逐只计算", _case_divergence),
+    'hv': ("risk.calculate_hv (倒序的 150 日行情)", _case_hv),
+    'flow_details': ("fund_flow.analyze_flow_details 逐只计算", _case_flow_details),
+    'industry_correlation': ("industry.calculate_industry_correlation (行业行情已在进程内缓存)", _case_industry_correlation),
+    'screening': ("strategy_screening.run_strategy_screening 默认规则 (本地 K 线仓库)", _case_screening),
+    'json_payload': ("channel.Payload 编码筛选结果", _case_json_payload),
+    'json_analysis': ("MyEncoder 编码个股分析结果", _case_json_analysis),
+}
+
+@contextlib.contextmanager
+def offline_environment(market, workdir):
+    """
+    把 K 线仓库、指标状态、响应缓存与交易日历指向临时目录 / 本地数据，并预置行业行情；退出时恢复
+    """
+    saved = (store.STORE_DIR, trade_calendar._calendar, indicator_state._store, response_cache._cache,
+             channel._channel, dict(industry._industry_cache))
+    devnull = open(os.devnull, 'wb')
+    try:
+        store.STORE_DIR = os.path.join(workdir, "bars")
+        trade_calendar._calendar = trade_calendar.TradingCalendar(trade_calendar._weekday_sessions())
+        indicator_state._store = indicator_state.IndicatorStateStore(os.path.join(workdir, "indicator_state.db"))
+        response_cache._cache = response_cache.ResponseCache(os.path.join(workdir, "responses.db"))
+        channel._channel = channel.FrameChannel(devnull)
+        ind = market.industry_frame()
+        industry._industry_cache[INDUSTRY_NAME] = (time.time(), ind)
+
+        now = datetime.now().timestamp()
+        for code in market.codes:
+            bars = store._frame_to_bars(market.bars(code))
+            bars['head'] = bars['日期'][0]
+            bars['synced_at'] = now
+            store._save_bars(code, "qfq", bars)
+        yield
+    finally:
+        (store.STORE_DIR, trade_calendar._calendar, indicator_state._store, response_cache._cache,
+         channel._channel) = saved[:5]
+        industry._industry_cache.clear()
+        industry._industry_cache.update(saved[5])
+        devnull.close()
+
+def calibration_workload():
+    """
+    固定的校准负载 (约数十毫秒)：向量化数值计算、pandas 滚动 / ewm、纯 Python 循环与 JSON 编码，
+    构成与被测用例相近，用于把绝对耗时换算为与机器无关的相对值
+    """
+    rng = np.random.default_rng(SEED)
+    matrix = rng.normal(size=(800, 250))
+    frame = pd.DataFrame(matrix[:40].T)
+    rows = [{"code": f"{i:06d}", "price": float(v), "change": float(v) / 10} for i, v in enumerate(matrix[0])] * 16
+
+    def run():
+        total = np.cumsum(matrix, axis=1)
+        np.sqrt(np.maximum((total[:, 20:] - total[:, :-20]) ** 2, 0.0)).mean()
+        frame.rolling(20).std()
+        frame.ewm(span=12, adjust=False).mean()
+        acc = 0.0
+        for row in rows:
+            acc += row["price"] * row["change"]
+        json.dumps(rows, ensure_ascii=False)
+        return acc
+    return run
+
+def _timed_runs(func, max_runs, budget):
+    times = []
+    started = time.perf_counter()
+    while len(times) < max(max_runs, MIN_RUNS) and (len(times) < MIN_RUNS or time.perf_counter() - started < budget):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return times
+
+def calibrate(workload):
+    """运行校准负载，返回中位耗时 (秒)"""
+    workload()
+    return statistics.median(_timed_runs(workload, CALIBRATION_RUNS, float('inf')))
+
+def measure(func, scale, workload):
+    """
+    预热一次后重复计时 (至少 MIN_RUNS 次)，紧接着运行校准负载
+    返回 {"median", "min", "runs", "calibration", "units"}，units = median / calibration
+    """
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stderr(sink):
+        func()
+        times = _timed_runs(func, REPEATS.get(scale, 3), TIME_BUDGET)
+    median = statistics.median(times)
+    calibration = calibrate(workload)
+    return {"median": median, "min": min(times), "runs": len(times),
+            "calibration": calibration, "units": median / calibration}
+
+def run_suite(cases, scales):
+    """运行所选用例，返回 {"<用例>@<规模>": 结果}"""
+    results = {}
+    workload = calibration_workload()
+    calls_before = sum(s.get('calls', 0) for s in net.stats().values())
+    for scale in scales:
+        market = SyntheticMarket(scale, DAYS, SEED)
+        with tempfile.TemporaryDirectory() as workdir, offline_environment(market, workdir):
+            for name in cases:
+                func = CASES[name][1](market, workdir)
+                stats = measure(func, scale, workload)
+                stats.update(case=name, scale=scale, per_symbol_us=round(stats['median'] / scale * 1e6, 2))
+                results[f"{name}@{scale}"] = stats
+                print(f"INFO: {name}@{scale}: 中位 {stats['median'] * 1000:.2f} ms，最短 {stats['min'] * 1000:.2f} ms "
+                      f"({stats['runs']} 次，{stats['per_symbol_us']} µs/只，校准 x{stats['units']:.2f})", file=sys.stderr)
+    calls = sum(s.get('calls', 0) for s in net.stats().values()) - calls_before
+    if calls:
+        print(f"WARNING: 基准测试期间发生了 {calls} 次上游请求，结果可能受网络影响", file=sys.stderr)
+    return results
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def compare(results, baseline, threshold=None):
+    """
+    以校准后的相对值与基线比较，返回回归列表 [(键, 本次相对值, 基线相对值, 阈值)]
+    基线中没有的键、或基线没有相对值 (旧格式) 的键跳过
+    """
+    regressions = []
+    base_results = (baseline or {}).get('results', {})
+    for key, stats in results.items():
+        base = base_results.get(key)
+        if base is None or not base.get('units'):
+            continue
+        limit = threshold or base.get('threshold') or THRESHOLDS.get(stats['scale'], 1.5)
+        ratio = stats['units'] / base['units']
+        # 基线相对值折算为本机当前的期望耗时，差值过小的用例不计回归
+        expected = base['units'] * stats['calibration']
+        regressed = ratio > limit and stats['median'] - expected > MIN_DELTA
+        level = "ERROR" if regressed else "INFO"
+        print(f"{level}: {key}: {stats['units']:.3f} / 基线 {base['units']:.3f} 校准单位 "
+              f"(x{ratio:.2f}，阈值 x{limit:.2f}；本机 {stats['median'] * 1000:.2f} ms，折算基线 {expected * 1000:.2f} ms)",
+              file=sys.stderr)
+        if regressed:
+            regressions.append((key, stats['units'], base['units'], limit))
+    return regressions
+
+def write_json(path, obj):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline benchmarks for quant hot paths')
+    parser.add_argument('--cases', type=str, help=f"Comma separated cases ({','.join(CASES)})")
+    parser.add_argument('--scales', type=str, help='Comma separated symbol counts (default 1,100,5000)')
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH, help='Baseline JSON path')
+    parser.add_argument('--output', type=str, help='Write this run\'s results to a JSON file')
+    parser.add_argument('--threshold', type=float, help='Override regression threshold (ratio to the baseline calibrated units)')
+    parser.add_argument('--update-baseline', dest='update_baseline', action='store_true',
+                        help='Overwrite the baseline with this run')
+    args = parser.parse_args()
+
+    cases = [c.strip() for c in args.cases.split(',')] if args.cases else list(CASES)
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        print(f"Error: unknown cases: {', '.join(unknown)}")
+        sys.exit(2)
+    scales = [int(s) for s in args.scales.split(',')] if args.scales else list(SCALES)
+
+    results = run_suite(cases, scales)
+    report = {"meta": environment_info(), "results": results}
+    if args.output:
+        write_json(args.output, report)
+
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) or {"results": {}}
+        for key, stats in results.items():
+            baseline['results'][key] = dict(stats, threshold=THRESHOLDS.get(stats['scale'], 1.5))
+        baseline['meta'] = report['meta']
+        write_json(args.baseline, baseline)
+        print(f"INFO: 基线已更新: {args.baseline} ({len(results)} 项)", file=sys.stderr)
+        sys.exit(0)
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"WARNING: 没有基线文件 {args.baseline}，使用 --update-baseline 生成", file=sys.stderr)
+        sys.exit(0)
+    if baseline.get('meta', {}).get('platform') != report['meta']['platform']:
+        print(f"INFO: 基线来自不同的环境 ({baseline.get('meta', {}).get('platform')})，按校准相对值比较",
+              file=sys.stderr)
+    regressions = compare(results, baseline, args.threshold)
+    print(json.dumps({"regressions": [k for k, *_ in regressions], "results": results}, ensure_ascii=False))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+
+# 确定性的合成行情
+#
+# 给定 (标的数, 交易日数, 种子) 总是得到相同的数据，列布局与 akshare 接口的返回完全一致 (含中文列名)：
+#   bars(code)          ak.stock_zh_a_hist            日线 (升序，日期为字符串)
+#   industry_frame()    ak.stock_board_industry_hist_em 行业指数日线
+#   fund_flow(code)     ak.stock_individual_fund_flow  个股资金流向 (升序)
+#   bid_ask(code)       ak.stock_bid_ask_em            五档盘口 (item / value 长表)
+#   snapshot()          data_fetching.fetch_snapshot   全市场快照 (记录列表)
+# 收益率 = beta × 市场因子 + 带趋势切换的个股成分 (AR(1) 漂移)，使 MACD 金叉、背离等形态以真实频率出现；
+# 价格按 0.01 元取整并受 ±10% 涨跌停约束，少量标的带有停牌缺口。
+BAR_COLUMNS = ['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+INDUSTRY_COLUMNS = ['日期', '开盘', '收盘', '最高', '最低', '涨跌幅', '涨跌额', '成交量', '成交额', '振幅', '换手率']
+FLOW_SIZES = ('主力', '超大单', '大单', '中单', '小单')
+BID_ASK_TAIL = ['最新', '均价', '涨幅', '涨跌', '总手', '金额', '换手', '量比', '最高', '最低', '今开', '昨收',
+                '涨停', '跌停', '外盘', '内盘']
+
+# 代码段前缀与占比：沪主板、深主板、创业板、科创板
+BOARDS = (('600', 0.35), ('000', 0.30), ('300', 0.25), ('688', 0.10))
+LIMIT = 0.10
+SUSPENDED_SHARE = 0.02
+
+def sessions(days: int, end=None):
+    """截至 end (缺省为今天) 的最近 days 个工作日 (datetime64[D]，升序)"""
+    end = np.datetime64(pd.Timestamp(end or pd.Timestamp.now()).date(), 'D')
+    last = np.busday_offset(end, 0, roll='backward')
+    return np.busday_offset(last, np.arange(-days + 1, 1), roll='backward')
+
+def make_codes(n: int, seed: int = 0):
+    """按板块占比生成 n 个不重复的 6 位代码 (升序)"""
+    rng = np.random.default_rng(seed)
+    codes = []
+    for prefix, share in BOARDS:
+        k = int(round(n * share)) if prefix != BOARDS[-1][0] else n - len(codes)
+        picked = rng.choice(np.arange(1, 1000), size=min(k, 999), replace=False)
+        codes += [f"{prefix}{i:03d}" for i in picked]
+    # 超出单个代码段容量时顺延到相邻号段
+    extra = 0
+    while len(codes) < n:
+        codes.append(f"{601 + extra // 999}{extra % 999 + 1:03d}")
+        extra += 1
+    return sorted(codes)[:n]
+
+class SyntheticMarket:
+    """
+    n 只标的 × days 个交易日的合成市场；矩阵一次生成，各接口布局的 DataFrame 按需构造
+    """
+    def __init__(self, n: int, days: int = 250, seed: int = 0, end=None):
+        self.seed = seed
+        self.codes = make_codes(n, seed)
+        self.dates = sessions(days, end)
+        self.date_str = np.datetime_as_string(self.dates, unit='D')
+        self._row = {code: i for i, code in enumerate(self.codes)}
+        rng = np.random.default_rng(seed)
+        t = len(self.dates)
+
+        # 1. 收益率：市场因子 + 趋势切换的个股成分
+        market = rng.normal(0.0003, 0.012, t)
+        beta = rng.uniform(0.6, 1.4, (n, 1))
+        drift = np.zeros((n, t))
+        shocks = rng.normal(0, 0.0006, (n, t))
+        for j in range(1, t):
+            drift[:, j] = 0.97 * drift[:, j - 1] + shocks[:, j]
+        vol = rng.uniform(0.012, 0.03, (n, 1))
+        ret = np.clip(beta * market + drift + rng.normal(0, 1, (n, t)) * vol, -LIMIT * 0.99, LIMIT * 0.99)
+        self.market = market
+
+        # 2. 价格：按分取整；开盘为前收盘加跳空，最高 / 最低包住开收盘
+        start = np.exp(rng.uniform(np.log(3), np.log(80), (n, 1)))
+        close = np.round(start * np.exp(np.cumsum(ret, axis=1)), 2)
+        close = np.maximum(close, 0.01)
+        prev = np.concatenate([np.round(start, 2), close[:, :-1]], axis=1)
+        open_ = np.round(prev * np.exp(rng.normal(0, 0.006, (n, t))), 2)
+        span = np.abs(rng.normal(0, 0.008, (n, t)))
+        high = np.minimum(np.round(np.maximum(open_, close) * (1 + span), 2), np.round(prev * (1 + LIMIT), 2))
+        low = np.maximum(np.round(np.minimum(open_, close) * (1 - span), 2), np.round(prev * (1 - LIMIT), 2))
+        high = np.maximum(high, np.maximum(open_, close))
+        low = np.minimum(low, np.minimum(open_, close))
+
+        # 3. 成交：流通股本 (股)，成交量 (手) 随波动放大
+        self.float_shares = np.round(np.exp(rng.uniform(np.log(5e7), np.log(5e9), n)), -4)
+        turnover = np.exp(rng.normal(np.log(0.015), 0.5, (n, t))) * (1 + 20 * np.abs(ret))
+        volume = np.maximum(np.round(turnover * self.float_shares[:, None] / 100), 1)
+        amount = np.round(volume * 100 * (open_ + close + high + low) / 4, 2)
+
+        # 4. 停牌：少量标的中间缺一段交易日
+        valid = np.ones((n, t), dtype=bool)
+        for i in np.flatnonzero(rng.random(n) < SUSPENDED_SHARE):
+            s = rng.integers(t // 4, max(t // 4 + 1, t - 10))
+            valid[i, s:s + rng.integers(3, 20)] = False
+
+        self.open, self.close, self.high, self.low = open_, close, high, low
+        self.prev_close = prev
+        self.volume, self.amount, self.turnover = volume, amount, volume * 100 / self.float_shares[:, None] * 100
+        self.valid = valid
+        self._flow_rng_seed = seed + 1
+
+    def bars(self, code: str):
+        """ak.stock_zh_a_hist 布局的日线 (升序)"""
+        i = self._row[code]
+        m = self.valid[i]
+        close, prev = self.close[i, m], self.prev_close[i, m]
+        return pd.DataFrame({
+            '日期': self.date_str[m],
+            '股票代码': code,
+            '开盘': self.open[i, m],
+            '收盘': close,
+            '最高': self.high[i, m],
+            '最低': self.low[i, m],
+            '成交量': self.volume[i, m].astype(np.int64),
+            '成交额': self.amount[i, m],
+            '振幅': np.round((self.high[i, m] - self.low[i, m]) / prev * 100, 2),
+            '涨跌幅': np.round((close / prev - 1) * 100, 2),
+            '涨跌额': np.round(close - prev, 2),
+            '换手率': np.round(self.turnover[i, m], 2),
+        }, columns=BAR_COLUMNS)
+
+    def bar_frames(self):
+        return {code: self.bars(code) for code in self.codes}
+
+    def industry_frame(self, base: float = 1000.0):
+        """ak.stock_board_industry_hist_em 布局的行业指数日线 (由市场因子构造，与个股相关)"""
+        rng = np.random.default_rng(self.seed + 2)
+        close = np.round(base * np.exp(np.cumsum(self.market)), 2)
+        prev = np.concatenate([[base], close[:-1]])
+        open_ = np.round(prev * np.exp(rng.normal(0, 0.003, len(close))), 2)
+        high = np.round(np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.004, len(close)))), 2)
+        low = np.round(np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.004, len(close)))), 2)
+        volume = np.round(np.exp(rng.normal(np.log(3e7), 0.3, len(close))))
+        return pd.DataFrame({
+            '日期': self.date_str,
+            '开盘': open_,
+            '收盘': close,
+            '最高': high,
+            '最低': low,
+            '涨跌幅': np.round((close / prev - 1) * 100, 2),
+            '涨跌额': np.round(close - prev, 2),
+            '成交量': volume,
+            '成交额': np.round(volume * 100 * close / 100, 2),
+            '振幅': np.round((high - low) / prev * 100, 2),
+            '换手率': np.round(rng.uniform(0.5, 3, len(close)), 2),
+        }, columns=INDUSTRY_COLUMNS)
+
+    def fund_flow(self, code: str, days: int = 120):
+        """ak.stock_individual_fund_flow 布局的资金流向 (升序，最近 days 个交易日，单位元)"""
+        i = self._row[code]
+        rng = np.random.default_rng(self._flow_rng_seed + i)
+        m = np.flatnonzero(self.valid[i])[-days:]
+        amount = self.amount[i, m]
+        pct = (self.close[i, m] / self.prev_close[i, m] - 1)
+        # 各类资金占成交额的净比例，与当日涨跌同向
+        share = rng.normal(0, 0.04, (len(m), 4)) + pct[:, None] * np.array([1.5, 1.0, -0.5, -1.5])
+        net = np.round(share * amount[:, None], 2)
+        nets = {'超大单': net[:, 0], '大单': net[:, 1], '中单': net[:, 2], '小单': net[:, 3]}
+        nets['主力'] = nets['超大单'] + nets['大单']
+        frame = pd.DataFrame({
+            '日期': pd.to_datetime(self.date_str[m]).date,
+            '收盘价': self.close[i, m],
+            '涨跌幅': np.round(pct * 100, 2),
+        })
+        for size in FLOW_SIZES:
+            frame[f'{size}净流入-净额'] = nets[size]
+            frame[f'{size}净流入-净占比'] = np.round(nets[size] / amount * 100, 2)
+        return frame
+
+    def bid_ask(self, code: str):
+        """ak.stock_bid_ask_em 布局的五档盘口 (item / value 长表，挂单量单位为股)"""
+        i = self._row[code]
+        j = np.flatnonzero(self.valid[i])[-1]
+        rng = np.random.default_rng(self.seed + 3 + i)
+        price, prev = self.close[i, j], self.prev_close[i, j]
+        items, values = [], []
+        for level in range(5, 0, -1):
+            items += [f'sell_{level}', f'sell_{level}_vol']
+            values += [round(price + 0.01 * level, 2), float(rng.integers(1, 800) * 100)]
+        for level in range(1, 6):
+            items += [f'buy_{level}', f'buy_{level}_vol']
+            values += [round(price - 0.01 * (level - 1), 2), float(rng.integers(1, 800) * 100)]
+        volume, amount = self.volume[i, j], self.amount[i, j]
+        outer = float(np.round(volume * rng.uniform(0.3, 0.7)))
+        values += [price, round(amount / volume / 100, 2), round((price / prev - 1) * 100, 2), round(price - prev, 2),
+                   float(volume), float(amount), round(self.turnover[i, j], 2), round(rng.uniform(0.5, 2.5), 2),
+                   self.high[i, j], self.low[i, j], self.open[i, j], prev,
+                   round(prev * (1 + LIMIT), 2), round(prev * (1 - LIMIT), 2), outer, float(volume - outer)]
+        items += BID_ASK_TAIL
+        return pd.DataFrame({'item': items, 'value': values})
+
+    def snapshot(self):
+        """data_fetching.fetch_snapshot 布局的全市场快照 (最后一个交易日，记录列表；停牌标的成交为 0)"""
+        rng = np.random.default_rng(self.seed + 4)
+        n = len(self.codes)
+        last = self.valid[:, -1]
+        j60 = max(len(self.dates) - 61, 0)
+        price = self.close[:, -1]
+        prev = self.prev_close[:, -1]
+        market_cap = np.round(price * self.float_shares * rng.uniform(1.0, 1.6, n), 2)
+        frame = pd.DataFrame({
+            'code': self.codes,
+            'name': [f"合成{code[-4:]}" for code in self.codes],
+            'price': price,
+            'change': np.where(last, np.round((price / prev - 1) * 100, 2), 0.0),
+            'volume': np.where(last, self.volume[:, -1], 0.0),
+            'amount': np.where(last, self.amount[:, -1], 0.0),
+            'amplitude': np.where(last, np.round((self.high[:, -1] - self.low[:, -1]) / prev * 100, 2), 0.0),
+            'turnover': np.where(last, np.round(self.turnover[:, -1], 2), 0.0),
+            'pe_dynamic': np.round(rng.lognormal(np.log(25), 0.6, n), 2),
+            'volume_ratio': np.round(rng.lognormal(0, 0.4, n), 2),
+            'high': self.high[:, -1],
+            'low': self.low[:, -1],
+            'open': self.open[:, -1],
+            'prevClose': prev,
+            'market_cap': market_cap,
+            'circulating_market_cap': np.round(price * self.float_shares, 2),
+            'speed': np.round(rng.normal(0, 0.3, n), 2),
+            'pb': np.round(rng.lognormal(np.log(2.5), 0.5, n), 2),
+            'change_60d': np.round((price / self.close[:, j60] - 1) * 100, 2),
+            'change_ytd': np.round((price / self.close[:, 0] - 1) * 100, 2),
+            'main_inflow': np.round(rng.normal(0, 0.03, n) * self.amount[:, -1], 2),
+            'pe_static': np.round(rng.lognormal(np.log(30), 0.6, n), 2),
+            'main_inflow_ratio': np.round(rng.normal(0, 3, n), 2),
+        })
+        return frame.to_dict(orient='records')
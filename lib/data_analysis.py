@@ -3,6 +3,7 @@ import json
 import argparse
 import os
 import pandas as pd
+import concurrent.futures
 from datetime import datetime
 
 # 添加模块路径
@@ -10,6 +11,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # 导入模块化量化工具库
 import quant
+from quant import channel
 
 import numpy as np
 
@@ -28,103 +30,209 @@ class MyEncoder(json.JSONEncoder):
             return obj.to_dict()
         return super(MyEncoder, self).default(obj)
 
-def run_analysis(symbol, base_path="data"):
-    print(f"INFO: 启动分析任务，代码: {symbol}, 路径: {base_path}", file=sys.stderr)
-    try:
-        # 1. 初始化归档目录 (Data Organization)
-        print(f"INFO: 正在初始化 {symbol} 的分析归档...", file=sys.stderr)
-        target_dir, analysis_dir, name = quant.get_target_dir(symbol, base_dir=base_path)
-        
-        # 2. 数据采集 (History & Basic Info)
-        print(f"INFO: 正在采集 {symbol} 的基础行情...", file=sys.stderr)
-        hist_df = quant.get_history_detail(symbol, days=150) # 获取足够的数据用于计算
-        stock_info = quant.get_stock_info(symbol)
-        
-        # 3. 市场风险与波动率 (Market Risk & Volatility)
-        print("INFO: 正在计算波动率指标...", file=sys.stderr)
-        hv20 = quant.calculate_hv(hist_df, 20)
-        hv60 = quant.calculate_hv(hist_df, 60)
-        
-        # 4. 流动性与盘口深度 (Liquidity & Depth)
-        print("INFO: 正在评估盘口流动性...", file=sys.stderr)
-        liquidity = quant.analyze_liquidity(symbol)
-        
-        # 5. 资金流向分析 (Fund Flow Analysis)
-        print("INFO: 正在执行深度资金流向分析...", file=sys.stderr)
+def _summary_row(result):
+    """分析结果 -> 简要报告中的一行"""
+    return {
+        "代码": result['symbol'],
+        "名称": result['name'],
+        "HV20": f"{result['risk']['hv20']}%",
+        "主力一周净流入": f"{result['fund_flow']['weekly_main_net']}万",
+        "扣非净利润": result['fundamentals']['deduct_net_profit'],
+        "行业": result['industry']['name'],
+        "行业相关性": result['industry']['correlation']
+    }
+
+def analyze_symbol(symbol, base_path="data", write_summary=True):
+    """
+    执行单只标的的完整分析并归档，返回只序列化一次的结果 (channel.Payload，.plain 为结果 dict)；出错时抛出异常
+    write_summary=False 时不写单标的 report_summary.csv (批量模式统一汇总)
+    """
+    # 1. 构建分析阶段依赖图：互不依赖的网络请求并发执行，
+    #    行业相关性在行情与行业名称都就绪后立即开始
+    def _flow_stage():
         raw_flow = quant.get_fund_flow(symbol)
         flow_details = quant.analyze_flow_details(raw_flow)
-        rose_data = quant.prepare_rose_chart_data(flow_details)
-        
-        # 6. 财务基本面 (Fundamental Financials)
-        print("INFO: 正在获取财务核心指标...", file=sys.stderr)
-        deduct_profit, report_period = quant.get_latest_profit(symbol)
-        
-        # 7. 行业共振与相关性 (Industry & Correlation)
-        print("INFO: 正在计算行业相关性...", file=sys.stderr)
-        try:
-            industry_name = stock_info[stock_info['item'] == '行业']['value'].values[0]
-            correlation = quant.calculate_industry_correlation(hist_df, industry_name)
-        except:
-            industry_name = "未知"
-            correlation = 0.0
-            
-        # 整合最终结果
-        result = {
-            "symbol": symbol,
-            "name": name,
-            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "risk": {
-                "hv20": round(hv20 * 100, 2) if hv20 else 0,
-                "hv60": round(hv60 * 100, 2) if hv60 else 0
-            },
-            "liquidity": liquidity,
-            "fund_flow": {
-                "details": flow_details.head(5).to_dict(orient='records') if not flow_details.empty else [],
-                "rose_chart": rose_data,
-                "weekly_main_net": round(flow_details['主力'].head(5).sum(), 2) if not flow_details.empty else 0
-            },
-            "fundamentals": {
-                "deduct_net_profit": deduct_profit,
-                "report_period": report_period
-            },
-            "industry": {
-                "name": industry_name,
-                "correlation": round(correlation, 4) if correlation else 0
-            },
-            "history": hist_df.head(30).to_dict(orient='records') if not hist_df.empty else []
-        }
-        
-        # 8. 自动归档 (Data Organization)
-        print("INFO: 正在生成归档文件...", file=sys.stderr)
+        return flow_details, quant.prepare_rose_chart_data(flow_details)
+
+    def _correlation_stage(history, industry_name):
+        if not industry_name:
+            return 0.0
+        return quant.calculate_industry_correlation(history, industry_name)
+
+    empty_df = pd.DataFrame()
+    stages = [
+        # 初始化归档目录 (Data Organization)
+        quant.Stage("archive", lambda: quant.get_target_dir(symbol, base_dir=base_path),
+                    timeout=30, required=True, message=f"正在初始化 {symbol} 的分析归档..."),
+        # 数据采集 (History & Basic Info)，获取足够的数据用于计算
+        quant.Stage("history", lambda: quant.get_history_detail(symbol, days=150),
+                    timeout=30, fallback=empty_df, message=f"正在采集 {symbol} 的基础行情..."),
+        # 市场风险与波动率 (Market Risk & Volatility)
+        quant.Stage("hv", lambda history: quant.calculate_hv_windows(history, (20, 60)),
+                    deps=["history"], timeout=10, fallback=(None, None), message="正在计算波动率指标..."),
+        # 流动性与盘口深度 (Liquidity & Depth)
+        quant.Stage("liquidity", lambda: quant.analyze_liquidity(symbol),
+                    timeout=10, fallback={"bid_depth": 0, "ask_depth": 0, "score": "未知"},
+                    message="正在评估盘口流动性..."),
+        # 资金流向分析 (Fund Flow Analysis)
+        quant.Stage("fund_flow", _flow_stage,
+                    timeout=20, fallback=(empty_df, []), message="正在执行深度资金流向分析..."),
+        # 财务基本面 (Fundamental Financials)
+        quant.Stage("fundamentals", lambda: quant.get_latest_profit(symbol),
+                    timeout=20, fallback=("N/A", "N/A"), message="正在获取财务核心指标..."),
+        # 行业共振与相关性 (Industry & Correlation)
+        quant.Stage("industry_name", lambda: quant.get_industry(symbol),
+                    timeout=10, fallback=None),
+        quant.Stage("correlation", _correlation_stage, deps=["history", "industry_name"],
+                    timeout=30, fallback=0.0, message="正在计算行业相关性..."),
+    ]
+
+    results, reports = quant.run_stages(
+        stages, log=lambda msg: print(f"INFO: {msg}", file=sys.stderr)
+    )
+    for stage_name, report in reports.items():
+        if report.status != "ok":
+            print(f"INFO: 阶段 {stage_name} {report.status}，使用兜底值 ({report.elapsed:.1f}s)", file=sys.stderr)
+
+    target_dir, analysis_dir, name = results["archive"]
+    hist_df = results["history"]
+    hv20, hv60 = results["hv"]
+    liquidity = results["liquidity"]
+    flow_details, rose_data = results["fund_flow"]
+    deduct_profit, report_period = results["fundamentals"]
+    industry_name = results["industry_name"] or "未知"
+    correlation = results["correlation"]
         
-        # 保存 JSON 结果
-        json_path = os.path.join(analysis_dir, f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-        print(f"INFO: 正在保存 JSON 结果到 {json_path}", file=sys.stderr)
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=4, cls=MyEncoder)
-            
-        # 保存简要 CSV 报告
+    # 整合最终结果
+    result = {
+        "symbol": symbol,
+        "name": name,
+        "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "risk": {
+            "hv20": round(hv20 * 100, 2) if hv20 else 0,
+            "hv60": round(hv60 * 100, 2) if hv60 else 0
+        },
+        "liquidity": liquidity,
+        "fund_flow": {
+            "details": flow_details.head(5).to_dict(orient='records') if not flow_details.empty else [],
+            "rose_chart": rose_data,
+            "weekly_main_net": round(flow_details['主力'].head(5).sum(), 2) if not flow_details.empty else 0
+        },
+        "fundamentals": {
+            "deduct_net_profit": deduct_profit,
+            "report_period": report_period
+        },
+        "industry": {
+            "name": industry_name,
+            "correlation": round(correlation, 4) if correlation else 0
+        },
+        "history": hist_df.head(30).to_dict(orient='records') if not hist_df.empty else [],
+        "stage_timings": {stage_name: report.to_dict() for stage_name, report in reports.items()},
+        "cache_stats": quant.response_cache.get_cache().info()["stats"]
+    }
+    
+    # 2. 自动归档 (Data Organization)
+    print("INFO: 正在生成归档文件...", file=sys.stderr)
+    
+    # 保存 JSON 结果
+    json_path = os.path.join(analysis_dir, f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    print(f"INFO: 正在保存 JSON 结果到 {json_path}", file=sys.stderr)
+    payload = channel.Payload(result)
+    payload.write_to(json_path)
+
+    # 保存简要 CSV 报告
+    if write_summary:
         csv_path = os.path.join(analysis_dir, f"report_summary.csv")
         print(f"INFO: 正在生成 CSV 报告...", file=sys.stderr)
-        summary_df = pd.DataFrame([{
-            "代码": symbol,
-            "名称": name,
-            "HV20": f"{result['risk']['hv20']}%",
-            "主力一周净流入": f"{result['fund_flow']['weekly_main_net']}万",
-            "扣非净利润": deduct_profit,
-            "行业": industry_name,
-            "行业相关性": result['industry']['correlation']
-        }])
+        summary_df = pd.DataFrame([_summary_row(result)])
         summary_df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+
+    return payload
+
+def run_analysis(symbol, base_path="data"):
+    print(f"INFO: 启动分析任务，代码: {symbol}, 路径: {base_path}", file=sys.stderr)
+    try:
+        payload = analyze_symbol(symbol, base_path)
         
-        # 输出成功结果给 Tauri (必须输出到 stderr 才能被捕获)
-        print(f"SUCCESS: {json.dumps(result, ensure_ascii=False, cls=MyEncoder)}", file=sys.stderr)
+        # 输出成功结果给 Tauri (与归档文件共用同一份序列化结果)
+        channel.get_channel().result(payload)
         print(f"INFO: 分析完成！", file=sys.stderr)
         
     except Exception as e:
         import traceback
         error_msg = traceback.format_exc()
-        print(f"ERROR: {error_msg}", file=sys.stderr)
+        channel.get_channel().error(error_msg)
+        sys.exit(1)
+
+def load_watchlist(symbols_arg=None, watchlist_file=None):
+    """
+    解析自选列表：--symbols 逗号分隔，或文件中每行一个代码/名称 (支持 # 注释与逗号分隔)
+    名称通过本地标的注册表解析为代码，结果去重并保持原有顺序
+    """
+    raw = []
+    if symbols_arg:
+        raw.extend(symbols_arg.split(','))
+    if watchlist_file:
+        with open(watchlist_file, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                line = line.split('#', 1)[0]
+                raw.extend(line.replace('，', ',').replace('\t', ',').split(','))
+
+    codes = []
+    for item in raw:
+        item = item.strip()
+        if not item:
+            continue
+        # 兼容 "000001 平安银行" 这类带名称的行
+        code, _ = quant.resolve_symbol(item.split()[0])
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+def run_batch_analysis(symbols, base_path="data", max_workers=4):
+    """
+    批量分析自选列表：有界并发执行，每完成一只即输出一行 RESULT，
+    最后写出一张汇总表代替各目录下的 report_summary.csv
+    """
+    print(f"INFO: 启动批量分析任务，共 {len(symbols)} 只, 并发: {max_workers}, 路径: {base_path}", file=sys.stderr)
+    out = channel.get_channel()
+    rows = []
+    failed = []
+    try:
+        total = len(symbols)
+        with quant.ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_symbol = {
+                executor.submit(analyze_symbol, s, base_path, False): s for s in symbols
+            }
+            count = 0
+            for future in concurrent.futures.as_completed(future_to_symbol):
+                count += 1
+                symbol = future_to_symbol[future]
+                try:
+                    payload = future.result()
+                    rows.append(_summary_row(payload.plain))
+                    out.item(payload)
+                except Exception as e:
+                    failed.append(symbol)
+                    print(f"WARNING: {symbol} 分析失败: {str(e)}", file=sys.stderr)
+                out.progress(int(count / total * 100))
+
+        # 按自选列表原顺序写出汇总表
+        order = {s: i for i, s in enumerate(symbols)}
+        rows.sort(key=lambda r: order.get(r['代码'], len(order)))
+        if not os.path.exists(base_path):
+            os.makedirs(base_path)
+        summary_path = os.path.join(base_path, f"watchlist_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+        pd.DataFrame(rows, columns=["代码", "名称", "HV20", "主力一周净流入", "扣非净利润", "行业", "行业相关性"]) \
+            .to_csv(summary_path, index=False, encoding="utf-8-sig")
+        print(f"INFO: 汇总表已保存至: {summary_path}", file=sys.stderr)
+
+        summary = {"summary_file": summary_path, "succeeded": len(rows), "failed": failed}
+        out.result(channel.Payload(summary))
+        return summary
+    except Exception as e:
+        import traceback
+        out.error(traceback.format_exc())
         sys.exit(1)
 
 def download_history(symbol, start_date, end_date, save_path, level='standard', include_index=True):
@@ -164,19 +272,139 @@ def download_history(symbol, start_date, end_date, save_path, level='standard',
         print(f"ERROR: 下载历史数据失败: {str(e)}", file=sys.stderr)
         return None
 
+def export_market_correlation(save_path, windows=(20, 60, 150)):
+    """
+    全市场个股 vs 行业 / 上证指数 / 沪深300 的相关系数、Beta、残差波动率，导出为 CSV
+    """
+    print(f"INFO: 启动全市场相关性计算，窗口: {list(windows)}", file=sys.stderr)
+    try:
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        table = quant.market_correlation_table(windows=windows)
+        if table.empty:
+            print(f"ERROR: 未能获取到行情数据", file=sys.stderr)
+            return None
+
+        full_path = os.path.join(save_path, f"market_correlation_{datetime.now().strftime('%Y%m%d')}.csv")
+        table.to_csv(full_path, index=False, encoding='utf-8-sig', float_format='%.4f')
+        print(f"INFO: 相关性矩阵已保存至: {full_path} ({len(table)} 只)", file=sys.stderr)
+        return {"main_file": full_path, "count": len(table)}
+    except Exception as e:
+        print(f"ERROR: 计算全市场相关性失败: {str(e)}", file=sys.stderr)
+        return None
+
+def export_market_volatility(save_path, windows=(5, 10, 20, 60, 120)):
+    """
+    全市场多窗口波动率 (HV / Parkinson / Garman-Klass) 及百分位排名，导出为 CSV
+    """
+    print(f"INFO: 启动全市场波动率计算，窗口: {list(windows)}", file=sys.stderr)
+    try:
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        table = quant.market_volatility_table(windows=windows)
+        if table.empty:
+            print(f"ERROR: 未能获取到行情数据", file=sys.stderr)
+            return None
+
+        full_path = os.path.join(save_path, f"market_volatility_{datetime.now().strftime('%Y%m%d')}.csv")
+        table.to_csv(full_path, index=False, encoding='utf-8-sig', float_format='%.4f')
+        print(f"INFO: 波动率排名已保存至: {full_path} ({len(table)} 只)", file=sys.stderr)
+        return {"main_file": full_path, "count": len(table)}
+    except Exception as e:
+        print(f"ERROR: 计算全市场波动率失败: {str(e)}", file=sys.stderr)
+        return None
+
+def export_market_flow(save_path, window=10, top=50):
+    """
+    全市场资金流向面板：追加最新交易日 (近期有缺口时自动回填) 后导出当日 / 近 N 日净流入、日增量及百分位排名的 CSV，
+    并返回近 window 日主力净流入前 top 名
+    """
+    print(f"INFO: 启动全市场资金流向统计，排行窗口: {window} 日", file=sys.stderr)
+    try:
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        flow_panel = quant.sync_flow_panel()
+        if flow_panel.empty:
+            print(f"ERROR: 资金流向面板为空", file=sys.stderr)
+            return None
+
+        missing = flow_panel.missing_sessions(window)
+        if len(missing):
+            print(f"ERROR: 资金流向面板近 {window} 日数据不完整 (回填后仍缺少 {len(missing)} 个交易日: "
+                  f"{', '.join(str(d) for d in missing[:5])})，不输出排行", file=sys.stderr)
+            return None
+
+        table = flow_panel.aggregates()['table']
+        full_path = os.path.join(save_path, f"market_fund_flow_{flow_panel.last_date()}.csv")
+        table.to_csv(full_path, index=False, encoding='utf-8-sig', float_format='%.4f')
+        print(f"INFO: 资金流向统计已保存至: {full_path} ({len(table)} 只)", file=sys.stderr)
+        leaders = flow_panel.top('主力', window, top)[['代码', '主力', f'主力{window}日']]
+        leaders = leaders.astype(object).where(leaders.notna(), None)
+        return {
+            "main_file": full_path,
+            "date": str(flow_panel.last_date()),
+            "days": len(flow_panel.dates),
+            "top": leaders.to_dict(orient='records')
+        }
+    except Exception as e:
+        print(f"ERROR: 统计全市场资金流向失败: {str(e)}", file=sys.stderr)
+        return None
+
+def export_backtest(save_path, start_date, end_date, signal='macd_zero_cross', hold=5, symbols=None):
+    """
+    信号回测：成交明细与净值曲线导出为 CSV，返回各持有期的胜率与收益分布
+    """
+    print(f"INFO: 启动回测 signal={signal} hold={hold} {start_date}~{end_date}", file=sys.stderr)
+    try:
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        result = quant.run_backtest(symbols, start_date, end_date, signal=signal, hold=hold)
+        if result['trades'].empty:
+            print(f"ERROR: 回测区间内没有成交", file=sys.stderr)
+            return None
+
+        stamp = f"{signal}_{start_date}_{end_date}"
+        trades_path = os.path.join(save_path, f"backtest_trades_{stamp}.csv")
+        equity_path = os.path.join(save_path, f"backtest_equity_{stamp}.csv")
+        result['trades'].to_csv(trades_path, index=False, encoding='utf-8-sig', float_format='%.4f')
+        result['equity'].to_csv(equity_path, index=False, encoding='utf-8-sig', float_format='%.6f')
+        print(f"INFO: 回测结果已保存至: {trades_path}", file=sys.stderr)
+        return {
+            "trades_file": trades_path,
+            "equity_file": equity_path,
+            "signals": result['signals'],
+            "skipped": result['skipped'],
+            "trades": len(result['trades']),
+            "stats": result['stats']
+        }
+    except Exception as e:
+        print(f"ERROR: 回测失败: {str(e)}", file=sys.stderr)
+        return None
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Stock Data Analysis & Export')
     parser.add_argument('--symbol', type=str, help='Stock symbol')
-    parser.add_argument('--mode', type=str, default='analysis', choices=['analysis', 'history'], help='Run mode')
+    parser.add_argument('--mode', type=str, default='analysis', choices=['analysis', 'history', 'correlation', 'volatility', 'fund_flow', 'backtest'], help='Run mode')
     parser.add_argument('--start', type=str, help='Start date (YYYYMMDD)')
     parser.add_argument('--end', type=str, help='End date (YYYYMMDD)')
     parser.add_argument('--path', type=str, default='data', help='Base path for data')
     parser.add_argument('--level', type=str, default='standard', help='Data level (lite/standard/research)')
     parser.add_argument('--include_index', type=str, default='true', help='Include index data (true/false)')
+    parser.add_argument('--symbols', type=str, help='Comma separated symbols for batch analysis')
+    parser.add_argument('--watchlist-file', dest='watchlist_file', type=str, help='Watchlist file, one symbol per line')
+    parser.add_argument('--concurrency', type=int, default=4, help='Max concurrent analyses in batch mode')
+    parser.add_argument('--signal', type=str, default='macd_zero_cross', help='Signal name for backtest mode')
+    parser.add_argument('--hold', type=int, default=5, help='Holding days for backtest mode')
     
     args = parser.parse_args()
     
-    if args.mode == 'analysis':
+    if args.mode == 'analysis' and (args.symbols or args.watchlist_file):
+        symbols = load_watchlist(args.symbols, args.watchlist_file)
+        if not symbols:
+            print("Error: watchlist is empty")
+            sys.exit(1)
+        run_batch_analysis(symbols, args.path, args.concurrency)
+    elif args.mode == 'analysis':
         if not args.symbol:
             print("Error: symbol is required for analysis mode")
             sys.exit(1)
@@ -192,3 +420,23 @@ if __name__ == "__main__":
         result = download_history(args.symbol, args.start, args.end, args.path, args.level, include_index)
         if result:
             print(json.dumps({"status": "success", "data": result}, ensure_ascii=False))
+    elif args.mode == 'correlation':
+        result = export_market_correlation(args.path)
+        if result:
+            print(json.dumps({"status": "success", "data": result}, ensure_ascii=False))
+    elif args.mode == 'volatility':
+        result = export_market_volatility(args.path)
+        if result:
+            print(json.dumps({"status": "success", "data": result}, ensure_ascii=False))
+    elif args.mode == 'fund_flow':
+        result = export_market_flow(args.path)
+        if result:
+            print(json.dumps({"status": "success", "data": result}, cls=MyEncoder, ensure_ascii=False))
+    elif args.mode == 'backtest':
+        if not all([args.start, args.end]):
+            print("Error: start and end are required for backtest mode")
+            sys.exit(1)
+        symbols = load_watchlist(args.symbols, args.watchlist_file) if (args.symbols or args.watchlist_file) else None
+        result = export_backtest(args.path, args.start, args.end, args.signal, args.hold, symbols)
+        if result:
+            print(json.dumps({"status": "success", "data": result}, cls=MyEncoder, ensure_ascii=False))
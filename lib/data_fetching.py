@@ -1,91 +1,274 @@
 import json
 import sys
-import requests
+import os
+import time
 import io
 import argparse
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+# 添加模块路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from quant import net, pipeline
 
 # 强制设置标准输出为 UTF-8 编码
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
+SNAPSHOT_URL = "http://push2.eastmoney.com/api/qt/clist/get"
+SNAPSHOT_UT = "bd1d9ddb040897f1cf462c6f6e7a71f8"
+
+# m:0 t:6 (深A), m:0 t:80 (创业板), m:1 t:2 (沪A), m:1 t:23 (科创板), m:0 t:81+s:2048 (北交所)
+SNAPSHOT_FS = ",".join([
+    "m:0+t:6",      # 深证A股
+    "m:0+t:80",     # 创业板
+    "m:1+t:2",      # 上证A股
+    "m:1+t:23",     # 科创板
+    "m:0+t:81+s:2048" # 北交所
+])
+
+# 东方财富字段码 -> 输出列名 (代码、名称为字符串列，其余为数值列)
+SNAPSHOT_FIELDS = {
+    "f12": "code",
+    "f14": "name",
+    "f2": "price",
+    "f3": "change",
+    "f5": "volume",
+    "f6": "amount",
+    "f7": "amplitude",
+    "f8": "turnover",
+    "f9": "pe_dynamic",
+    "f10": "volume_ratio",
+    "f15": "high",
+    "f16": "low",
+    "f17": "open",
+    "f18": "prevClose",
+    "f20": "market_cap",
+    "f21": "circulating_market_cap",
+    "f22": "speed",
+    "f23": "pb",
+    "f24": "change_60d",
+    "f25": "change_ytd",
+    "f62": "main_inflow",
+    "f115": "pe_static",
+    "f184": "main_inflow_ratio"
+}
+TEXT_FIELDS = ("f12", "f14")
+
+# 快照接口单页上限为 100 条，全市场约 55 页 (限速、重试与熔断由 quant.net 统一处理)
+SNAPSHOT_PAGE_SIZE = 100
+SNAPSHOT_WORKERS = 8
+SNAPSHOT_RETRIES = net.RETRIES
+
+_snapshot_session = None
+
+def _get_session():
+    global _snapshot_session
+    if _snapshot_session is None:
+        _snapshot_session = net.make_session(pool_size=SNAPSHOT_WORKERS * 2)
+    return _snapshot_session
+
+def _page_params(page, page_size):
+    return {
+        "pn": page,
+        "pz": page_size,
+        "po": 0,
+        "np": 1,
+        "ut": SNAPSHOT_UT,
+        "fltt": 2,
+        "invt": 2,
+        "fid": "f12",
+        "fs": SNAPSHOT_FS,
+        "fields": ",".join(SNAPSHOT_FIELDS)
+    }
+
+def _fetch_page_once(page, page_size, session):
+    response = net.check_status(session.get(SNAPSHOT_URL, params=_page_params(page, page_size), timeout=15))
+    if not response.content.strip():
+        # 被限流时上游可能返回 200 与空响应体，按限流重试
+        raise net.ThrottledError(response.status_code, response.url)
+    data = response.json().get('data') or {}
+    diff = data.get('diff') or []
+    if isinstance(diff, dict):
+        # np=0 时 diff 为以序号为键的对象
+        diff = [diff[k] for k in sorted(diff, key=int)]
+    return int(data.get('total') or 0), diff
+
+def fetch_page(page, page_size, session=None, retries=SNAPSHOT_RETRIES):
+    """
+    获取快照的一页，返回 (total, diff)；限流与网络错误按抖动退避重试，耗尽后抛出 net.UpstreamError
+    """
+    return net.call('eastmoney', _fetch_page_once, page, page_size, session or _get_session(), retries=retries)
+
+def parse_diff(diff):
+    """
+    将快照 diff (字典列表) 一次性解析为列式 DataFrame：数值列为 float64，'-' 等非数值记为 NaN
+    """
+    frame = pd.DataFrame.from_records(diff, columns=list(SNAPSHOT_FIELDS))
+    numeric = [f for f in SNAPSHOT_FIELDS if f not in TEXT_FIELDS]
+    frame[numeric] = frame[numeric].apply(pd.to_numeric, errors='coerce').astype(np.float64)
+    for f in TEXT_FIELDS:
+        frame[f] = frame[f].fillna('--').astype(str)
+    return frame.rename(columns=SNAPSHOT_FIELDS)
+
+def fetch_snapshot(page_size=SNAPSHOT_PAGE_SIZE, max_workers=SNAPSHOT_WORKERS):
+    """
+    全市场快照：先取第 1 页得到总数，其余页在共享连接池上并发获取，按页序拼接后一次性解析
+    返回列式 DataFrame (每只股票一行)
+    """
+    session = _get_session()
+    total, first = fetch_page(1, page_size, session)
+    pages = {1: first}
+    page_count = -(-total // page_size) if total else 1
+
+    if page_count > 1:
+        with pipeline.ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_page = {
+                executor.submit(fetch_page, page, page_size, session): page
+                for page in range(2, page_count + 1)
+            }
+            for future in concurrent.futures.as_completed(future_to_page):
+                pages[future_to_page[future]] = future.result()[1]
+                print(f"PROGRESS: {int(len(pages) / page_count * 100)}", file=sys.stderr, flush=True)
+
+    diff = [row for page in sorted(pages) for row in pages[page]]
+    frame = parse_diff(diff)
+    # 翻页期间行情变动可能导致跨页重复
+    return frame.drop_duplicates('code', keep='first').reset_index(drop=True)
+
+def snapshot_to_columns(frame: pd.DataFrame):
+    """列式快照 -> 紧凑 JSON 结构 {"rows": N, "columns": {列名: [值, ...]}}，NaN 输出为 null"""
+    columns = {}
+    for name in frame.columns:
+        col = frame[name]
+        if col.dtype.kind == 'f':
+            columns[name] = col.astype(object).where(col.notna(), None).tolist()
+        else:
+            columns[name] = col.tolist()
+    return {"rows": len(frame), "columns": columns}
+
+class SnapshotDelta:
+    """
+    快照增量引擎：以代码为键保存上一轮快照的列式数组，新一轮只输出发生变化的字段
+    每 keyframe_every 轮 (及首轮、调用 reset() 后) 输出一次完整关键帧
+    增量帧格式: {"type": "delta", "seq", "changes": {列名: {"code": [...], "value": [...]}}, "added", "removed"}
+    """
+    def __init__(self, keyframe_every: int = 20):
+        self.keyframe_every = max(int(keyframe_every), 1)
+        self.seq = 0
+        self._since_keyframe = None
+        self._codes = None
+        self._frame = None
+
+    def reset(self):
+        """下一轮强制输出关键帧 (例如前端发现序号不连续时)"""
+        self._since_keyframe = None
+
+    def update(self, frame: pd.DataFrame):
+        frame = frame.drop_duplicates('code').reset_index(drop=True)
+        self.seq += 1
+        if self._frame is None or self._since_keyframe is None or self._since_keyframe + 1 >= self.keyframe_every:
+            out = {"type": "keyframe", "seq": self.seq}
+            out.update(snapshot_to_columns(frame))
+            self._since_keyframe = 0
+        else:
+            out = self._diff(frame)
+            self._since_keyframe += 1
+        self._frame = frame
+        self._codes = pd.Index(frame['code'])
+        return out
+
+    def _diff(self, frame: pd.DataFrame):
+        prev = self._frame
+        new_codes = pd.Index(frame['code'])
+        pos = self._codes.get_indexer(new_codes)
+        common = pos >= 0
+
+        # 新增标的整行输出，消失的标的只输出代码
+        added = frame[~common]
+        removed = self._codes[~self._codes.isin(new_codes)]
+
+        cur = frame[common]
+        old = prev.iloc[pos[common]]
+        codes = cur['code'].to_numpy()
+        changes = {}
+        for name in frame.columns:
+            if name == 'code':
+                continue
+            a = cur[name].to_numpy()
+            b = old[name].to_numpy()
+            if a.dtype.kind == 'f':
+                changed = ~((a == b) | (np.isnan(a) & np.isnan(b)))
+            else:
+                changed = a != b
+            if changed.any():
+                values = a[changed]
+                if values.dtype.kind == 'f':
+                    values = np.where(np.isnan(values), None, values.astype(object))
+                changes[name] = {"code": codes[changed].tolist(), "value": values.tolist()}
+
+        out = {"type": "delta", "seq": self.seq, "changes": changes}
+        if len(added):
+            out["added"] = snapshot_to_columns(added)
+        if len(removed):
+            out["removed"] = removed.tolist()
+        return out
+
+def apply_snapshot_frame(frame: pd.DataFrame, message: dict):
+    """
+    在接收端还原快照：关键帧直接重建，增量帧在上一轮快照 (frame) 上应用，返回新的 DataFrame
+    """
+    if message["type"] == "keyframe":
+        return pd.DataFrame(message["columns"])
+
+    frame = frame.set_index('code')
+    for name, change in message["changes"].items():
+        values = pd.Series(change["value"], index=change["code"], dtype=object)
+        if frame[name].dtype.kind == 'f':
+            values = values.astype(np.float64)
+        frame.loc[values.index, name] = values
+    if message.get("removed"):
+        frame = frame.drop(index=message["removed"])
+    frame = frame.reset_index()
+    if message.get("added"):
+        frame = pd.concat([frame, pd.DataFrame(message["added"]["columns"])], ignore_index=True)
+    return frame
+
+def stream_snapshot_deltas(interval: float = 3.0, keyframe_every: int = 20):
+    """按固定间隔刷新全市场快照，每轮向 stdout 输出一行关键帧或增量帧 (JSON)"""
+    engine = SnapshotDelta(keyframe_every)
+    while True:
+        started = time.monotonic()
+        try:
+            message = engine.update(fetch_snapshot())
+            print(json.dumps(message, ensure_ascii=False, separators=(',', ':')), flush=True)
+        except Exception as e:
+            # 本轮失败，下一轮从关键帧重新开始
+            engine.reset()
+            print(f"WARNING: 快照刷新失败: {str(e)}", file=sys.stderr)
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
 def get_page_data(page, page_size):
     try:
         # 直接调用东方财富底层 API，速度比 akshare 快得多
-        url = "http://push2.eastmoney.com/api/qt/clist/get"
-        # 优化 fs 参数，确保覆盖 沪深京 A 股
-        # m:0 t:6 (深A), m:0 t:80 (创业板), m:1 t:2 (沪A), m:1 t:23 (科创板), m:0 t:81+s:2048 (北交所)
-        fs_parts = [
-            "m:0+t:6",      # 深证A股
-            "m:0+t:80",     # 创业板
-            "m:1+t:2",      # 上证A股
-            "m:1+t:23",     # 科创板
-            "m:0+t:81+s:2048" # 北交所
-        ]
-        
-        params = {
-            "pn": page,
-            "pz": page_size,
-            "po": 0,
-            "np": 1,
-            "ut": "bd1d9ddb040897f1cf462c6f6e7a71f8",
-            "fltt": 2,
-            "invt": 2,
-            "fid": "f12",
-            "fs": ",".join(fs_parts),
-            "fields": "f2,f3,f5,f6,f7,f8,f9,f10,f12,f14,f15,f16,f17,f18,f20,f21,f22,f23,f24,f25,f62,f115,f184"
-        }
-        
         print(f"PROGRESS: 30", flush=True)
-        # 增加重试逻辑
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, params=params, timeout=15)
-                response.raise_for_status()
-                data = response.json()
-                if data.get('data') and data['data'].get('diff'):
-                    break
-                if attempt == max_retries - 1:
-                    print(f"DEBUG: Page {page} returned no data after {max_retries} attempts", file=sys.stderr)
-                    return []
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise e
-                print(f"DEBUG: Retry {attempt+1} for page {page} due to {str(e)}", file=sys.stderr)
-        
-        if not data.get('data') or not data['data'].get('diff'):
+        try:
+            _, diff = fetch_page(page, page_size)
+        except Exception as e:
+            print(f"DEBUG: Page {page} returned no data after {SNAPSHOT_RETRIES} attempts", file=sys.stderr)
+            raise e
+        if not diff:
             return []
 
-        stocks = data['data']['diff']
         print(f"PROGRESS: 70", flush=True)
-        
-        result = []
-        for stock in stocks:
-            result.append({
-                "code": str(stock.get('f12', '--')),
-                "name": str(stock.get('f14', '--')),
-                "price": float(stock.get('f2', 0)) if stock.get('f2') != '-' else 0,
-                "change": float(stock.get('f3', 0)) if stock.get('f3') != '-' else 0,
-                "volume": float(stock.get('f5', 0)) if stock.get('f5') != '-' else 0,
-                "amount": float(stock.get('f6', 0)) if stock.get('f6') != '-' else 0,
-                "amplitude": float(stock.get('f7', 0)) if stock.get('f7') != '-' else 0,
-                "turnover": float(stock.get('f8', 0)) if stock.get('f8') != '-' else 0,
-                "pe_dynamic": float(stock.get('f9', 0)) if stock.get('f9') != '-' else 0,
-                "volume_ratio": float(stock.get('f10', 0)) if stock.get('f10') != '-' else 0,
-                "high": float(stock.get('f15', 0)) if stock.get('f15') != '-' else 0,
-                "low": float(stock.get('f16', 0)) if stock.get('f16') != '-' else 0,
-                "open": float(stock.get('f17', 0)) if stock.get('f17') != '-' else 0,
-                "prevClose": float(stock.get('f18', 0)) if stock.get('f18') != '-' else 0,
-                "market_cap": float(stock.get('f20', 0)) if stock.get('f20') != '-' else 0,
-                "circulating_market_cap": float(stock.get('f21', 0)) if stock.get('f21') != '-' else 0,
-                "speed": float(stock.get('f22', 0)) if stock.get('f22') != '-' else 0,
-                "pb": float(stock.get('f23', 0)) if stock.get('f23') != '-' else 0,
-                "change_60d": float(stock.get('f24', 0)) if stock.get('f24') != '-' else 0,
-                "change_ytd": float(stock.get('f25', 0)) if stock.get('f25') != '-' else 0,
-                "main_inflow": float(stock.get('f62', 0)) if stock.get('f62') != '-' else 0,
-                "pe_static": float(stock.get('f115', 0)) if stock.get('f115') != '-' else 0,
-                "main_inflow_ratio": float(stock.get('f184', 0)) if stock.get('f184') != '-' else 0,
-            })
-            
+        # 单页模式保持原有的行式输出，缺失值记为 0
+        frame = parse_diff(diff)
+        numeric = frame.select_dtypes(include='number').columns
+        frame[numeric] = frame[numeric].fillna(0)
+        result = frame.to_dict(orient='records')
+
         print(f"PROGRESS: 100", flush=True)
         return result
     except Exception as e:
@@ -97,10 +280,20 @@ if __name__ == "__main__":
         parser = argparse.ArgumentParser()
         parser.add_argument('--page', type=int, default=1)
         parser.add_argument('--size', type=int, default=500)
+        parser.add_argument('--mode', type=str, default='page', choices=['page', 'snapshot', 'delta'],
+                            help='page: 单页行式输出; snapshot: 全市场列式输出; delta: 持续输出增量帧')
+        parser.add_argument('--interval', type=float, default=3.0, help='delta 模式刷新间隔 (秒)')
+        parser.add_argument('--keyframe', type=int, default=20, help='delta 模式关键帧间隔 (轮)')
         args = parser.parse_args()
-        
-        data = get_page_data(args.page, args.size)
-        print(json.dumps(data, ensure_ascii=False))
+
+        if args.mode == 'delta':
+            stream_snapshot_deltas(args.interval, args.keyframe)
+        elif args.mode == 'snapshot':
+            frame = fetch_snapshot()
+            print(json.dumps(snapshot_to_columns(frame), ensure_ascii=False, separators=(',', ':')))
+        else:
+            data = get_page_data(args.page, args.size)
+            print(json.dumps(data, ensure_ascii=False))
     except Exception as e:
         print(f"ERROR: Main block exception: {str(e)}", file=sys.stderr)
         print("[]") # 兜底输出空数组，防止 Rust 解析失败
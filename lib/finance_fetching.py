@@ -1,215 +1,263 @@
-import requests
 import pandas as pd
 import argparse
 import sys
 import os
 import json
-import time
 import re
+import threading
+import concurrent.futures
 from datetime import datetime
 import akshare as ak
 
+# 添加模块路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from quant import symbols, net, pipeline
+from quant.catalog import get_catalog, file_sha256
+
 # 强制输出为 UTF-8
 import io
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 def get_stock_info(symbol):
     """
-    获取股票的正确代码和名称
+    获取股票的正确代码和名称 (本地标的注册表解析，支持代码或名称)
     """
-    try:
-        stock_list = ak.stock_info_a_code_name()
-        # 如果是纯数字，按代码匹配
-        if symbol.isdigit():
-            # 补全 6 位代码
-            code = symbol.zfill(6)
-            match = stock_list[stock_list['code'] == code]
-            if not match.empty:
-                return code, match.iloc[0]['name']
-        else:
-            # 按名称匹配
-            match = stock_list[stock_list['name'] == symbol]
-            if not match.empty:
-                return match.iloc[0]['code'], match.iloc[0]['name']
-    except Exception as e:
-        print(f"WARNING: 获取股票列表失败: {str(e)}", file=sys.stderr)
-    
-    return symbol, symbol # 兜底返回原值
+    return symbols.resolve_symbol(symbol)
 
 def get_cninfo_org_id(code):
     """
-    通过巨潮搜索接口获取股票的 orgId
+    获取股票的巨潮 orgId (优先使用注册表缓存，未命中时再走巨潮搜索)
     """
-    url = "http://www.cninfo.com.cn/new/information/topSearch/query"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    }
-    params = {
-        "keyWord": code,
-        "maxNum": 10
+    return symbols.get_org_id(code)
+
+# 报表类型映射到分类码
+CATEGORY_MAP = {
+    "年报": "category_ndbg_szsh",
+    "半年报": "category_bndbg_szsh",
+    "一季报": "category_yjdbg_szsh",
+    "三季报": "category_sjdbg_szsh"
+}
+
+# 标题中出现这些词的公告不是正式报告全文
+EXCLUDE_TITLE_KEYS = ["摘要", "英文", "风险提示", "提示性", "更正"]
+
+CNINFO_QUERY_URL = "http://www.cninfo.com.cn/new/hisAnnouncement/query"
+CNINFO_STATIC_URL = "http://static.cninfo.com.cn/"
+
+CNINFO_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "X-Requested-With": "XMLHttpRequest",
+    "Referer": "http://www.cninfo.com.cn/new/commonUrl/pageOfSearch?url=hisAnnouncement/hisAnnouncement",
+    "Origin": "http://www.cninfo.com.cn"
+}
+
+# 共享连接池；查询接口与静态文件服务器的限速见 quant.net.HOSTS ('cninfo' / 'cninfo_static')
+MAX_WORKERS = 8
+CHUNK_SIZE = 256 * 1024
+_session = net.make_session(pool_size=MAX_WORKERS * 2, headers=CNINFO_HEADERS)
+
+_sync_locks = {}
+_sync_guard = threading.Lock()
+
+def _announcement_row(stock_code, r_type, a):
+    """巨潮查询结果 -> 目录记录"""
+    ann_date = datetime.fromtimestamp(a['announcementTime'] / 1000).strftime('%Y-%m-%d')
+    return {
+        "announcement_id": str(a['announcementId']),
+        "code": stock_code,
+        "category": r_type,
+        "title": a['announcementTitle'],
+        "ann_date": ann_date,
+        "adjunct_url": a['adjunctUrl'],
+        "size_kb": a.get('adjunctSize')
     }
+
+def sync_announcements(stock_code, org_id, r_type, force=False):
+    """
+    将某标的某类定期报告的公告元数据增量同步到本地目录：
+    从已知最新公告日期开始查询至今天 (首次同步取全部历史)，TTL 内重复调用不访问网络
+    """
+    catalog = get_catalog()
+    with _sync_guard:
+        lock = _sync_locks.setdefault((stock_code, r_type), threading.Lock())
+
+    # 同一标的同一类型的多个年份任务只同步一次
+    with lock:
+        if not force and not catalog.needs_sync(stock_code, r_type):
+            return 0
+        return _sync_announcements(catalog, stock_code, org_id, r_type)
+
+def _sync_announcements(catalog, stock_code, org_id, r_type):
+    synced_until, _ = catalog.sync_state(stock_code, r_type)
+    start_date = synced_until or "2000-01-01"
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    column, plate = symbols.cninfo_column(stock_code)
+
+    rows = []
+    page = 1
+    while True:
+        data = {
+            "pageNum": str(page),
+            "pageSize": "30",
+            "column": column,
+            "tabName": "fulltext",
+            "plate": plate,
+            "stock": f"{stock_code},{org_id}",
+            "searchkey": "",
+            "secid": "",
+            "category": f"{CATEGORY_MAP.get(r_type, CATEGORY_MAP['三季报'])};",
+            "trade": "",
+            "seDate": f"{start_date}~{end_date}"
+        }
+        payload = net.call('cninfo', _query_page, data)
+        announcements = payload.get('announcements') or []
+        rows.extend(_announcement_row(stock_code, r_type, a) for a in announcements)
+        if not announcements or not payload.get('hasMore'):
+            break
+        page += 1
+
+    if rows:
+        catalog.upsert(rows)
+    newest = max([r['ann_date'] for r in rows], default=synced_until or start_date)
+    catalog.mark_synced(stock_code, r_type, newest)
+    print(f"INFO: 已同步 {stock_code} {r_type} 公告 {len(rows)} 条 (自 {start_date})", file=sys.stderr)
+    return len(rows)
+
+def _query_page(data):
+    return net.check_status(_session.post(CNINFO_QUERY_URL, data=data, timeout=15)).json()
+
+def search_report(stock_code, org_id, year, r_type):
+    """
+    查找指定年份、类型的定期报告 (先增量同步目录，再从本地索引查询)，返回目录记录，未找到时返回 None
+    """
     try:
-        res = requests.post(url, data=params, headers=headers, timeout=10)
-        if res.status_code == 200:
-            data = res.json()
-            if not data:
-                return None, None
-            # 查找最匹配的项
-            for item in data:
-                # 巨潮搜索结果中的 code 可能是 "000981", 也可能是 "000981 sz"
-                item_code = item.get('code', '')
-                if code in item_code:
-                    return item.get('orgId'), item.get('plate', 'szsh') # 默认 szsh
+        sync_announcements(stock_code, org_id, r_type)
     except Exception as e:
-        print(f"ERROR: 获取 orgId 失败: {str(e)}", file=sys.stderr)
-    return None, None
+        # 同步失败时使用已有目录
+        print(f"WARNING: 同步 {stock_code} {r_type} 公告目录时出错: {str(e)}", file=sys.stderr)
+    return get_catalog().find_report(stock_code, r_type, year, EXCLUDE_TITLE_KEYS)
 
-def get_cninfo_reports(symbol, years, report_types, save_path):
+def download_file(url, file_path):
     """
-    从巨潮资讯获取财报 PDF 链接并下载
+    流式下载到 file_path.part，分块写盘后原子重命名；
+    存在未完成的 .part 时通过 Range 请求断点续传 (服务器不支持时从头下载)
+    限流状态码抛出 net.ThrottledError，连接中断抛出 ConnectionError，均由 quant.net 重试 (重试时从 .part 续传)
     """
-    # 1. 准确获取代码和名称
-    stock_code, stock_name = get_stock_info(symbol)
-    print(f"INFO: 目标标的 - {stock_code} {stock_name}", file=sys.stderr)
-    
-    # 2. 获取巨潮内部 orgId
-    org_id, plate = get_cninfo_org_id(stock_code)
-    if not org_id:
-        print(f"ERROR: 无法在巨潮获取 {stock_code} 的 orgId", file=sys.stderr)
-        return
+    part_path = file_path + ".part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
 
-    print(f"PROGRESS: 20", flush=True)
+    with _session.get(url, headers=headers, stream=True, timeout=30) as res:
+        if res.status_code == 416:
+            # .part 已是完整文件
+            os.replace(part_path, file_path)
+            return True
+        if res.status_code in net.THROTTLE_STATUS:
+            raise net.ThrottledError(res.status_code, url)
+        if res.status_code not in (200, 206):
+            return False
+        mode = 'ab' if res.status_code == 206 else 'wb'
+        expected = res.headers.get('Content-Length')
+        written = 0
+        with open(part_path, mode) as f:
+            for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+        if expected is not None and written != int(expected):
+            # 连接中断，保留 .part 供下次续传
+            raise ConnectionError(f"下载中断: {written}/{expected} 字节")
+    os.replace(part_path, file_path)
+    return True
 
-    # 3. 准备基础保存目录 (第一级：代码_名称)
-    base_target_dir = os.path.join(save_path, f"{stock_code}_{stock_name}")
-    if not os.path.exists(base_target_dir):
-        os.makedirs(base_target_dir)
-
-    # 报表类型映射到分类码
-    category_map = {
-        "年报": "category_ndbg_szsh",
-        "半年报": "category_bndbg_szsh",
-        "一季报": "category_yjdbg_szsh",
-        "三季报": "category_sjdbg_szsh"
-    }
-    
-    # 报表类型映射到巨潮搜索关键词 (尝试多个关键词以提高成功率)
-    search_keys_map = {
-        "年报": ["年度报告", "年报"],
-        "半年报": ["半年度报告", "半年报"],
-        "一季报": ["一季度报告", "第一季度报告"],
-        "三季报": ["三季度报告", "第三季度报告"]
-    }
+def _fetch_one(stock_code, org_id, year_dir, year, r_type):
+    """单个 (年份, 类型) 任务：目录查询 -> 下载，返回是否已拿到文件"""
+    report = search_report(stock_code, org_id, year, r_type)
+    if report is None:
+        print(f"WARNING: 未能找到 {stock_code} {year} 年的 {r_type}。", file=sys.stderr)
+        return False
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-        "Accept": "application/json, text/javascript, */*; q=0.01",
-        "X-Requested-With": "XMLHttpRequest",
-        "Referer": "http://www.cninfo.com.cn/new/commonUrl/pageOfSearch?url=hisAnnouncement/hisAnnouncement",
-        "Origin": "http://www.cninfo.com.cn"
-    }
+    catalog = get_catalog()
+    if report['local_path'] and os.path.exists(report['local_path']):
+        print(f"INFO: 跳过已存在: {os.path.basename(report['local_path'])}", file=sys.stderr)
+        return True
 
-    url = "http://www.cninfo.com.cn/new/hisAnnouncement/query"
-    
-    total_tasks = len(years) * len(report_types)
-    completed_tasks = 0
+    adj_title = re.sub(r'[\\/:*?"<>|]', '_', report['title'])
+    file_path = os.path.join(year_dir, f"{adj_title}.pdf")
+    if os.path.exists(file_path):
+        # 目录建立前已下载的文件：补登记路径与哈希
+        catalog.record_download(report['announcement_id'], file_path, file_sha256(file_path))
+        print(f"INFO: 跳过已存在: {adj_title}", file=sys.stderr)
+        return True
 
-    for year in years:
-        # 准备第二级保存目录 (第二级：年份)
-        year_dir = os.path.join(base_target_dir, str(year))
-        if not os.path.exists(year_dir):
-            os.makedirs(year_dir)
-
-        for r_type in report_types:
-            search_keys = search_keys_map.get(r_type, [r_type])
-            found_for_this_type = False
-
-            # 构建查询数据公共参数
-            search_year = int(year)
-            # 扩大搜索日期范围，确保能搜到 (例如 2023 年报可能在 2024 年 4 月发布)
-            start_date = f"{search_year}-01-01"
-            end_date = f"{search_year + 1}-06-30"
-            
-            # 自动判断市场 (CNINFO 搜索参数)
-            # 实际上使用 szsh 通常最稳健，或者根据股票代码精确区分
-            if stock_code.startswith(('60', '68', '90')):
-                column = "shmb"; plate = "sh"
-            elif stock_code.startswith(('00', '20')):
-                column = "szmb"; plate = "sz"
-            elif stock_code.startswith('30'):
-                column = "szcy"; plate = "sz"
-            elif stock_code.startswith(('43', '83', '87', '88')):
-                column = "bj"; plate = "bj"
-            else:
-                column = ""; plate = "" # 留空通常可以搜索全市场
-
-            for search_key in search_keys:
-                if found_for_this_type: break
-
-                data = {
-                    "pageNum": "1",
-                    "pageSize": "30",
-                    "column": column,
-                    "tabName": "fulltext",
-                    "plate": plate,
-                    "stock": f"{stock_code},{org_id}",
-                    "searchkey": search_key,
-                    "secid": "",
-                    "category": "category_ndbg_szsh;" if r_type == "年报" else "category_bndbg_szsh;" if r_type == "半年报" else "category_yjdbg_szsh;" if r_type == "一季报" else "category_sjdbg_szsh;",
-                    "trade": "",
-                    "seDate": f"{start_date}~{end_date}"
-                }
-
-                try:
-                    print(f"INFO: 正在搜索 {year} {r_type} (关键词: {search_key})...", file=sys.stderr)
-                    response = requests.post(url, data=data, headers=headers, timeout=15)
-                    if response.status_code != 200: continue
-
-                    res_json = response.json()
-                    announcements = res_json.get('announcements', [])
-                    
-                    if announcements:
-                        for a in announcements:
-                            title = a['announcementTitle']
-                            # 必须包含年份关键词且排除“摘要”、“英文版”、“提示性”等
-                            if str(year) in title and not any(k in title for k in ["摘要", "英文", "风险提示", "提示性", "更正"]):
-                                pdf_url = "http://static.cninfo.com.cn/" + a['adjunctUrl']
-                                adj_title = re.sub(r'[\\/:*?"<>|]', '_', title)
-                                file_path = os.path.join(year_dir, f"{adj_title}.pdf")
-                                
-                                if os.path.exists(file_path):
-                                    print(f"INFO: 跳过已存在: {adj_title}", file=sys.stderr)
-                                    found_for_this_type = True
-                                    break
-                                    
-                                print(f"Downloading: {adj_title}", file=sys.stderr)
-                                pdf_res = requests.get(pdf_url, headers=headers, timeout=30)
-                                if pdf_res.status_code == 200:
-                                    with open(file_path, 'wb') as f:
-                                        f.write(pdf_res.content)
-                                    print(f"SUCCESS: 已保存 {file_path}", file=sys.stderr)
-                                    found_for_this_type = True
-                                    break
-                    
-                    time.sleep(1) # 增加延迟，避免被封
-
-                except Exception as e:
-                    print(f"WARNING: 搜索 {year} {r_type} 时出错: {str(e)}", file=sys.stderr)
-
-            if not found_for_this_type:
-                print(f"WARNING: 未能找到 {year} 年的 {r_type}。", file=sys.stderr)
+    print(f"Downloading: {adj_title}", file=sys.stderr)
+    try:
+        if net.call('cninfo_static', download_file, CNINFO_STATIC_URL + report['adjunct_url'], file_path):
+            catalog.record_download(report['announcement_id'], file_path, file_sha256(file_path))
+            print(f"SUCCESS: 已保存 {file_path}", file=sys.stderr)
+            return True
+    except Exception as e:
+        print(f"WARNING: 下载 {adj_title} 出错: {str(e)}", file=sys.stderr)
+    return False
 
+def get_cninfo_reports_batch(symbol_list, years, report_types, save_path, max_workers=MAX_WORKERS):
+    """
+    批量下载多只标的的财报：所有 (标的, 年份, 类型) 任务共享连接池并发执行，
+    查询与下载分别受令牌桶限速
+    """
+    tasks = []
+    for symbol in symbol_list:
+        # 1. 准确获取代码和名称
+        stock_code, stock_name = get_stock_info(symbol)
+        print(f"INFO: 目标标的 - {stock_code} {stock_name}", file=sys.stderr)
+
+        # 2. 获取巨潮内部 orgId
+        org_id, _ = get_cninfo_org_id(stock_code)
+        if not org_id:
+            print(f"ERROR: 无法在巨潮获取 {stock_code} 的 orgId", file=sys.stderr)
+            continue
+
+        # 3. 准备保存目录 (第一级：代码_名称，第二级：年份)
+        base_target_dir = os.path.join(save_path, f"{stock_code}_{stock_name}")
+        for year in years:
+            year_dir = os.path.join(base_target_dir, str(year))
+            os.makedirs(year_dir, exist_ok=True)
+            for r_type in report_types:
+                tasks.append((stock_code, org_id, year_dir, year, r_type))
+
+    print(f"PROGRESS: 20", flush=True)
+    if not tasks:
+        return 0
+
+    completed_tasks = 0
+    saved = 0
+    with pipeline.ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_fetch_one, *task) for task in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                saved += bool(future.result())
+            except Exception as e:
+                print(f"WARNING: 任务执行出错: {str(e)}", file=sys.stderr)
             completed_tasks += 1
-            progress = 20 + int((completed_tasks / total_tasks) * 80)
+            progress = 20 + int((completed_tasks / len(tasks)) * 80)
             print(f"PROGRESS: {progress}", flush=True)
+    return saved
+
+def get_cninfo_reports(symbol, years, report_types, save_path):
+    """
+    从巨潮资讯获取财报 PDF 链接并下载 (symbol 可为逗号分隔的多只标的)
+    """
+    symbol_list = [s.strip() for s in str(symbol).replace('，', ',').split(',') if s.strip()]
+    get_cninfo_reports_batch(symbol_list, years, report_types, save_path)
 
     print(f"PROGRESS: 100", flush=True)
     print(f"SUCCESS: 财报处理流程结束")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='从巨潮资讯下载 A 股财报 PDF')
-    parser.add_argument('--symbol', type=str, required=True, help='股票代码或名称')
+    parser.add_argument('--symbol', type=str, required=True, help='股票代码或名称，多只用逗号分隔')
     parser.add_argument('--years', type=str, required=True, help='年份，逗号分隔，如 2023,2022')
     parser.add_argument('--types', type=str, required=True, help='类型，逗号分隔，如 一季报,年报')
     parser.add_argument('--path', type=str, default='downloads/finance', help='保存路径')
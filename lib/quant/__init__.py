@@ -1,6 +1,17 @@
 from .common import get_target_dir, get_stock_info
-from .risk import calculate_hv, analyze_liquidity
+from .risk import calculate_hv, calculate_hv_windows, analyze_liquidity
 from .fund_flow import get_fund_flow, analyze_flow_details, prepare_rose_chart_data
 from .fundamentals import get_latest_profit
 from .industry import calculate_industry_correlation
 from .history import get_history_detail, get_history_range, get_index_history
+from .store import load_bars, sync_bars, read_history
+from .trade_calendar import TradingCalendar, get_calendar
+from .symbols import classify_market, cninfo_column, get_registry, resolve_symbol, lookup_name, search_symbols, get_org_id, get_industry
+from .response_cache import ResponseCache, cached_call
+from .pipeline import Stage, StageReport, StageCancelled, TierStats, ContextThreadPoolExecutor, run_stages
+from .correlation import log_return_panel, cross_beta, rolling_pair_beta, market_correlation_table
+from .rules import Rule, RuleError, parse_rule, ScreeningSession
+from .backtest import SIGNAL_MATRICES, backtest_panel, run_backtest
+from .volatility import volatility_panel, volatility_table, market_volatility_table, OnlineVolatility
+from .flow_panel import FlowPanel, get_flow_panel, sync_flow_panel, backfill_flow_panel, top_inflows
+from .depth_sampler import DepthSampler, start_sampler, get_sampler, stop_sampler, fake_quote_server
@@ -0,0 +1,298 @@
+import os
+import sys
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from . import calculators, panel
+from .pipeline import ContextThreadPoolExecutor
+from .store import read_history
+from .symbols import classify_market, get_registry
+
+# 向量化回测
+#
+# 信号在 T 日收盘后确认，T+1 个有效交易日开盘买入 (停牌日自动顺延)；
+# 买入当日不可卖出 (T+1)，持有 hold 个交易日后按收盘价卖出。
+# 开盘即涨停无法买入，该笔信号放弃；收盘跌停无法卖出，顺延到下一个非跌停的交易日。
+# 涨跌幅限制随板块与日期变化 (见 limit_ratios)；此外全天一价 (开 = 高 = 低 = 收) 且涨跌幅达到最小限制的 K 线
+# 视为封板，不论比例是否已知 (历史上曾被 ST 的标的无法从当前简称得知)。
+# 每个标的的有效 K 线先右对齐压缩 (见 panel.right_align)，停牌不占用持有天数。
+
+HORIZONS = (1, 5, 10, 20)
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# 涨跌幅限制 (按板块)；判定时留出少量容差以吸收复权与四舍五入误差
+LIMIT_RATIOS = {'main': 0.10, 'star': 0.20, 'chinext': 0.20, 'bse': 0.30}
+LIMIT_TOLERANCE = 0.002
+# 创业板注册制改革 (2020-08-24) 前涨跌幅限制为 10%
+CHINEXT_REFORM = np.datetime64('2020-08-24')
+# ST / *ST 标的 (主板及改革前的创业板) 的涨跌幅限制
+ST_RATIO = 0.05
+
+# 单边佣金与卖出印花税
+COMMISSION = 0.0003
+STAMP_DUTY = 0.0005
+
+FIELDS = ('开盘', '收盘', '最高', '最低')
+
+def _ma_up(close, window):
+    """MA 是否上拐 (今日 MA > 昨日 MA)，等价于 close[t] > close[t - window]"""
+    valid = np.cumsum(~np.isnan(close), axis=1)
+    out = np.zeros(close.shape, dtype=bool)
+    out[:, window:] = (close[:, window:] > close[:, :-window]) & (valid[:, window:] > window)
+    return out
+
+# 信号名 -> 信号矩阵 (右对齐压缩后的 close 矩阵 -> 同形状布尔矩阵，True 表示当日收盘后出现信号)
+# 在压缩序列上计算，与逐标的按自身 K 线计算指标的结果一致 (停牌日不参与 EMA 递推)
+SIGNAL_MATRICES = {
+    'macd_golden_cross': lambda close: calculators.calculate_macd_panel(close)['golden_cross'],
+    'macd_zero_cross': lambda close: calculators.calculate_macd_panel(close)['zero_golden_cross'],
+    'ma5_up': lambda close: _ma_up(close, 5),
+    'ma10_up': lambda close: _ma_up(close, 10),
+    'ma20_up': lambda close: _ma_up(close, 20),
+}
+
+def signal_matrix(signal, close):
+    """signal 为信号名或可调用对象 (压缩后的 close 矩阵 -> 布尔矩阵)"""
+    if callable(signal):
+        return np.asarray(signal(close), dtype=bool)
+    if signal not in SIGNAL_MATRICES:
+        raise ValueError(f"未知信号: {signal}")
+    return SIGNAL_MATRICES[signal](close)
+
+def is_st(name: str):
+    """按简称判定 ST / *ST"""
+    return 'ST' in str(name).upper()
+
+def limit_ratios(codes, days: np.ndarray, st=None):
+    """
+    各 (标的, 交易日) 的涨跌幅限制比例，days 为与之同形的 datetime64[D] 矩阵
+    按板块取值，创业板在 CHINEXT_REFORM 之前为 10%；st 为各标的是否 ST 的布尔数组，10% 限制的 ST 标的为 5%
+    """
+    boards = [classify_market(code)[1] for code in codes]
+    ratio = np.repeat(np.array([LIMIT_RATIOS.get(b, 0.10) for b in boards])[:, None], days.shape[1], axis=1)
+    chinext = np.array([b == 'chinext' for b in boards], dtype=bool)[:, None]
+    ratio[chinext & (days < CHINEXT_REFORM)] = 0.10
+    if st is not None:
+        ratio[np.asarray(st, dtype=bool)[:, None] & (ratio == 0.10)] = ST_RATIO
+    return ratio
+
+def _next_ok(ok: np.ndarray):
+    """每个位置起第一个 ok 为真的位置 (含自身)，之后没有时为 -1；沿时间轴倒序递推"""
+    n, t = ok.shape
+    out = np.full((n, t), -1, dtype=np.int64)
+    nxt = np.full(n, -1, dtype=np.int64)
+    for j in range(t - 1, -1, -1):
+        nxt = np.where(ok[:, j], j, nxt)
+        out[:, j] = nxt
+    return out
+
+def backtest_panel(codes, dates, prices: dict, signal, hold=5, horizons=HORIZONS, cost=True, st=None):
+    """
+    单个 (标的 × 交易日) 矩阵上的回测
+    prices 为 {'开盘','收盘','最高','最低'} -> 矩阵 (停牌为 NaN)；st 为各标的是否 ST 的布尔数组 (可选)
+    返回 dict:
+      trades: 成交明细 DataFrame (代码、信号日、买入日、卖出日、买卖价、收益)
+      forward: {horizon: 各信号的前向收益数组} (买入开盘价 -> horizon 日收盘价)
+      daily_pnl / daily_weight: 按交易日汇总的持仓收益与持仓数量 (pd.Series，便于跨分片合并)
+      signals / skipped: 信号总数与因涨停无法买入的数量
+    """
+    close = prices['收盘']
+
+    # 1. 压缩为各标的自身的有效 K 线序列，信号在压缩序列上计算
+    c, cols = panel.right_align(close)
+    rows_idx = np.arange(close.shape[0])[:, None]
+    safe_cols = np.maximum(cols, 0)
+    valid = cols >= 0
+    o = np.where(valid, prices['开盘'][rows_idx, safe_cols], np.nan)
+    low = np.where(valid, prices['最低'][rows_idx, safe_cols], np.nan)
+    high = np.where(valid, prices['最高'][rows_idx, safe_cols], np.nan)
+    s = signal_matrix(signal, c) & valid
+    n, length = c.shape
+
+    prev = np.full_like(c, np.nan)
+    prev[:, 1:] = c[:, :-1]
+    days = pd.to_datetime(np.asarray(dates)[safe_cols].ravel()).to_numpy().astype('datetime64[D]').reshape(safe_cols.shape)
+    ratio = limit_ratios(codes, days, st)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        move = c / prev - 1
+        # 一价 K 线 (一字板) 且涨跌幅达到最小限制：无论比例如何均视为封板
+        one_price = (np.abs(high - low) <= 1e-6 * np.abs(c)) & (np.abs(move) >= ST_RATIO - LIMIT_TOLERANCE)
+        open_limit_up = (o / prev - 1 >= ratio - LIMIT_TOLERANCE) | (one_price & (move > 0))
+        close_limit_down = ((move <= -ratio + LIMIT_TOLERANCE) & (low >= c - 1e-6)) | (one_price & (move < 0))
+    sellable = valid & ~close_limit_down
+    next_sellable = _next_ok(sellable)
+
+    # 2. 信号 -> 次日开盘买入
+    sig_r, sig_p = np.nonzero(s[:, :-1])
+    entry_p = sig_p + 1
+    fillable = valid[sig_r, entry_p] & ~open_limit_up[sig_r, entry_p]
+    skipped = int((~fillable).sum())
+    sig_r, sig_p, entry_p = sig_r[fillable], sig_p[fillable], entry_p[fillable]
+    entry_px = o[sig_r, entry_p]
+
+    buy_cost = COMMISSION if cost else 0.0
+    sell_cost = COMMISSION + STAMP_DUTY if cost else 0.0
+
+    def _exit_at(h):
+        # 持有 h 个交易日 (h >= 1，满足 T+1)，跌停顺延
+        target = entry_p + h
+        inside = target < length
+        exit_p = np.full(len(target), -1, dtype=np.int64)
+        exit_p[inside] = next_sellable[sig_r[inside], target[inside]]
+        return exit_p
+
+    forward = {}
+    for h in horizons:
+        exit_p = _exit_at(h)
+        done = exit_p >= 0
+        ret = np.full(len(exit_p), np.nan)
+        ret[done] = c[sig_r[done], exit_p[done]] / entry_px[done] * (1 - sell_cost) / (1 + buy_cost) - 1
+        forward[h] = ret
+
+    # 3. 主持有期的成交明细
+    exit_p = _exit_at(hold)
+    done = exit_p >= 0
+    tr, tp, te, tx = sig_r[done], sig_p[done], entry_p[done], exit_p[done]
+    exit_px = c[tr, tx]
+    trade_ret = exit_px / entry_px[done] * (1 - sell_cost) / (1 + buy_cost) - 1
+    trades = pd.DataFrame({
+        '代码': np.asarray(codes, dtype=object)[tr],
+        '信号日': dates[cols[tr, tp]],
+        '买入日': dates[cols[tr, te]],
+        '卖出日': dates[cols[tr, tx]],
+        '买入价': entry_px[done],
+        '卖出价': exit_px,
+        '收益': trade_ret,
+    })
+
+    # 4. 等权组合：按持仓数量汇总每日收益 (买入日用开盘价计，卖出日扣除成本)
+    weight = np.zeros((n, length + 1))
+    np.add.at(weight, (tr, te), 1)
+    np.add.at(weight, (tr, tx + 1), -1)
+    weight = np.cumsum(weight, axis=1)[:, :length]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        day_ret = np.nan_to_num(c / prev - 1)
+    pnl = weight * day_ret
+    entries = np.zeros((n, length))
+    np.add.at(entries, (tr, te), 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        entry_adj = np.nan_to_num(c / o - 1) - day_ret
+    pnl += entries * (entry_adj - buy_cost)
+    exits = np.zeros((n, length))
+    np.add.at(exits, (tr, tx), 1)
+    pnl -= exits * sell_cost
+
+    daily_pnl = np.zeros(len(dates))
+    daily_weight = np.zeros(len(dates))
+    vr, vp = np.nonzero(valid)
+    np.add.at(daily_pnl, cols[vr, vp], pnl[vr, vp])
+    np.add.at(daily_weight, cols[vr, vp], weight[vr, vp])
+
+    return {
+        'trades': trades,
+        'forward': forward,
+        'daily_pnl': pd.Series(daily_pnl, index=dates),
+        'daily_weight': pd.Series(daily_weight, index=dates),
+        'signals': int(s[:, :-1].sum()),
+        'skipped': skipped,
+    }
+
+def summarize(forward: dict):
+    """前向收益分布：样本数、胜率、均值与分位数"""
+    stats = {}
+    for h, ret in forward.items():
+        ret = ret[~np.isnan(ret)]
+        row = {'count': int(len(ret))}
+        if len(ret):
+            row['hit_rate'] = float((ret > 0).mean())
+            row['mean'] = float(ret.mean())
+            row.update({f'q{int(q * 100)}': float(v) for q, v in zip(QUANTILES, np.quantile(ret, QUANTILES))})
+        stats[h] = row
+    return stats
+
+def equity_curve(daily_pnl: pd.Series, daily_weight: pd.Series):
+    """等权组合的日收益与净值曲线 (无持仓日收益为 0)"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ret = (daily_pnl / daily_weight).where(daily_weight > 0, 0.0)
+    return pd.DataFrame({
+        '日期': ret.index,
+        '收益': ret.to_numpy(),
+        '净值': (1 + ret).cumprod().to_numpy(),
+        '持仓数': daily_weight.to_numpy(),
+    })
+
+def _load_prices(codes, start_date, end_date, loader=None, max_workers=16):
+    loader = loader or (lambda code: read_history(code, start_date, end_date))
+    frames = {}
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_code = {executor.submit(loader, code): code for code in codes}
+        for future in concurrent.futures.as_completed(future_to_code):
+            try:
+                df = future.result()
+            except Exception:
+                continue
+            if df is not None and not df.empty:
+                frames[future_to_code[future]] = df
+    if not frames:
+        return [], np.array([]), {}
+    prices = {}
+    for field in FIELDS:
+        names, dates, prices[field] = panel.build_price_panel(frames, field=field)
+    return names, dates, prices
+
+def _run_block(args):
+    """子进程：加载一组标的的行情并回测 (参数需可 pickle，signal 用信号名)"""
+    codes, start_date, end_date, signal, hold, horizons, cost, st_codes = args
+    names, dates, prices = _load_prices(codes, start_date, end_date)
+    if not names:
+        return None
+    st = [code in st_codes for code in names]
+    return backtest_panel(names, dates, prices, signal, hold, horizons, cost, st)
+
+def run_backtest(codes=None, start_date=None, end_date=None, signal='macd_zero_cross', hold=5, horizons=HORIZONS,
+                 cost=True, processes=None, block_size=500):
+    """
+    按标的分块、多进程并行回测，合并各分片结果；codes 缺省为注册表中的全部 A 股
+    返回 dict: trades / stats (各持有期前向收益分布) / equity (净值曲线) / signals / skipped
+    """
+    registry = get_registry()
+    codes = list(codes) if codes is not None else registry.codes()
+    # ST 状态按注册表中的当前简称判定 (在主进程中一次性完成，子进程不访问注册表)
+    st_codes = {code for code in codes if is_st((registry.get(code) or {}).get('name', ''))}
+    blocks = [codes[i:i + block_size] for i in range(0, len(codes), block_size)]
+    tasks = [(block, start_date, end_date, signal, hold, tuple(horizons), cost, st_codes & set(block))
+             for block in blocks]
+    processes = processes or min(len(blocks), os.cpu_count() or 1)
+
+    parts = []
+    if processes <= 1:
+        parts = [_run_block(task) for task in tasks]
+    else:
+        # spawn 而非 fork：调用方 (常驻 worker) 是多线程进程，fork 可能复制被其他线程持有的锁
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                    mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_run_block, task) for task in tasks]
+            for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    parts.append(future.result())
+                except Exception as e:
+                    print(f"WARNING: 回测分片执行失败: {str(e)}", file=sys.stderr)
+                print(f"PROGRESS: {int(i / len(futures) * 100)}", file=sys.stderr)
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return {'trades': pd.DataFrame(), 'stats': {}, 'equity': pd.DataFrame(), 'signals': 0, 'skipped': 0}
+
+    forward = {h: np.concatenate([p['forward'][h] for p in parts]) for h in horizons}
+    daily_pnl = pd.concat([p['daily_pnl'] for p in parts], axis=1).sum(axis=1).sort_index()
+    daily_weight = pd.concat([p['daily_weight'] for p in parts], axis=1).sum(axis=1).sort_index()
+    trades = pd.concat([p['trades'] for p in parts], ignore_index=True).sort_values(['信号日', '代码'])
+    return {
+        'trades': trades.reset_index(drop=True),
+        'stats': summarize(forward),
+        'equity': equity_curve(daily_pnl, daily_weight),
+        'signals': sum(p['signals'] for p in parts),
+        'skipped': sum(p['skipped'] for p in parts),
+    }
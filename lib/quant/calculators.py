@@ -1,27 +1,83 @@
 import pandas as pd
 import numpy as np
 
+def ema_panel(values: np.ndarray, span: int):
+    """
+    沿交易日方向 (axis=1) 对整个矩阵递推 EMA，等价于 ewm(span, adjust=False)
+    每个标的以首个有效值为种子，NaN (停牌) 处沿用前值
+    """
+    values = np.asarray(values, dtype=np.float64)
+    alpha = 2.0 / (span + 1)
+    out = np.empty_like(values)
+    ema = np.full(values.shape[0], np.nan)
+    for t in range(values.shape[1]):
+        x = values[:, t]
+        valid = ~np.isnan(x)
+        nxt = (1 - alpha) * ema + alpha * x
+        ema = np.where(valid, np.where(np.isnan(ema), x, nxt), ema)
+        out[:, t] = ema
+    return out
+
+def calculate_macd_panel(close: np.ndarray, fast=12, slow=26, signal=9):
+    """
+    批量计算整个价格矩阵 (标的 × 交易日) 的 MACD 及信号掩码
+    返回 dict:
+      diff / dea / hist: 与 close 同形状的浮点矩阵
+      golden_cross: 前一日 DIFF <= DEA 且当日 DIFF > DEA
+      below_zero: 当日 DIFF 与 DEA 均小于 0
+      zero_golden_cross: golden_cross & below_zero
+    有效 K 线数量不足 slow 的位置，所有掩码均为 False
+    """
+    close = np.atleast_2d(np.asarray(close, dtype=np.float64))
+    diff = ema_panel(close, fast) - ema_panel(close, slow)
+    dea = ema_panel(diff, signal)
+    hist = diff - dea
+
+    enough = np.cumsum(~np.isnan(close), axis=1) >= slow
+    golden_cross = np.zeros(close.shape, dtype=bool)
+    golden_cross[:, 1:] = (diff[:, :-1] <= dea[:, :-1]) & (diff[:, 1:] > dea[:, 1:])
+    golden_cross &= enough & ~np.isnan(close)
+    below_zero = (diff < 0) & (dea < 0) & enough
+
+    return {
+        'diff': diff,
+        'dea': dea,
+        'hist': hist,
+        'golden_cross': golden_cross,
+        'below_zero': below_zero,
+        'zero_golden_cross': golden_cross & below_zero
+    }
+
+def _ema(series: pd.Series, span: int):
+    # ignore_na=True 时 NaN 处沿用前值，与 ema_panel 的递推一致
+    return series.ewm(span=span, adjust=False, ignore_na=True).mean()
+
 def calculate_macd(df, fast=12, slow=26, signal=9):
     """
-    计算 MACD 指标
+    计算 MACD 指标 (单个标的用 pandas ewm；整个价格矩阵见 calculate_macd_panel，两者数值一致)
     """
     if len(df) < slow:
         return None
     
-    # 计算 EMA
-    exp1 = df['收盘'].ewm(span=fast, adjust=False).mean()
-    exp2 = df['收盘'].ewm(span=slow, adjust=False).mean()
-    
-    macd = exp1 - exp2
-    signal_line = macd.ewm(span=signal, adjust=False).mean()
-    hist = macd - signal_line
+    close = df['收盘'].astype(np.float64)
+    macd = _ema(close, fast) - _ema(close, slow)
+    signal_line = _ema(macd, signal)
     
     return pd.DataFrame({
         'macd': macd,
         'signal': signal_line,
-        'hist': hist
+        'hist': macd - signal_line
     })
 
+def _last_cross(df):
+    """最后两日的 (是否金叉, 今日 DIFF, 今日 DEA)；K 线不足慢线周期或今日无收盘价时返回 None"""
+    macd_data = calculate_macd(df)
+    if macd_data is None or np.isnan(df['收盘'].iloc[-1]):
+        return None
+    diff = macd_data['macd'].to_numpy()
+    dea = macd_data['signal'].to_numpy()
+    return diff[-2] <= dea[-2] and diff[-1] > dea[-1], diff[-1], dea[-1]
+
 def check_macd_golden_cross(df):
     """
     检查今日是否发生 MACD 金叉
@@ -30,18 +86,8 @@ def check_macd_golden_cross(df):
     if len(df) < 2:
         return False
         
-    macd_data = calculate_macd(df)
-    if macd_data is None:
-        return False
-        
-    # 获取最后两日的数据
-    curr_macd = macd_data['macd'].iloc[-1]
-    curr_signal = macd_data['signal'].iloc[-1]
-    prev_macd = macd_data['macd'].iloc[-2]
-    prev_signal = macd_data['signal'].iloc[-2]
-    
-    # 金叉判定
-    return prev_macd <= prev_signal and curr_macd > curr_signal
+    cross = _last_cross(df)
+    return bool(cross and cross[0])
 
 def check_macd_zero_golden_cross(df):
     """
@@ -54,27 +100,8 @@ def check_macd_zero_golden_cross(df):
     if len(df) < 2:
         return False
         
-    macd_data = calculate_macd(df)
-    if macd_data is None:
-        return False
-        
-    # 获取最后两日的数据
-    # diff -> macd, dea -> signal
-    curr_diff = macd_data['macd'].iloc[-1]
-    curr_dea = macd_data['signal'].iloc[-1]
-    curr_hist = macd_data['hist'].iloc[-1]
-    
-    prev_diff = macd_data['macd'].iloc[-2]
-    prev_dea = macd_data['signal'].iloc[-2]
-    prev_hist = macd_data['hist'].iloc[-2]
-    
-    # 1. 金叉判定
-    is_golden_cross = prev_diff <= prev_dea and curr_diff > curr_dea
-    
-    # 2. 零下判定
-    is_below_zero = curr_diff < 0 and curr_dea < 0
-    
-    return is_golden_cross and is_below_zero
+    cross = _last_cross(df)
+    return bool(cross and cross[0] and cross[1] < 0 and cross[2] < 0)
 
 def check_ma_trend_up(df, window=5):
     """
@@ -91,42 +118,27 @@ def check_bottom_divergence(df, window=60):
     """
     检查是否存在底背离
     底背离定义：股价创新低，但 MACD 指标未创新低（甚至回升）
-    简单逻辑：寻找最近两个波谷进行对比
+    简单逻辑：寻找最近两个波谷进行对比 (极值检测见 quant.extrema)
     """
+    from .extrema import macd_divergence
+
     if len(df) < window:
         return False
-        
+    close = df['收盘'].to_numpy(dtype=np.float64)
     macd_data = calculate_macd(df)
-    if macd_data is None:
-        return False
-        
-    macd = macd_data['macd']
-    price = df['收盘']
-    
-    # 寻找局部低点 (波谷)
-    def find_troughs(series, n=5):
-        troughs = []
-        for i in range(n, len(series) - n):
-            if all(series.iloc[i] <= series.iloc[i-j] for j in range(1, n+1)) and \
-               all(series.iloc[i] <= series.iloc[i+j] for j in range(1, n+1)):
-                troughs.append(i)
-        return troughs
+    macd = {'diff': macd_data['macd'].to_numpy()[None, :]} if macd_data is not None else None
+    return bool(macd_divergence(close, 'bottom', min_bars=window, macd=macd)[0])
+
+def check_top_divergence(df, window=60):
+    """
+    检查是否存在顶背离
+    顶背离定义：股价创新高，但 MACD 指标未创新高（甚至回落）
+    """
+    from .extrema import macd_divergence
 
-    price_troughs = find_troughs(price)
-    if len(price_troughs) < 2:
+    if len(df) < window:
         return False
-        
-    # 获取最近两个价格波谷
-    last_idx = price_troughs[-1]
-    prev_idx = price_troughs[-2]
-    
-    # 底背离条件：
-    # 1. 价格：当前波谷价格 < 前一波谷价格
-    # 2. MACD：当前波谷 MACD > 前一波谷 MACD
-    if price.iloc[last_idx] < price.iloc[prev_idx] and \
-       macd.iloc[last_idx] > macd.iloc[prev_idx]:
-        # 确保最近的波谷距离现在不要太远 (比如在最近 10 天内)
-        if (len(df) - 1 - last_idx) <= 10:
-            return True
-            
-    return False
+    close = df['收盘'].to_numpy(dtype=np.float64)
+    macd_data = calculate_macd(df)
+    macd = {'diff': macd_data['macd'].to_numpy()[None, :]} if macd_data is not None else None
+    return bool(macd_divergence(close, 'top', min_bars=window, macd=macd)[0])
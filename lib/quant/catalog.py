@@ -0,0 +1,142 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 巨潮公告元数据的本地目录 (SQLite)
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "announcements.db")
+
+# 同一标的 + 类型在该时间内同步过则不再访问网络
+SYNC_TTL = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS announcements (
+    announcement_id TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    category TEXT NOT NULL,
+    title TEXT NOT NULL,
+    ann_date TEXT NOT NULL,
+    adjunct_url TEXT NOT NULL,
+    size_kb INTEGER,
+    local_path TEXT,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ann_code_cat_date ON announcements (code, category, ann_date);
+CREATE TABLE IF NOT EXISTS sync_state (
+    code TEXT NOT NULL,
+    category TEXT NOT NULL,
+    synced_until TEXT,
+    synced_at REAL,
+    PRIMARY KEY (code, category)
+);
+"""
+
+class AnnouncementCatalog:
+    """
+    按标的存储公告元数据 (标题、日期、类型、下载地址、大小、本地路径与哈希)，
+    年份/类型查询只走本地索引
+    """
+    def __init__(self, path: str = None):
+        self.path = path or CATALOG_PATH
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    # ---------- 同步状态 ----------
+    def sync_state(self, code: str, category: str):
+        """返回 (synced_until, synced_at)，从未同步时为 (None, 0)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT synced_until, synced_at FROM sync_state WHERE code = ? AND category = ?",
+                (code, category)
+            ).fetchone()
+        return (row['synced_until'], row['synced_at']) if row else (None, 0.0)
+
+    def needs_sync(self, code: str, category: str, ttl: float = SYNC_TTL):
+        _, synced_at = self.sync_state(code, category)
+        return time.time() - synced_at >= ttl
+
+    def mark_synced(self, code: str, category: str, synced_until: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (code, category, synced_until, synced_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (code, category) DO UPDATE SET "
+                "synced_until = MAX(COALESCE(synced_until, ''), excluded.synced_until), synced_at = excluded.synced_at",
+                (code, category, synced_until, time.time())
+            )
+
+    # ---------- 写入 ----------
+    def upsert(self, rows):
+        """
+        写入公告元数据，rows 为 dict 列表 (announcement_id, code, category, title, ann_date, adjunct_url, size_kb)
+        已存在的记录保留本地路径与哈希
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO announcements (announcement_id, code, category, title, ann_date, adjunct_url, size_kb) "
+                "VALUES (:announcement_id, :code, :category, :title, :ann_date, :adjunct_url, :size_kb) "
+                "ON CONFLICT (announcement_id) DO UPDATE SET "
+                "title = excluded.title, ann_date = excluded.ann_date, "
+                "adjunct_url = excluded.adjunct_url, size_kb = excluded.size_kb",
+                rows
+            )
+
+    def record_download(self, announcement_id: str, local_path: str, sha256: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE announcements SET local_path = ?, sha256 = ? WHERE announcement_id = ?",
+                (local_path, sha256, announcement_id)
+            )
+
+    # ---------- 查询 ----------
+    def find_report(self, code: str, category: str, year, exclude_keys=()):
+        """
+        查找某年度的定期报告：标题含年份、发布日期在 [year-01-01, year+1-06-30] 内，
+        排除摘要/英文版等，返回最新发布的一条 (dict) 或 None
+        """
+        year = int(year)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM announcements WHERE code = ? AND category = ? AND ann_date BETWEEN ? AND ? "
+                "AND title LIKE ? ORDER BY ann_date DESC",
+                (code, category, f"{year}-01-01", f"{year + 1}-06-30", f"%{year}%")
+            ).fetchall()
+        for row in rows:
+            if not any(k in row['title'] for k in exclude_keys):
+                return dict(row)
+        return None
+
+    def list_reports(self, code: str, category: str = None):
+        with self._lock:
+            if category:
+                rows = self._conn.execute(
+                    "SELECT * FROM announcements WHERE code = ? AND category = ? ORDER BY ann_date DESC",
+                    (code, category)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM announcements WHERE code = ? ORDER BY ann_date DESC", (code,)
+                ).fetchall()
+        return [dict(r) for r in rows]
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+_catalog = None
+_catalog_guard = threading.Lock()
+
+def get_catalog():
+    """进程内单例"""
+    global _catalog
+    with _catalog_guard:
+        if _catalog is None:
+            _catalog = AnnouncementCatalog()
+        return _catalog
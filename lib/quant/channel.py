@@ -0,0 +1,212 @@
+import io
+import os
+import sys
+import json
+import math
+import struct
+import threading
+import contextvars
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # 可选依赖
+    pa = None
+
+# 结果通道
+#
+# 调用方 (Tauri) 通过环境变量 CRANEPOINT_RESULT_FD 传入一个已打开的管道 fd 时，
+# 结果、进度与日志以长度前缀的二进制帧写入该 fd，不再与 stderr 上的日志混在一起：
+#   帧头 8 字节: >I 负载长度 | B 帧类型 | B 负载编码 | H 任务 id 长度，其后依次为任务 id (UTF-8) 与负载
+# 任务 id 取自 current_job (常驻 worker 在每个任务的上下文中设置，非 worker 调用时为空)，
+# 并发任务共用同一个管道时调用方据此区分各帧的归属。
+# 未设置时退回原有的行协议 (stderr 上的 PROGRESS:/INFO:/SUCCESS:/RESULT: 前缀行，由 worker 按上下文归属)。
+RESULT_FD_ENV = "CRANEPOINT_RESULT_FD"
+
+FRAME_LOG = 1
+FRAME_PROGRESS = 2
+FRAME_RESULT = 3
+FRAME_ITEM = 4      # 批量模式中单个标的的结果
+FRAME_TABLE = 5     # 表格数据 (行情、筛选结果等)
+FRAME_ERROR = 6
+
+ENC_UTF8 = 0        # 纯文本
+ENC_JSON = 1
+ENC_MSGPACK = 2
+ENC_ARROW = 3       # Arrow IPC stream
+
+HEADER = struct.Struct(">IBBH")
+
+# 当前任务 id；经 quant.ContextThreadPoolExecutor 提交的线程同样继承
+current_job = contextvars.ContextVar('current_job', default=None)
+
+def to_plain(obj):
+    """
+    一次遍历把 numpy / pandas 对象转换为 JSON 原生类型 (NaN / Inf 记为 None)，
+    之后的编码走 json 的 C 实现，不再逐对象回调
+    """
+    if isinstance(obj, dict):
+        return {str(k): to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, (str, int, bool)) or obj is None:
+        return obj
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj) if np.isfinite(obj) else None
+    if isinstance(obj, np.ndarray):
+        return to_plain(obj.tolist())
+    if isinstance(obj, pd.DataFrame):
+        return to_plain(obj.to_dict(orient='records'))
+    if isinstance(obj, pd.Series):
+        return to_plain(obj.to_dict())
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (datetime, date, pd.Timestamp)):
+        return obj.isoformat()
+    if isinstance(obj, np.datetime64):
+        return to_plain(pd.Timestamp(obj))
+    if hasattr(obj, 'to_dict'):
+        return to_plain(obj.to_dict())
+    return str(obj)
+
+class Payload:
+    """
+    只序列化一次的结果：归档文件与结果通道共用同一份 JSON 字节
+    """
+    def __init__(self, obj):
+        self.plain = to_plain(obj)
+        self.json_bytes = json.dumps(self.plain, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    @property
+    def text(self):
+        return self.json_bytes.decode('utf-8')
+
+    def write_to(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.json_bytes)
+
+def encode_table(frame: pd.DataFrame):
+    """表格数据的紧凑编码：优先 Arrow IPC，其次 msgpack 列式，最后 JSON 列式；返回 (编码, 字节)"""
+    if pa is not None:
+        sink = io.BytesIO()
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return ENC_ARROW, sink.getvalue()
+    columns = {str(name): to_plain(frame[name].tolist()) for name in frame.columns}
+    if msgpack is not None:
+        return ENC_MSGPACK, msgpack.packb({"rows": len(frame), "columns": columns}, use_bin_type=True)
+    return ENC_JSON, json.dumps({"rows": len(frame), "columns": columns},
+                                ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class FrameChannel:
+    """长度前缀的二进制帧通道，多线程写入安全；每帧带上写入方所属任务的 id"""
+    binary = True
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def send(self, frame_type: int, payload: bytes, encoding: int = ENC_JSON):
+        job = (current_job.get() or '').encode('utf-8')
+        with self._lock:
+            self._stream.write(HEADER.pack(len(payload), frame_type, encoding, len(job)))
+            self._stream.write(job)
+            self._stream.write(payload)
+            self._stream.flush()
+
+    def log(self, level: str, message: str):
+        self.send(FRAME_LOG, f"{level}: {message}".encode('utf-8'), ENC_UTF8)
+
+    def progress(self, percent: int):
+        self.send(FRAME_PROGRESS, str(int(percent)).encode('utf-8'), ENC_UTF8)
+
+    def result(self, payload: Payload):
+        self.send(FRAME_RESULT, payload.json_bytes)
+
+    def item(self, payload: Payload):
+        self.send(FRAME_ITEM, payload.json_bytes)
+
+    def table(self, rows):
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(to_plain(list(rows)))
+        encoding, data = encode_table(frame)
+        self.send(FRAME_TABLE, data, encoding)
+
+    def error(self, message: str):
+        self.send(FRAME_ERROR, message.encode('utf-8'), ENC_UTF8)
+
+class LineChannel:
+    """原有的 stderr 前缀行协议"""
+    binary = False
+
+    def _print(self, line):
+        print(line, file=sys.stderr, flush=True)
+
+    def log(self, level: str, message: str):
+        self._print(f"{level}: {message}")
+
+    def progress(self, percent: int):
+        self._print(f"PROGRESS: {int(percent)}")
+
+    def result(self, payload: Payload):
+        self._print(f"SUCCESS: {payload.text}")
+
+    def item(self, payload: Payload):
+        self._print(f"RESULT: {payload.text}")
+
+    def table(self, rows):
+        self.result(Payload(rows))
+
+    def error(self, message: str):
+        self._print(f"ERROR: {message}")
+
+_channel = None
+_channel_guard = threading.Lock()
+
+def get_channel():
+    """按环境变量选择结果通道 (进程内单例)"""
+    global _channel
+    with _channel_guard:
+        if _channel is None:
+            fd = os.environ.get(RESULT_FD_ENV)
+            if fd:
+                _channel = FrameChannel(os.fdopen(int(fd), 'wb', buffering=0, closefd=False))
+            else:
+                _channel = LineChannel()
+        return _channel
+
+def read_frames(stream):
+    """
+    读取二进制帧 (供 Python 侧调用方与调试使用)，逐个产出 (帧类型, 编码, 解码后的数据, 任务 id)
+    不属于任何任务的帧任务 id 为 None
+    """
+    while True:
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        length, frame_type, encoding, job_length = HEADER.unpack(header)
+        job = stream.read(job_length).decode('utf-8') or None
+        data = stream.read(length)
+        if encoding == ENC_JSON:
+            data = json.loads(data)
+        elif encoding == ENC_MSGPACK:
+            data = msgpack.unpackb(data, raw=False)
+        elif encoding == ENC_ARROW:
+            data = pa.ipc.open_stream(data).read_pandas()
+        else:
+            data = data.decode('utf-8')
+        yield frame_type, encoding, data, job
@@ -0,0 +1,187 @@
+import sys
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .panel import build_price_panel
+from .pipeline import ContextThreadPoolExecutor
+from .store import read_history
+from .industry import get_industry_history
+from .history import get_index_history
+from .symbols import get_registry
+from .trade_calendar import get_calendar
+
+# 基准指数：上证指数、沪深300
+BENCHMARKS = ("000001", "000300")
+WINDOWS = (20, 60, 150)
+TRADING_DAYS = 252
+
+def log_return_panel(close: np.ndarray):
+    """价格矩阵 -> 对数收益率矩阵 (float32)，首列及缺失处为 NaN；停牌后复牌首日按跨期收益计算"""
+    close = np.asarray(close, dtype=np.float64)
+    filled = pd.DataFrame(close.T).ffill().to_numpy().T
+    prev = np.empty_like(filled)
+    prev[:, 0] = np.nan
+    prev[:, 1:] = filled[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.log(close / prev)
+    return ret.astype(np.float32)
+
+def _demean(values: np.ndarray):
+    """按行减去有效值均值 (提高 float32 下矩阵求和的数值精度)，返回 (去均值后填 0 的矩阵, 有效掩码)"""
+    mask = ~np.isnan(values)
+    counts = mask.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, np.nansum(values, axis=1, keepdims=True) / np.maximum(counts, 1), 0)
+    centered = np.where(mask, values - mean, 0).astype(np.float32)
+    return centered, mask.astype(np.float32)
+
+def cross_beta(stock_ret: np.ndarray, bench_ret: np.ndarray, min_obs: int = 10, block: int = 1024):
+    """
+    分块矩阵运算计算每只股票 (N 行) 对每个基准 (K 行) 的相关系数、Beta 与残差波动率
+    两个矩阵需在同一组交易日上对齐 (列相同)，缺失值按成对有效样本处理
+    返回 dict: corr / beta / resid_vol / n_obs，形状均为 N × K
+    """
+    y, my = _demean(np.asarray(bench_ret, dtype=np.float32))
+    y2 = y * y
+    n_stocks, n_bench = stock_ret.shape[0], y.shape[0]
+    out = {key: np.full((n_stocks, n_bench), np.nan, dtype=np.float32) for key in ('corr', 'beta', 'resid_vol')}
+    out['n_obs'] = np.zeros((n_stocks, n_bench), dtype=np.int32)
+
+    for start in range(0, n_stocks, block):
+        stop = min(start + block, n_stocks)
+        x, mx = _demean(np.asarray(stock_ret[start:stop], dtype=np.float32))
+
+        # 成对有效样本的各阶矩：均为 (块大小 × K) 的矩阵乘法
+        n = mx @ my.T
+        sx = x @ my.T
+        sy = mx @ y.T
+        sxx = (x * x) @ my.T
+        syy = mx @ y2.T
+        sxy = x @ y.T
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = (sxy - sx * sy / n) / (n - 1)
+            var_x = (sxx - sx * sx / n) / (n - 1)
+            var_y = (syy - sy * sy / n) / (n - 1)
+            corr = cov / np.sqrt(var_x * var_y)
+            beta = cov / var_y
+            resid_var = np.maximum(var_x * (1 - corr * corr), 0)
+            resid_vol = np.sqrt(resid_var * TRADING_DAYS)
+
+        valid = n >= min_obs
+        out['corr'][start:stop] = np.where(valid, corr, np.nan)
+        out['beta'][start:stop] = np.where(valid, beta, np.nan)
+        out['resid_vol'][start:stop] = np.where(valid, resid_vol, np.nan)
+        out['n_obs'][start:stop] = n.astype(np.int32)
+    return out
+
+def rolling_pair_beta(stock_ret: np.ndarray, bench_ret: np.ndarray, window: int, min_obs: int = None):
+    """
+    逐行配对 (第 i 只股票对应 bench_ret 第 i 行) 的滚动相关系数 / Beta / 残差波动率时间序列
+    基于累计和的滚动矩，O(N × T)；返回 dict，形状均为 N × T
+    """
+    x = np.asarray(stock_ret, dtype=np.float64)
+    y = np.asarray(bench_ret, dtype=np.float64)
+    mask = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(mask, x, 0.0)
+    y = np.where(mask, y, 0.0)
+    min_obs = min_obs or max(10, window // 2)
+
+    def _rolling_sum(values):
+        csum = np.cumsum(values, axis=1)
+        out = csum.copy()
+        out[:, window:] = csum[:, window:] - csum[:, :-window]
+        return out
+
+    n = _rolling_sum(mask.astype(np.float64))
+    sx, sy = _rolling_sum(x), _rolling_sum(y)
+    sxx, syy, sxy = _rolling_sum(x * x), _rolling_sum(y * y), _rolling_sum(x * y)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = (sxy - sx * sy / n) / (n - 1)
+        var_x = (sxx - sx * sx / n) / (n - 1)
+        var_y = (syy - sy * sy / n) / (n - 1)
+        corr = cov / np.sqrt(var_x * var_y)
+        beta = cov / var_y
+        resid_vol = np.sqrt(np.maximum(var_x * (1 - corr * corr), 0) * TRADING_DAYS)
+
+    valid = n >= min_obs
+    return {
+        'corr': np.where(valid, corr, np.nan).astype(np.float32),
+        'beta': np.where(valid, beta, np.nan).astype(np.float32),
+        'resid_vol': np.where(valid, resid_vol, np.nan).astype(np.float32)
+    }
+
+def _load_frames(loader, keys, max_workers=16):
+    frames = {}
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_key = {executor.submit(loader, key): key for key in keys}
+        for future in concurrent.futures.as_completed(future_to_key):
+            try:
+                df = future.result()
+                if df is not None and not df.empty:
+                    frames[future_to_key[future]] = df
+            except Exception:
+                continue
+    return frames
+
+def market_correlation_table(codes=None, windows=WINDOWS, benchmarks=BENCHMARKS, max_workers=16):
+    """
+    全市场个股 vs 所属行业 / 基准指数 的相关系数、Beta、残差波动率 (各窗口取最近 window 个交易日)
+    codes 缺省为注册表中的全部 A 股；返回 DataFrame，每只股票一行
+    """
+    registry = get_registry()
+    registry.refresh_industries()
+    if codes is None:
+        codes = registry.codes()
+
+    end_date = datetime.now().strftime("%Y%m%d")
+    # 最长窗口的收益率需要多一个交易日的收盘价
+    start_date = pd.Timestamp(get_calendar().start_for(max(windows) + 1)).strftime("%Y%m%d")
+
+    # 1. 行情数据：个股来自本地 K 线仓库，行业与指数各只下载一次
+    print(f"INFO: 正在加载 {len(codes)} 只个股行情...", file=sys.stderr)
+    stock_frames = _load_frames(lambda c: read_history(c, start_date, end_date), codes, max_workers)
+    industry_of = {c: registry.industry(c, fetch=False) for c in stock_frames}
+    industries = sorted({ind for ind in industry_of.values() if ind})
+    print(f"INFO: 正在加载 {len(industries)} 个行业指数与基准指数...", file=sys.stderr)
+    industry_frames = _load_frames(get_industry_history, industries, max_workers)
+    index_frames = _load_frames(lambda s: get_index_history(s, start_date, end_date), benchmarks, max_workers)
+
+    # 2. 对齐到同一组交易日 (以个股交易日为准)
+    stock_codes, dates, stock_close = build_price_panel(stock_frames)
+    if not stock_codes:
+        return pd.DataFrame()
+    ind_names, ind_dates, ind_close = build_price_panel(industry_frames)
+    idx_names, idx_dates, idx_close = build_price_panel(index_frames, field='close', date_col='date')
+
+    def _align(src_dates, src_close):
+        aligned = np.full((src_close.shape[0], len(dates)), np.nan)
+        if len(src_dates):
+            pos = np.searchsorted(src_dates, dates)
+            pos = np.clip(pos, 0, len(src_dates) - 1)
+            hit = src_dates[pos] == dates
+            aligned[:, hit] = src_close[:, pos[hit]]
+        return aligned
+
+    stock_ret = log_return_panel(stock_close)
+    bench_close = np.vstack([_align(ind_dates, ind_close), _align(idx_dates, idx_close)])
+    bench_ret = log_return_panel(bench_close)
+    bench_names = list(ind_names) + [f"idx_{s}" for s in idx_names]
+
+    # 3. 各窗口：分块矩阵运算得到 N × K 结果，再按所属行业取出对应列
+    ind_col = np.array([ind_names.index(industry_of[c]) if industry_of.get(c) in ind_names else -1
+                        for c in stock_codes])
+    rows = np.arange(len(stock_codes))
+    table = pd.DataFrame({'代码': stock_codes, '行业': [industry_of.get(c) or '' for c in stock_codes]})
+    for window in windows:
+        stats = cross_beta(stock_ret[:, -window:], bench_ret[:, -window:], min_obs=max(10, window // 2))
+        for key in ('corr', 'beta', 'resid_vol'):
+            picked = stats[key][rows, np.maximum(ind_col, 0)]
+            table[f'ind_{key}_{window}'] = np.where(ind_col >= 0, picked, np.nan)
+            for s in idx_names:
+                table[f'{s}_{key}_{window}'] = stats[key][:, bench_names.index(f"idx_{s}")]
+    return table.sort_values('代码').reset_index(drop=True)
@@ -0,0 +1,329 @@
+import re
+import sys
+import time
+import random
+import threading
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from . import net
+from .symbols import classify_market
+
+# 盘口深度采样器
+#
+# 后台线程按固定间隔批量拉取自选股的五档委买委卖 (新浪行情接口，一次请求最多 BATCH_SIZE 只，
+# 共享连接池与 quant.net 的限速 / 重试 / 熔断)，写入按标的预分配的环形缓冲区：
+#   ts (标的 × 容量)、book (标的 × 容量 × 20：买一~买五、卖一~卖五的 价 / 量)、
+#   metrics (指标 × 标的 × 容量：价差 bps、深度失衡、盘口一档深度、买 / 卖五档深度)
+# 各指标的滑动和与平方和随写入增量更新 (移出最旧样本、加入新样本)，缓冲区写满后内存不再增长。
+# 行情时间未变化 (午间休市、停牌) 的样本不写入，避免重复样本稀释统计。
+QUOTE_URL = "http://hq.sinajs.cn/list={symbols}"
+QUOTE_HEADERS = {"Referer": "https://finance.sina.com.cn"}
+BATCH_SIZE = 200
+INTERVAL = 3.0
+# 默认保留约 1 小时的样本 (3 秒一次)
+CAPACITY = 1200
+FETCH_WORKERS = 4
+LEVELS = 5
+# 新浪行情字段中五档的起始位置：买一量, 买一价, ..., 买五价, 卖一量, 卖一价, ..., 卖五价
+BOOK_START = 10
+BOOK_END = BOOK_START + 4 * LEVELS
+
+METRICS = ('spread_bps', 'imbalance', 'touch_depth', 'bid_depth', 'ask_depth')
+# 每 RESYNC_EVERY 次写入后由缓冲区重算滑动和，抵消加减累积的浮点误差
+RESYNC_EVERY = 1000
+# 样本数不足时 analyze_liquidity 回退为单次快照
+MIN_SAMPLES = 20
+# 买卖五档总挂单量 (股) 超过该值视为充裕，与单次快照的评分口径一致
+DEPTH_THRESHOLD = 20000
+
+_QUOTE_LINE = re.compile(r'hq_str_(\w+)="([^"]*)"')
+
+def sina_symbol(symbol: str):
+    """600000 -> sh600000"""
+    market, _ = classify_market(symbol)
+    return f"{market or 'sh'}{symbol}"
+
+def parse_quotes(text: str):
+    """
+    新浪行情文本 -> (代码列表, 五档矩阵 (k × 20，价与量交替)，行情时间列表)
+    字段不全 (停牌、代码无效) 的行跳过
+    """
+    codes, rows, stamps = [], [], []
+    for key, body in _QUOTE_LINE.findall(text):
+        fields = body.split(',')
+        if len(fields) < BOOK_END + 2:
+            continue
+        codes.append(key[-6:])
+        rows.append(fields[BOOK_START:BOOK_END])
+        stamps.append(f"{fields[BOOK_END]} {fields[BOOK_END + 1]}")
+    if not rows:
+        return [], np.empty((0, 4 * LEVELS)), []
+    book = pd.DataFrame(rows).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    return codes, book, stamps
+
+def book_metrics(book: np.ndarray):
+    """
+    五档矩阵 (k × 20) -> 指标矩阵 (len(METRICS) × k)
+    价差以中间价计 (bps)；失衡为 (买深度 - 卖深度) / (买深度 + 卖深度)；单边无挂单 (涨跌停) 时价差为 NaN
+    """
+    bid_vol = book[:, 0:2 * LEVELS:2]
+    bid_px = book[:, 1:2 * LEVELS:2]
+    ask_vol = book[:, 2 * LEVELS::2]
+    ask_px = book[:, 2 * LEVELS + 1::2]
+    bid_depth = np.nansum(bid_vol, axis=1)
+    ask_depth = np.nansum(ask_vol, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mid = (bid_px[:, 0] + ask_px[:, 0]) / 2
+        two_sided = (bid_px[:, 0] > 0) & (ask_px[:, 0] > 0)
+        spread = np.where(two_sided, (ask_px[:, 0] - bid_px[:, 0]) / mid * 1e4, np.nan)
+        total = bid_depth + ask_depth
+        imbalance = np.where(total > 0, (bid_depth - ask_depth) / total, np.nan)
+    touch = np.nan_to_num(bid_vol[:, 0]) + np.nan_to_num(ask_vol[:, 0])
+    return np.vstack([spread, imbalance, touch, bid_depth, ask_depth])
+
+class DepthSampler:
+    """
+    自选股盘口采样器：start() 启动后台线程，stop() 停止；stats() 返回各标的的滑动统计
+    capacity 为每只标的保留的样本数，内存在构造时一次分配
+    """
+    def __init__(self, symbols, interval: float = INTERVAL, capacity: int = CAPACITY,
+                 url: str = QUOTE_URL, batch_size: int = BATCH_SIZE, workers: int = FETCH_WORKERS):
+        self.symbols = list(dict.fromkeys(str(s) for s in symbols))
+        self.interval = float(interval)
+        self.capacity = int(capacity)
+        self.url = url
+        self.batch_size = batch_size
+        self.workers = workers
+        self.host = net.host_of(url.format(symbols=''))
+        self._session = net.make_session(pool_size=workers * 2, headers=QUOTE_HEADERS)
+        self._row = {s: i for i, s in enumerate(self.symbols)}
+
+        n, cap = len(self.symbols), self.capacity
+        self._ts = np.full((n, cap), np.nan)
+        self._book = np.full((n, cap, 4 * LEVELS), np.nan, dtype=np.float32)
+        self._metrics = np.full((len(METRICS), n, cap), np.nan)
+        self._sums = np.zeros((len(METRICS), n))
+        self._squares = np.zeros((len(METRICS), n))
+        self._counts = np.zeros((len(METRICS), n), dtype=np.int64)
+        self._written = np.zeros(n, dtype=np.int64)
+        self._stamps = np.full(n, '', dtype=object)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.failures = 0
+        self.rounds = 0
+
+    def _fetch_batch(self, batch):
+        url = self.url.format(symbols=','.join(sina_symbol(s) for s in batch))
+        response = net.request('GET', url, session=self._session, host=self.host, timeout=10)
+        response.encoding = 'gbk'
+        return response.text
+
+    def sample_once(self):
+        """拉取一轮全部标的并写入缓冲区，返回写入的样本数"""
+        batches = [self.symbols[i:i + self.batch_size] for i in range(0, len(self.symbols), self.batch_size)]
+        written = 0
+        now = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, len(batches) or 1)) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(self._fetch_batch, b) for b in batches]):
+                try:
+                    codes, book, stamps = parse_quotes(future.result())
+                except Exception as e:
+                    self.failures += 1
+                    print(f"WARNING: 盘口采样失败: {str(e)}", file=sys.stderr)
+                    continue
+                written += self.write(codes, book, stamps, now)
+        self.rounds += 1
+        return written
+
+    def write(self, codes, book: np.ndarray, stamps, ts: float = None):
+        """把一批五档快照写入环形缓冲区 (行情时间未变化的跳过)，返回写入的样本数"""
+        ts = time.time() if ts is None else ts
+        rows = np.array([self._row.get(c, -1) for c in codes], dtype=np.int64)
+        stamps = np.asarray(stamps, dtype=object)
+        with self._lock:
+            fresh = (rows >= 0) & (stamps != self._stamps[np.maximum(rows, 0)])
+            rows, book, stamps = rows[fresh], book[fresh], stamps[fresh]
+            if len(rows) == 0:
+                return 0
+            # 同一批次中的重复代码只保留第一条
+            rows, first = np.unique(rows, return_index=True)
+            book, stamps = book[first], stamps[first]
+
+            pos = self._written[rows] % self.capacity
+            # 缓冲区未写满时被覆盖的位置仍是初始的 NaN，不影响滑动和
+            old = self._metrics[:, rows, pos]
+            new = book_metrics(book)
+
+            self._sums[:, rows] += np.nan_to_num(new) - np.nan_to_num(old)
+            self._squares[:, rows] += np.nan_to_num(new) ** 2 - np.nan_to_num(old) ** 2
+            self._counts[:, rows] += (~np.isnan(new)).astype(np.int64) - (~np.isnan(old)).astype(np.int64)
+            self._metrics[:, rows, pos] = new
+            self._book[rows, pos] = book
+            self._ts[rows, pos] = ts
+            self._stamps[rows] = stamps
+            self._written[rows] += 1
+
+            self._writes += 1
+            if self._writes % RESYNC_EVERY == 0:
+                self._resync()
+            return len(rows)
+
+    def _resync(self):
+        self._sums = np.nansum(self._metrics, axis=2)
+        self._squares = np.nansum(self._metrics ** 2, axis=2)
+        self._counts = (~np.isnan(self._metrics)).sum(axis=2)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sample_once()
+            except Exception as e:
+                self.failures += 1
+                print(f"WARNING: 盘口采样失败: {str(e)}", file=sys.stderr)
+            # 按固定节拍采样，首轮加入随机相位避免多个采样器同时发起请求
+            delay = self.interval - (time.monotonic() - started)
+            if self.rounds == 1:
+                delay += random.uniform(0, self.interval * 0.1)
+            self._stop.wait(max(delay, 0))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="depth-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        """各标的缓冲区内的样本数，以及各指标的均值与标准差 (DataFrame，以代码为索引)"""
+        with self._lock:
+            sums, squares, counts = self._sums.copy(), self._squares.copy(), self._counts.copy()
+            samples = np.minimum(self._written, self.capacity)
+            last_ts = np.nanmax(self._ts, axis=1, initial=-np.inf)
+        table = pd.DataFrame({'samples': samples, 'last_ts': np.where(np.isfinite(last_ts), last_ts, np.nan)},
+                             index=pd.Index(self.symbols, name='代码'))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(counts > 0, sums / counts, np.nan)
+            var = np.where(counts > 1, (squares - counts * mean * mean) / (counts - 1), np.nan)
+        for i, name in enumerate(METRICS):
+            table[f'{name}_mean'] = mean[i]
+            table[f'{name}_std'] = np.sqrt(np.maximum(var[i], 0))
+        return table
+
+    def recent(self, symbol: str, n: int = None):
+        """某只标的最近 n 个样本的五档与指标 (按时间升序的 DataFrame)"""
+        row = self._row[symbol]
+        with self._lock:
+            count = int(min(self._written[row], self.capacity))
+            n = count if n is None else min(n, count)
+            pos = (self._written[row] - n + np.arange(n)) % self.capacity
+            ts, book, metrics = self._ts[row, pos], self._book[row, pos].astype(np.float64), self._metrics[:, row, pos]
+        columns = [f'{side}_{i}_{kind}' for side in ('buy', 'sell') for i in range(1, LEVELS + 1) for kind in ('vol', 'price')]
+        frame = pd.DataFrame(book, columns=columns)
+        frame.insert(0, 'ts', ts)
+        for i, name in enumerate(METRICS):
+            frame[name] = metrics[i]
+        return frame
+
+_sampler = None
+_sampler_guard = threading.Lock()
+
+def start_sampler(symbols, **kwargs):
+    """启动进程内的默认采样器 (已有采样器时先停止)，供 analyze_liquidity 使用"""
+    global _sampler
+    with _sampler_guard:
+        if _sampler is not None:
+            _sampler.stop()
+        _sampler = DepthSampler(symbols, **kwargs).start()
+        return _sampler
+
+def get_sampler():
+    return _sampler
+
+def stop_sampler():
+    global _sampler
+    with _sampler_guard:
+        if _sampler is not None:
+            _sampler.stop()
+        _sampler = None
+
+def sampled_liquidity(symbol: str, sampler: DepthSampler = None):
+    """采样器中样本充足时返回该标的的滑动盘口统计 (与 analyze_liquidity 相同的键)，否则返回 None"""
+    sampler = sampler or _sampler
+    if sampler is None or symbol not in sampler._row:
+        return None
+    row = sampler.stats().loc[symbol]
+    if row['samples'] < MIN_SAMPLES:
+        return None
+    bid, ask = row['bid_depth_mean'], row['ask_depth_mean']
+    return {
+        "bid_depth": int(bid),
+        "ask_depth": int(ask),
+        "score": "充裕" if (bid + ask) > DEPTH_THRESHOLD else "中/低",
+        "spread_bps": round(float(row['spread_bps_mean']), 2) if not np.isnan(row['spread_bps_mean']) else None,
+        "imbalance": round(float(row['imbalance_mean']), 4) if not np.isnan(row['imbalance_mean']) else None,
+        "touch_depth": int(row['touch_depth_mean']),
+        "samples": int(row['samples'])
+    }
+
+class _FakeQuoteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlsplit(self.path).query)
+        keys = [k for k in ','.join(params.get('list', [])).split(',') if k]
+        body = ''.join(f'var hq_str_{k}="{self.server.book.quote(k)}";\n' for k in keys).encode('gbk')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/javascript; charset=GBK")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _FakeBook:
+    """随机游走的五档行情，每次请求推进一个 tick (按代码固定随机种子，结果可复现)"""
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self._state = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def quote(self, key: str):
+        with self._lock:
+            self._tick += 1
+            rng, price = self._state.get(key) or (random.Random(f"{self.seed}:{key}"), 10.0)
+            price = max(round(price * (1 + rng.gauss(0, 0.002)), 2), 0.05)
+            self._state[key] = (rng, price)
+            levels = []
+            for side in (-1, 1):
+                for i in range(1, LEVELS + 1):
+                    levels += [str(rng.randint(1, 500) * 100), f"{price + side * 0.01 * i:.2f}"]
+            tick = self._tick
+        return ",".join(["测试", f"{price:.2f}", f"{price:.2f}", f"{price:.2f}", f"{price:.2f}", f"{price:.2f}",
+                         f"{price - 0.01:.2f}", f"{price + 0.01:.2f}", "100000", "1000000"]
+                        + levels + ["2026-01-05", f"{9 + tick // 3600:02d}:{tick // 60 % 60:02d}:{tick % 60:02d}", "00"])
+
+def fake_quote_server(port: int = 0, seed: int = 0):
+    """
+    本地模拟行情服务 (新浪行情文本格式)，在后台线程运行；返回 (server, url 模板)，用完调用 server.shutdown()
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _FakeQuoteHandler)
+    server.book = _FakeBook(seed)
+    threading.Thread(target=server.serve_forever, name="fake-quotes", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/?list={{symbols}}"
@@ -0,0 +1,105 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .panel import right_align
+from .calculators import calculate_macd_panel
+
+# 局部极值 (波峰 / 波谷) 的向量化检测，用于价格与 MACD 的顶 / 底背离
+#
+# plateau 决定平台 (相邻多根 K 线取值相同) 的处理方式：
+#   'all'    平台上的每根 K 线都算极值 (与旧版 find_troughs 的 <= 判定一致)
+#   'first'  只取平台的第一根
+#   'last'   只取平台的最后一根
+#   'strict' 严格小于 / 大于两侧，平台不算极值
+PLATEAU_MODES = ('all', 'first', 'last', 'strict')
+
+def _side_extreme(values: np.ndarray, window: int, reduce):
+    """每个位置左侧 / 右侧各 window 根 K 线的极值 (不含自身)，窗口越界或含 NaN 处为 NaN"""
+    n, t = values.shape
+    left = np.full((n, t), np.nan)
+    right = np.full((n, t), np.nan)
+    if t <= window:
+        return left, right
+    windows = reduce(sliding_window_view(values, window, axis=1), axis=-1)  # windows[:, j] 覆盖 j..j+window-1
+    left[:, window:] = windows[:, :t - window]
+    right[:, :t - window] = windows[:, 1:]
+    return left, right
+
+def find_extrema(values: np.ndarray, window: int = 5, kind: str = 'trough', plateau: str = 'all'):
+    """
+    对整个矩阵 (标的 × K 线) 检测局部极值：某根 K 线不高于 (波谷) / 不低于 (波峰) 前后各 window 根
+    返回同形状布尔矩阵；首尾不足 window 根及含 NaN 的窗口不判定
+    """
+    if plateau not in PLATEAU_MODES:
+        raise ValueError(f"未知的平台处理方式: {plateau}")
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    if kind == 'trough':
+        left, right = _side_extreme(values, window, np.min)
+        lt, le = np.less, np.less_equal
+    elif kind == 'peak':
+        left, right = _side_extreme(values, window, np.max)
+        lt, le = np.greater, np.greater_equal
+    else:
+        raise ValueError(f"未知的极值类型: {kind}")
+
+    left_cmp = lt if plateau in ('strict', 'first') else le
+    right_cmp = lt if plateau in ('strict', 'last') else le
+    with np.errstate(invalid='ignore'):
+        return left_cmp(values, left) & right_cmp(values, right)
+
+def last_extrema(mask: np.ndarray, k: int = 2):
+    """
+    每行最近的 k 个极值位置 (按时间升序，最后一列为最近一个)，不足处为 -1
+    """
+    mask = np.atleast_2d(mask).copy()
+    n, t = mask.shape
+    out = np.full((n, k), -1, dtype=np.int64)
+    rows = np.arange(n)
+    for j in range(k - 1, -1, -1):
+        has = mask.any(axis=1)
+        idx = t - 1 - np.argmax(mask[:, ::-1], axis=1)
+        out[:, j] = np.where(has, idx, -1)
+        mask[rows[has], idx[has]] = False
+    return out
+
+def divergence(price: np.ndarray, indicator: np.ndarray, kind: str = 'bottom', window: int = 5,
+               recent: int = 10, plateau: str = 'all'):
+    """
+    价格与指标的背离 (两者需已右对齐且同形状)，按最近两个价格极值配对比较：
+      底背离: 价格波谷创新低，指标在对应位置抬高
+      顶背离: 价格波峰创新高，指标在对应位置走低
+    最近一个极值距最后一根 K 线不超过 recent 根时成立；返回每行一个布尔值
+    """
+    price = np.atleast_2d(np.asarray(price, dtype=np.float64))
+    indicator = np.atleast_2d(np.asarray(indicator, dtype=np.float64))
+    mask = find_extrema(price, window, 'trough' if kind == 'bottom' else 'peak', plateau)
+    pairs = last_extrema(mask, 2)
+    prev_idx, last_idx = pairs[:, 0], pairs[:, 1]
+    found = prev_idx >= 0
+
+    rows = np.arange(price.shape[0])
+    prev_i, last_i = np.maximum(prev_idx, 0), np.maximum(last_idx, 0)
+    p_prev, p_last = price[rows, prev_i], price[rows, last_i]
+    m_prev, m_last = indicator[rows, prev_i], indicator[rows, last_i]
+    with np.errstate(invalid='ignore'):
+        if kind == 'bottom':
+            diverged = (p_last < p_prev) & (m_last > m_prev)
+        else:
+            diverged = (p_last > p_prev) & (m_last < m_prev)
+    return found & diverged & (price.shape[1] - 1 - last_idx <= recent)
+
+def macd_divergence(close: np.ndarray, kind: str = 'bottom', window: int = 5, recent: int = 10,
+                    min_bars: int = 60, lookback: int = None, plateau: str = 'all', macd: dict = None):
+    """
+    全市场价格矩阵 (标的 × 交易日，停牌为 NaN) 一次性判定 MACD (DIFF) 顶 / 底背离
+    每个标的的有效 K 线先右对齐，lookback 限定只看最近若干根 (缺省为全部)；有效 K 线不足 min_bars 的判为 False
+    macd 可传入已计算好的 calculate_macd_panel 结果以复用
+    """
+    close = np.atleast_2d(np.asarray(close, dtype=np.float64))
+    if macd is None:
+        macd = calculate_macd_panel(close)
+    price, cols = right_align(close, lookback)
+    rows = np.arange(close.shape[0])[:, None]
+    diff = np.where(cols >= 0, macd['diff'][rows, np.maximum(cols, 0)], np.nan)
+    enough = (~np.isnan(close)).sum(axis=1) >= min_bars
+    return divergence(price, diff, kind, window, recent, plateau) & enough
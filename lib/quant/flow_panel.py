@@ -0,0 +1,308 @@
+import os
+import sys
+import threading
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import akshare as ak
+
+from . import net
+from .fund_flow import FLOW_FIELDS, flow_matrix, get_fund_flow
+from .pipeline import ContextThreadPoolExecutor
+from .trade_calendar import get_calendar, settle_ts
+
+# 全市场资金流向面板 (本地缓存 cache/fund_flow/panel.npz)
+#
+# 按 (交易日 × 标的) 保存超大单 / 大单 / 中单 / 小单 / 主力 的每日净流入 (万元，float32)，
+# 交易日升序、代码升序，按列名分别存为矩阵。行按交易日历对齐：首末交易日之间漏采的交易日保留为整行 NaN，
+# 滚动窗口因此按交易日而不是面板行数计算。每个交易日收盘后用一次全市场排行接口追加一行，
+# 面板不足最大窗口或近期有缺口时用个股历史 (stock_individual_fund_flow，约 100 个交易日) 自动回填。
+# 滚动 N 日合计、日增量与全市场百分位排名都在矩阵上向量化计算，
+# 结果按面板版本缓存，并为每个 (类别, 窗口) 预先排好序，"近 10 日主力净流入前 N" 只需取索引。
+PANEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "fund_flow", "panel.npz")
+
+WINDOWS = (5, 10, 20)
+# 只保留最近 MAX_DAYS 个交易日
+MAX_DAYS = 250
+
+def _rank_pct(values: np.ndarray):
+    """按列 (横截面) 计算百分位排名，NaN 不参与"""
+    return pd.DataFrame(values).rank(pct=True).to_numpy()
+
+class FlowPanel:
+    """
+    codes: 升序代码数组；dates: 升序交易日 (datetime64[D])；values: {类别: 交易日 × 标的 的 float32 矩阵}
+    """
+    def __init__(self, codes=None, dates=None, values=None):
+        self.codes = np.asarray(codes if codes is not None else [], dtype='<U6')
+        self.dates = np.asarray(dates if dates is not None else [], dtype='datetime64[D]')
+        shape = (len(self.dates), len(self.codes))
+        self.values = {f: np.asarray(values[f], dtype=np.float32) if values else np.full(shape, np.nan, dtype=np.float32)
+                       for f in FLOW_FIELDS}
+        self._aggregates = None
+
+    @property
+    def empty(self):
+        return len(self.dates) == 0 or len(self.codes) == 0
+
+    def last_date(self):
+        return self.dates[-1] if len(self.dates) else None
+
+    def merge(self, codes, dates, values):
+        """
+        合并一块数据 (values 为 {类别: len(dates) × len(codes) 矩阵})，重叠处以新数据中的非空值为准
+        代码与交易日取并集后重新对齐，只保留最近 MAX_DAYS 个交易日
+        """
+        codes = np.asarray(codes, dtype='<U6')
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        all_codes = np.union1d(self.codes, codes)
+        all_dates = np.union1d(self.dates, dates)
+        if len(all_dates):
+            # 补齐首末交易日之间缺失的交易日，使行与交易日一一对应
+            all_dates = np.union1d(all_dates, get_calendar().sessions_between(all_dates[0], all_dates[-1]))
+        all_dates = all_dates[-MAX_DAYS:]
+        old_rows = np.searchsorted(all_dates, self.dates)
+        old_keep = (old_rows < len(all_dates)) & (all_dates[np.minimum(old_rows, len(all_dates) - 1)] == self.dates) \
+            if len(all_dates) else np.zeros(len(self.dates), dtype=bool)
+        new_rows = np.searchsorted(all_dates, dates)
+        new_keep = (new_rows < len(all_dates)) & (all_dates[np.minimum(new_rows, len(all_dates) - 1)] == dates) \
+            if len(all_dates) else np.zeros(len(dates), dtype=bool)
+        old_cols = np.searchsorted(all_codes, self.codes)
+        new_cols = np.searchsorted(all_codes, codes)
+
+        merged = {}
+        for f in FLOW_FIELDS:
+            out = np.full((len(all_dates), len(all_codes)), np.nan, dtype=np.float32)
+            out[np.ix_(old_rows[old_keep], old_cols)] = self.values[f][old_keep]
+            block = np.asarray(values[f], dtype=np.float32)[new_keep]
+            target = out[np.ix_(new_rows[new_keep], new_cols)]
+            out[np.ix_(new_rows[new_keep], new_cols)] = np.where(np.isnan(block), target, block)
+            merged[f] = out
+        self.codes, self.dates, self.values = all_codes, all_dates, merged
+        self._aggregates = None
+
+    def fill_sessions(self):
+        """按交易日历补齐首末交易日之间缺失的交易日 (整行 NaN)"""
+        self.merge([], [], {f: np.empty((0, 0), dtype=np.float32) for f in FLOW_FIELDS})
+
+    def missing_sessions(self, window: int, end=None):
+        """
+        截至 end (缺省为面板最后一个交易日) 的最近 window 个交易日中面板没有任何数据的交易日
+        返回升序的 datetime64[D] 数组，为空表示该窗口完整
+        """
+        calendar = get_calendar()
+        if end is None:
+            end = self.last_date() if len(self.dates) else calendar.last_closed_session()
+        if end is None:
+            return np.array([], dtype='datetime64[D]')
+        expected = calendar.sessions_between(calendar.start_for(window, end), end)
+        has_data = np.zeros(len(self.dates), dtype=bool)
+        if len(self.codes):
+            for f in FLOW_FIELDS:
+                has_data |= ~np.isnan(self.values[f]).all(axis=1)
+        return np.setdiff1d(expected, self.dates[has_data])
+
+    def append_day(self, day, frame: pd.DataFrame):
+        """追加一个交易日的全市场数据 (frame 含 代码 列与各类别净流入额列)"""
+        codes = frame['代码'].astype(str).str.zfill(6).to_numpy()
+        matrix = flow_matrix(frame)
+        codes, first = np.unique(codes, return_index=True)
+        self.merge(codes, [np.datetime64(pd.Timestamp(day).date(), 'D')],
+                   {f: matrix[first, i][None, :] for i, f in enumerate(FLOW_FIELDS)})
+
+    def ingest_histories(self, frames: dict):
+        """合并多只股票的历史资金流向 ({代码: stock_individual_fund_flow 的返回})，拼成一块后只重排一次"""
+        frames = {code: df for code, df in frames.items() if df is not None and not df.empty}
+        if not frames:
+            return
+        codes = sorted(frames)
+        day_arrays = [pd.to_datetime(frames[c]['日期']).to_numpy().astype('datetime64[D]') for c in codes]
+        dates = np.unique(np.concatenate(day_arrays))
+        block = np.full((len(FLOW_FIELDS), len(dates), len(codes)), np.nan, dtype=np.float32)
+        for j, code in enumerate(codes):
+            block[:, np.searchsorted(dates, day_arrays[j]), j] = flow_matrix(frames[code]).T
+        self.merge(codes, dates, {f: block[i] for i, f in enumerate(FLOW_FIELDS)})
+
+    def rolling_sum(self, field: str, window: int):
+        """
+        各标的截至每个交易日的近 window 日净流入合计 (交易日 × 标的)
+        停牌日按 0 计；面板不足 window 个交易日、窗口内有漏采的交易日 (整行无数据)、
+        或该标的窗口内没有任何数据时为 NaN
+        """
+        values = self.values[field].astype(np.float64)
+        mask = ~np.isnan(values)
+        covered = np.zeros(values.shape[0] + 1, dtype=np.int64)
+        np.cumsum(mask.any(axis=1), out=covered[1:])
+        total = np.zeros((values.shape[0] + 1, values.shape[1]))
+        count = np.zeros((values.shape[0] + 1, values.shape[1]), dtype=np.int64)
+        np.cumsum(np.where(mask, values, 0.0), axis=0, out=total[1:])
+        np.cumsum(mask, axis=0, out=count[1:])
+        out = np.full(values.shape, np.nan)
+        if values.shape[0] >= window:
+            s = total[window:] - total[:-window]
+            c = count[window:] - count[:-window]
+            complete = (covered[window:] - covered[:-window]) == window
+            out[window - 1:] = np.where((c > 0) & complete[:, None], s, np.nan)
+        return out
+
+    def delta(self, field: str):
+        """日增量 (环比)：当日净流入减前一交易日，首日为 NaN"""
+        values = self.values[field].astype(np.float64)
+        out = np.full(values.shape, np.nan)
+        out[1:] = values[1:] - values[:-1]
+        return out
+
+    def aggregates(self, windows=WINDOWS):
+        """
+        最新交易日的横截面：各类别当日净流入、日增量、近 N 日合计及其百分位排名
+        返回 dict: table (DataFrame，每只标的一行) / order ({(类别, 窗口): 按合计降序的行号，NaN 在末尾})
+        同一面板版本只计算一次
+        """
+        windows = tuple(windows)
+        if self._aggregates is not None and self._aggregates[0] == windows:
+            return self._aggregates[1]
+        table = pd.DataFrame({'代码': self.codes})
+        if self.empty:
+            result = {'date': None, 'table': table, 'order': {}}
+            self._aggregates = (windows, result)
+            return result
+
+        last = {}
+        for f in FLOW_FIELDS:
+            last[f] = self.values[f][-1].astype(np.float64)
+            last[f'{f}日增量'] = self.delta(f)[-1]
+            for window in windows:
+                last[f'{f}{window}日'] = self.rolling_sum(f, window)[-1]
+        names = list(last)
+        sums = np.column_stack([last[n] for n in names])
+        # 一次性对全部列做横截面排名
+        ranks = _rank_pct(sums)
+        table = pd.concat([table, pd.DataFrame(sums, columns=names),
+                           pd.DataFrame(ranks, columns=[f'{n}_pct' for n in names])], axis=1)
+
+        order = {}
+        for f in FLOW_FIELDS:
+            for window in (1,) + windows:
+                column = last[f] if window == 1 else last[f'{f}{window}日']
+                # 降序，NaN 排在最后
+                order[(f, window)] = np.lexsort((-np.nan_to_num(column, nan=0.0), np.isnan(column)))
+        result = {'date': str(self.dates[-1]), 'table': table, 'order': order}
+        self._aggregates = (windows, result)
+        return result
+
+    def top(self, field: str = '主力', window: int = 10, n: int = 50, ascending: bool = False):
+        """
+        近 window 日 (1 为当日) 净流入合计最大 (ascending=True 时最小) 的前 n 只，返回 DataFrame
+        面板在最近 window 个交易日内有缺口时抛出 ValueError，而不是返回不完整窗口上的排行
+        """
+        missing = self.missing_sessions(window)
+        if len(missing):
+            raise ValueError(f"近 {window} 日资金流向不完整，缺少 {len(missing)} 个交易日: "
+                             f"{', '.join(str(d) for d in missing[:5])}")
+        windows = WINDOWS if window in (1,) + WINDOWS else WINDOWS + (window,)
+        agg = self.aggregates(windows)
+        order = agg['order'].get((field, window))
+        if order is None:
+            return pd.DataFrame()
+        if ascending:
+            column = field if window == 1 else f'{field}{window}日'
+            order = order[~np.isnan(agg['table'][column].to_numpy()[order])][::-1]
+        return agg['table'].iloc[order[:n]].reset_index(drop=True)
+
+def load_panel(path: str = None):
+    """读取本地面板，不存在或损坏时返回空面板"""
+    path = path or PANEL_PATH
+    if not os.path.exists(path):
+        return FlowPanel()
+    try:
+        with np.load(path) as data:
+            flow_panel = FlowPanel(data['codes'], data['dates'].astype('datetime64[D]'),
+                                   {f: data[f'v{i}'] for i, f in enumerate(FLOW_FIELDS)})
+        flow_panel.fill_sessions()
+        return flow_panel
+    except Exception as e:
+        print(f"WARNING: 读取资金流向面板失败: {str(e)}", file=sys.stderr)
+        return FlowPanel()
+
+def save_panel(flow_panel: FlowPanel, path: str = None):
+    """原子写入：先写临时文件再 rename"""
+    path = path or PANEL_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    arrays = {f'v{i}': flow_panel.values[f] for i, f in enumerate(FLOW_FIELDS)}
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, codes=flow_panel.codes, dates=flow_panel.dates, **arrays)
+    os.replace(tmp_path, path)
+
+_panel = None
+_panel_lock = threading.Lock()
+
+def get_flow_panel():
+    """进程内单例"""
+    global _panel
+    with _panel_lock:
+        if _panel is None:
+            _panel = load_panel()
+        return _panel
+
+def sync_flow_panel(now: datetime = None, backfill: bool = True):
+    """
+    收盘落定后追加最近一个交易日的全市场资金流向 (一次排行接口请求)；已追加过、或当日尚未收盘时不请求
+    backfill=True 时，若最近 max(WINDOWS) 个已落定交易日内有缺口 (新安装、漏跑) 则用个股历史自动回填
+    返回面板
+    """
+    flow_panel = get_flow_panel()
+    now = now or datetime.now()
+    calendar = get_calendar()
+    session = calendar.last_session(now)
+    closed = calendar.last_closed_session(now)
+    # 盘中排行接口返回的是未落定的数据，不写入面板
+    if session is not None and session == closed:
+        with _panel_lock:
+            if flow_panel.last_date() is None or flow_panel.last_date() < session:
+                frame = net.call('eastmoney', ak.stock_individual_fund_flow_rank, indicator="今日")
+                if frame is None or frame.empty:
+                    raise net.UpstreamError("资金流向排行返回为空")
+                flow_panel.append_day(session, frame)
+                save_panel(flow_panel)
+                print(f"INFO: 资金流向面板已追加 {session} ({len(frame)} 只)", file=sys.stderr)
+
+    if backfill and closed is not None and len(flow_panel.codes):
+        missing = flow_panel.missing_sessions(max(WINDOWS), closed)
+        if len(missing):
+            print(f"INFO: 资金流向面板近 {max(WINDOWS)} 个交易日缺少 {len(missing)} 天，"
+                  f"用个股历史回填 {len(flow_panel.codes)} 只", file=sys.stderr)
+            backfill_flow_panel(flow_panel.codes, until=closed)
+    return flow_panel
+
+def backfill_flow_panel(codes, max_workers=8, until=None):
+    """
+    用个股历史资金流向 (每只约 100 个交易日) 回填面板，全部合并后只写盘一次
+    until 之后 (尚未落定) 的行不写入面板
+    """
+    flow_panel = get_flow_panel()
+    until = np.datetime64(pd.Timestamp(until).date(), 'D') if until is not None else None
+    frames = {}
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_code = {executor.submit(get_fund_flow, code): code for code in codes}
+        for i, future in enumerate(concurrent.futures.as_completed(future_to_code), 1):
+            try:
+                df = future.result()
+                if df is not None and not df.empty:
+                    if until is not None:
+                        df = df[pd.to_datetime(df['日期']).to_numpy().astype('datetime64[D]') <= until]
+                    frames[future_to_code[future]] = df
+            except Exception:
+                pass
+            print(f"PROGRESS: {int(i / len(future_to_code) * 100)}", file=sys.stderr, flush=True)
+    with _panel_lock:
+        flow_panel.ingest_histories(frames)
+        save_panel(flow_panel)
+    return flow_panel
+
+def top_inflows(field: str = '主力', window: int = 10, n: int = 50, ascending: bool = False, sync: bool = True):
+    """全市场近 window 日净流入排行 (本地面板查询，sync=True 时先追加最新交易日)"""
+    flow_panel = sync_flow_panel() if sync else get_flow_panel()
+    return flow_panel.top(field, window, n, ascending)
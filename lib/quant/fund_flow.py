@@ -1,61 +1,73 @@
+import re
+
+import numpy as np
 import pandas as pd
 import akshare as ak
-import os
-from datetime import datetime
+
+from .response_cache import cached_call
+from .symbols import classify_market
+
+# 资金类别 (与接口列名中的前缀一致) 与单位换算 (元 -> 万元)
+FLOW_FIELDS = ('超大单', '大单', '中单', '小单', '主力')
+FLOW_UNIT = 10000
 
 def get_fund_flow(symbol: str):
     """获取个股资金流向数据"""
     # 自动识别市场
-    if symbol.startswith('6'):
-        market = "sh"
-    elif symbol.startswith('0') or symbol.startswith('3'):
-        market = "sz"
-    elif symbol.startswith('8') or symbol.startswith('4'):
-        market = "bj"
-    else:
-        market = "sh"
+    market, _ = classify_market(symbol)
+    market = market or "sh"
         
     try:
-        return ak.stock_individual_fund_flow(stock=symbol, market=market)
+        return cached_call('daily', 'eastmoney_hist', ak.stock_individual_fund_flow, stock=symbol, market=market)
     except:
         return pd.DataFrame()
 
-def analyze_flow_details(df: pd.DataFrame):
+def flow_columns(columns):
     """
-    深度分析资金流向明细：计算日增量（环比）
+    在接口返回的列名中定位各类别的净流入额列 ("主力净流入-净额"、"今日大单净流入-净额" 等)
+    按完整前缀匹配，避免 "大单" 误匹配到 "超大单"；返回 {类别: 列名}，缺失的类别不出现
     """
-    if df.empty:
+    found = {}
+    for col in columns:
+        m = re.fullmatch(r'(?:今日|\d+日)?(超大单|大单|中单|小单|主力)净流入-净额', str(col))
+        if m and m.group(1) not in found:
+            found[m.group(1)] = col
+    return found
+
+def flow_matrix(df: pd.DataFrame):
+    """接口返回的 DataFrame -> (行数 × 类别) 的净流入矩阵 (万元)，缺失列为 NaN"""
+    cols = flow_columns(df.columns)
+    values = np.full((len(df), len(FLOW_FIELDS)), np.nan)
+    present = [i for i, field in enumerate(FLOW_FIELDS) if field in cols]
+    if present:
+        block = df[[cols[FLOW_FIELDS[i]] for i in present]]
+        try:
+            raw = block.to_numpy(dtype=np.float64)
+        except (TypeError, ValueError):
+            # 含 "-" 等非数值时逐列转换
+            raw = block.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        values[:, present] = raw / FLOW_UNIT
+    return values
+
+def analyze_flow_details(df: pd.DataFrame, days: int = 5):
+    """
+    深度分析资金流向明细：近 days 个交易日的各类别净流入 (万元) 及日增量 (环比)，按日期倒序返回
+    """
+    if df is None or df.empty:
         return pd.DataFrame()
-        
-    # 筛选近一周 (5个交易日) 的明细数据
-    week_flow = df.head(5).copy()
-    
-    # 动态匹配列名 (处理不同接口可能的列名差异)
-    cols_map = {
-        '日期': '日期',
-        '超大单': [c for c in week_flow.columns if '超大单' in c and '净额' in c][0],
-        '大单': [c for c in week_flow.columns if '大单' in c and '净额' in c][0],
-        '中单': [c for c in week_flow.columns if '中单' in c and '净额' in c][0],
-        '小单': [c for c in week_flow.columns if '小单' in c and '净额' in c][0],
-        '主力': [c for c in week_flow.columns if '主力净流入' in c and '净额' in c][0]
-    }
-    
-    analysis_df = week_flow[list(cols_map.values())].copy()
-    analysis_df.columns = list(cols_map.keys())
-    
+
+    df = df.sort_values('日期')
+    values = flow_matrix(df)
+    # 环比在完整序列上计算，窗口首日的增量也有前一交易日可比
+    delta = np.zeros_like(values)
+    delta[1:] = values[1:] - values[:-1]
+    values, delta = values[-days:], np.nan_to_num(delta[-days:])
+
     # 强制将日期转换为字符串，防止 JSON 序列化失败
-    analysis_df['日期'] = analysis_df['日期'].astype(str)
-    
-    numeric_cols = ['超大单', '大单', '中单', '小单', '主力']
-    for col in numeric_cols:
-        analysis_df[col] = analysis_df[col] / 10000 # 转为万元
-        
-    # 计算每日变化量 (环比增量)
-    analysis_df = analysis_df.sort_values('日期')
-    for col in numeric_cols:
-        analysis_df[f'{col}日增量'] = analysis_df[col].diff().fillna(0)
-    
-    return analysis_df.sort_values('日期', ascending=False)
+    analysis_df = pd.DataFrame(values, columns=list(FLOW_FIELDS))
+    analysis_df.insert(0, '日期', df['日期'].astype(str).to_numpy()[-days:])
+    analysis_df[[f'{col}日增量' for col in FLOW_FIELDS]] = delta
+    return analysis_df.iloc[::-1].reset_index(drop=True)
 
 def prepare_rose_chart_data(df: pd.DataFrame):
     """
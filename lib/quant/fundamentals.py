@@ -1,13 +1,15 @@
 import akshare as ak
 import pandas as pd
 
+from .response_cache import cached_call
+
 def get_latest_profit(symbol: str):
     """
     获取最新报告期的扣非净利润
     """
     try:
         # 使用同花顺财务摘要接口
-        df = ak.stock_financial_abstract_ths(symbol=symbol, indicator="主要指标")
+        df = cached_call('financial', 'ths', ak.stock_financial_abstract_ths, symbol=symbol, indicator="主要指标")
         if df.empty:
             return "N/A", "N/A"
         
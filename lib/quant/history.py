@@ -1,25 +1,32 @@
 import akshare as ak
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 
-def get_history_detail(symbol: str, days: int = 30):
+from .response_cache import cached_call
+from .store import read_history
+from .trade_calendar import get_calendar
+
+def get_history_detail(symbol: str, days: int = 30, strict: bool = False):
     """
     获取最近 30 个交易日的详细行情
+    优先读取本地 K 线仓库，仅增量拉取最后一根 K 线之后的数据
+    strict=True 时上游失败 (且本地无数据) 抛出异常，而不是返回空表
     """
     try:
         end_date = datetime.now().strftime("%Y%m%d")
-        start_date = (datetime.now() - timedelta(days=days*2)).strftime("%Y%m%d") # 多取一点以保证有30个交易日
+        # 按交易日历精确计算最近 days 个交易日的起点
+        start_date = pd.Timestamp(get_calendar().start_for(days)).strftime("%Y%m%d")
         
-        df = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
+        df = read_history(symbol, start_date=start_date, end_date=end_date, adjust="qfq", strict=strict)
         if df.empty:
             return pd.DataFrame()
             
-        # 仅保留最近 30 行
+        # 仅保留最近 30 行 (日期已是字符串，可直接 JSON 序列化)
         df = df.tail(days).sort_values('日期', ascending=False)
-        # 强制将日期转换为字符串，防止 JSON 序列化失败
-        df['日期'] = df['日期'].astype(str)
         return df
     except Exception:
+        if strict:
+            raise
         return pd.DataFrame()
 
 def get_history_range(symbol: str, start_date: str, end_date: str, level: str = 'standard'):
@@ -30,14 +37,8 @@ def get_history_range(symbol: str, start_date: str, end_date: str, level: str =
         # 1. 基础参数：根据等级决定复权方式和字段
         adjust = "qfq" if level in ['standard', 'research'] else ""
         
-        # 2. 调用 akshare 获取基础 K 线
-        df = ak.stock_zh_a_hist(
-            symbol=symbol, 
-            period="daily", 
-            start_date=start_date, 
-            end_date=end_date, 
-            adjust=adjust
-        )
+        # 2. 从本地 K 线仓库读取，缺失部分由仓库增量补齐
+        df = read_history(symbol, start_date=start_date, end_date=end_date, adjust=adjust)
         if df.empty:
             return pd.DataFrame()
             
@@ -57,7 +58,6 @@ def get_history_range(symbol: str, start_date: str, end_date: str, level: str =
 
         # 5. 排序与格式化
         df = df.sort_values('日期', ascending=False)
-        df['日期'] = df['日期'].astype(str)
         
         # 剔除停牌日（成交量为 0 且价格无波动的通常视为停牌）
         df = df[df['成交量'] > 0]
@@ -74,7 +74,7 @@ def get_index_history(symbol: str, start_date: str, end_date: str):
     try:
         # 指数代码转换：上证 000001 -> sh000001, 沪深300 000300 -> sh000300
         # ak.stock_zh_index_daily_em 获取指数
-        df = ak.stock_zh_index_daily_em(symbol=f"sh{symbol}")
+        df = cached_call('daily', 'eastmoney_hist', ak.stock_zh_index_daily_em, symbol=f"sh{symbol}")
         if df.empty:
             return pd.DataFrame()
         
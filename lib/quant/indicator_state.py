@@ -0,0 +1,213 @@
+import os
+import time
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .trade_calendar import get_calendar
+
+# 增量 MACD 状态
+#
+# 每个标的保存截至最后一个已收盘交易日的 EMA(快) / EMA(慢) / DEA (以及前一日的 DIFF / DEA)，
+# 随 K 线仓库同步逐根递推 (每根 K 线 O(1))，与完整历史上 ewm(adjust=False) 的结果一致，没有短窗口的预热偏差。
+# 盘中用实时快照的最新价在状态上试算一步，即可得到当日的临时 DIFF / DEA 与金叉判定，无需拉取历史行情。
+STATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "bars", "indicator_state.db")
+
+FAST, SLOW, SIGNAL = 12, 26, 9
+ALPHA_FAST = 2.0 / (FAST + 1)
+ALPHA_SLOW = 2.0 / (SLOW + 1)
+ALPHA_SIGNAL = 2.0 / (SIGNAL + 1)
+
+# 与 calculate_macd_panel 一致：有效 K 线不足慢线周期时不判定信号
+MIN_BARS = SLOW
+
+# 前收盘与状态中的收盘价相差超过该比例时视为除权除息，按比例缩放状态
+EX_RIGHTS_TOLERANCE = 1e-4
+
+COLUMNS = ['date', 'close', 'ema_fast', 'ema_slow', 'dea', 'prev_diff', 'prev_dea', 'bars']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS macd_state (
+    code TEXT NOT NULL,
+    adjust TEXT NOT NULL,
+    date TEXT NOT NULL,
+    close REAL NOT NULL,
+    ema_fast REAL NOT NULL,
+    ema_slow REAL NOT NULL,
+    dea REAL NOT NULL,
+    prev_diff REAL,
+    prev_dea REAL,
+    bars INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (code, adjust)
+);
+"""
+
+def macd_step(ema_fast, ema_slow, dea, close):
+    """在状态上递推一根 K 线，标量与数组通用；返回 (ema_fast, ema_slow, diff, dea)"""
+    ema_fast = ema_fast + ALPHA_FAST * (close - ema_fast)
+    ema_slow = ema_slow + ALPHA_SLOW * (close - ema_slow)
+    diff = ema_fast - ema_slow
+    dea = dea + ALPHA_SIGNAL * (diff - dea)
+    return ema_fast, ema_slow, diff, dea
+
+def advance(state, dates, closes):
+    """
+    从 state (dict，可为 None 表示从头开始) 起依次递推若干根 K 线，返回新的状态 dict
+    首根 K 线以收盘价为种子 (DIFF = DEA = 0)，与 ewm(adjust=False) 一致
+    """
+    if state is None:
+        state = None if len(closes) == 0 else {
+            'date': str(dates[0]), 'close': float(closes[0]), 'ema_fast': float(closes[0]),
+            'ema_slow': float(closes[0]), 'dea': 0.0, 'prev_diff': np.nan, 'prev_dea': np.nan, 'bars': 1
+        }
+        dates, closes = dates[1:], closes[1:]
+    if state is None or len(closes) == 0:
+        return state
+    ema_fast, ema_slow, dea = state['ema_fast'], state['ema_slow'], state['dea']
+    diff = ema_fast - ema_slow
+    prev_diff, prev_dea = diff, dea
+    for x in closes:
+        prev_diff, prev_dea = diff, dea
+        ema_fast, ema_slow, diff, dea = macd_step(ema_fast, ema_slow, dea, float(x))
+    return {
+        'date': str(dates[-1]), 'close': float(closes[-1]), 'ema_fast': ema_fast, 'ema_slow': ema_slow,
+        'dea': dea, 'prev_diff': prev_diff, 'prev_dea': prev_dea, 'bars': int(state['bars']) + len(closes)
+    }
+
+class IndicatorStateStore:
+    """按 (代码, 复权方式) 保存 MACD 状态的 SQLite 表，多线程共享"""
+    def __init__(self, path: str = None):
+        self.path = path or STATE_PATH
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def get(self, code: str, adjust: str = "qfq"):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM macd_state WHERE code = ? AND adjust = ?", (code, adjust)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def put(self, code: str, adjust: str, state: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO macd_state (code, adjust, {', '.join(COLUMNS)}, updated_at) "
+                f"VALUES (?, ?, {', '.join('?' * len(COLUMNS))}, ?)",
+                (code, adjust, *[state[c] for c in COLUMNS], time.time())
+            )
+
+    def load_all(self, adjust: str = "qfq"):
+        """全部标的的状态 (DataFrame，以代码为索引)"""
+        with self._lock:
+            frame = pd.read_sql_query(
+                f"SELECT code, {', '.join(COLUMNS)} FROM macd_state WHERE adjust = ?", self._conn, params=(adjust,)
+            )
+        return frame.set_index('code')
+
+_store = None
+_store_guard = threading.Lock()
+
+def get_state_store():
+    """进程内单例"""
+    global _store
+    with _store_guard:
+        if _store is None:
+            _store = IndicatorStateStore()
+        return _store
+
+def update_state(symbol: str, adjust: str, bars: dict):
+    """
+    K 线仓库同步后调用：把状态递推到最后一个已收盘的交易日 (盘中未收盘的 K 线不计入)
+    状态对应 K 线的收盘价发生变化 (前复权基准调整) 时从头重算
+    """
+    dates = bars['日期']
+    if len(dates) == 0:
+        return None
+    store = get_state_store()
+    last_closed = get_calendar().last_closed_session()
+    end = int(np.searchsorted(dates, last_closed, side='right'))
+    if end == 0:
+        return None
+    closes = bars['收盘'][:end]
+    day_str = np.datetime_as_string(dates[:end], unit='D')
+
+    state = store.get(symbol, adjust)
+    if state is not None:
+        i = int(np.searchsorted(day_str, state['date']))
+        if i < end and day_str[i] == state['date'] and np.isclose(closes[i], state['close'], rtol=1e-6):
+            if i == end - 1:
+                return state
+            state = advance(state, day_str[i + 1:], closes[i + 1:])
+        else:
+            state = None
+    if state is None:
+        state = advance(None, day_str, closes)
+    store.put(symbol, adjust, state)
+    return state
+
+def provisional_macd(snapshot: pd.DataFrame, adjust: str = "qfq", states: pd.DataFrame = None, now=None):
+    """
+    用快照最新价 (price) 在各标的状态上试算当日 MACD，返回与 snapshot 行对应的 DataFrame：
+      diff / dea / hist / bars、golden_cross / below_zero / zero_golden_cross，以及 valid (状态可用)
+    状态已是当日收盘 (盘后、休市日) 时直接取状态值；状态过旧、停牌 (无最新价) 的标的 valid 为 False
+    快照中前收盘 (prevClose) 与状态收盘价不一致时视为除权除息，按比例缩放 EMA
+    """
+    states = states if states is not None else get_state_store().load_all(adjust)
+    cal = get_calendar()
+    now = now or pd.Timestamp.now().to_pydatetime()
+    session = cal.last_session(now)
+    previous = cal.last_session(session - 1)
+    session_str = np.datetime_as_string(session, unit='D')
+    previous_str = np.datetime_as_string(previous, unit='D')
+
+    st = states.reindex(snapshot['code'].astype(str).to_numpy())
+    price = pd.to_numeric(snapshot['price'], errors='coerce').to_numpy(dtype=np.float64)
+    if 'prevClose' in snapshot.columns:
+        prev_close = pd.to_numeric(snapshot['prevClose'], errors='coerce').to_numpy(dtype=np.float64)
+    else:
+        prev_close = np.full(len(snapshot), np.nan)
+    state_date = st['date'].to_numpy(dtype=object)
+    close = st['close'].to_numpy(dtype=np.float64)
+    ema_fast = st['ema_fast'].to_numpy(dtype=np.float64)
+    ema_slow = st['ema_slow'].to_numpy(dtype=np.float64)
+    dea0 = st['dea'].to_numpy(dtype=np.float64)
+    bars = st['bars'].to_numpy(dtype=np.float64)
+
+    # 1. 状态截至前一交易日：按最新价试算一步
+    step = (state_date == previous_str) & (price > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where((prev_close > 0) & (np.abs(prev_close / close - 1) > EX_RIGHTS_TOLERANCE),
+                         prev_close / close, 1.0)
+    f, s, step_diff, step_dea = macd_step(ema_fast * scale, ema_slow * scale, dea0 * scale, price)
+
+    # 2. 状态已是当日收盘：直接使用
+    done = state_date == session_str
+
+    diff = np.where(step, step_diff, np.where(done, ema_fast - ema_slow, np.nan))
+    dea = np.where(step, step_dea, np.where(done, dea0, np.nan))
+    prev_diff = np.where(step, (ema_fast - ema_slow) * scale, st['prev_diff'].to_numpy(dtype=np.float64))
+    prev_dea = np.where(step, dea0 * scale, st['prev_dea'].to_numpy(dtype=np.float64))
+    bars = np.where(step, bars + 1, bars)
+
+    valid = step | done
+    enough = valid & (bars >= MIN_BARS)
+    with np.errstate(invalid='ignore'):
+        golden_cross = enough & (prev_diff <= prev_dea) & (diff > dea)
+        below_zero = enough & (diff < 0) & (dea < 0)
+    return pd.DataFrame({
+        'diff': diff,
+        'dea': dea,
+        'hist': diff - dea,
+        'bars': np.where(valid, bars, np.nan),
+        'golden_cross': golden_cross,
+        'below_zero': below_zero,
+        'zero_golden_cross': golden_cross & below_zero,
+        'valid': valid,
+    }, index=snapshot.index)
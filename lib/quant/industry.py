@@ -1,38 +1,74 @@
+import time
+import threading
+
 import pandas as pd
 import numpy as np
 import akshare as ak
 
+from .response_cache import cached_call
+
+# 行业指数日线在进程内共享：批量分析时同一行业的成员只下载一次
+INDUSTRY_CACHE_TTL = 3600
+
+_industry_cache = {}
+_industry_locks = {}
+_industry_guard = threading.Lock()
+
+def get_industry_history(industry_name: str):
+    """
+    获取行业板块历史行情 (日期已规整为 YYYY-MM-DD 字符串)
+    同一行业的并发请求只会触发一次下载，其余调用方等待并复用结果；返回的 DataFrame 请勿原地修改
+    """
+    with _industry_guard:
+        lock = _industry_locks.setdefault(industry_name, threading.Lock())
+
+    with lock:
+        cached = _industry_cache.get(industry_name)
+        if cached is not None and time.time() - cached[0] < INDUSTRY_CACHE_TTL:
+            return cached[1]
+
+        ind_hist = cached_call('daily', 'eastmoney_hist', ak.stock_board_industry_hist_em,
+                               symbol=industry_name, period="daily", adjust="qfq")
+        if ind_hist is None or ind_hist.empty:
+            return pd.DataFrame()
+        ind_hist = ind_hist.copy()
+        ind_hist['日期'] = pd.to_datetime(ind_hist['日期']).dt.strftime('%Y-%m-%d')
+        _industry_cache[industry_name] = (time.time(), ind_hist)
+        return ind_hist
+
 def calculate_industry_correlation(stock_df: pd.DataFrame, industry_name: str):
     """
     计算个股与行业的 Pearson 相关性
     """
     if stock_df.empty or not industry_name:
         return None
-        
+
     try:
-        # 获取行业历史行情
-        ind_hist = ak.stock_board_industry_hist_em(symbol=industry_name, period="daily", adjust="qfq")
+        # 获取行业历史行情 (进程内共享)
+        ind_hist = get_industry_history(industry_name)
         if ind_hist.empty:
             return None
-            
+
         # 合并数据进行相关性计算
-        # 确保日期列格式一致
-        stock_df['日期'] = pd.to_datetime(stock_df['日期']).dt.strftime('%Y-%m-%d')
-        ind_hist['日期'] = pd.to_datetime(ind_hist['日期']).dt.strftime('%Y-%m-%d')
-        
+        # 确保日期列格式一致 (不修改调用方传入的 DataFrame)
+        stock_part = pd.DataFrame({
+            '日期': pd.to_datetime(stock_df['日期']).dt.strftime('%Y-%m-%d'),
+            'stock_close': stock_df['收盘']
+        })
+
         merged = pd.merge(
-            stock_df[['日期', '收盘']].rename(columns={'收盘': 'stock_close'}),
+            stock_part,
             ind_hist[['日期', '收盘']].rename(columns={'收盘': 'ind_close'}),
             on='日期'
         )
-        
+
         if len(merged) < 30:
             return None
-            
+
         # 计算对数收益率的相关性（比价格相关性更准确）
         merged['stock_ret'] = np.log(merged['stock_close'] / merged['stock_close'].shift(1))
         merged['ind_ret'] = np.log(merged['ind_close'] / merged['ind_close'].shift(1))
-        
+
         # 取最近 150 天的数据计算相关性
         correlation = merged['stock_ret'].tail(150).corr(merged['ind_ret'].tail(150))
         return correlation
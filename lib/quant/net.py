@@ -0,0 +1,279 @@
+import sys
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .pipeline import check_cancelled
+
+# 上游请求的统一客户端层
+#
+# 每个上游主机 (按逻辑名区分，见 HOSTS) 各自维护：
+#   令牌桶限速；
+#   AIMD 自适应并发：每次成功并发上限缓慢增加 (+1/上限)，被限流时减半；
+#   带抖动的指数退避重试；
+#   熔断器：连续失败达到阈值后暂停该主机的请求，冷却结束后只放行一个探测请求，成功则恢复。
+# akshare 接口通过 call(host, func, ...) 调用，直接的 HTTP 请求通过 request(method, url, ...) 发出。
+# 被限流的请求计为重试而不是空数据；重试耗尽后抛出 UpstreamError，由调用方决定兜底方式。
+# 在已超时被放弃的分析阶段中，每次请求 (含重试) 之前抛出 pipeline.StageCancelled，不再占用配额。
+
+class TokenBucket:
+    """
+    令牌桶限速：平均每秒 rate 个请求，允许 burst 个突发；acquire() 在令牌不足时阻塞等待
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.capacity = float(max(burst, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+def make_session(pool_size: int = 16, headers: dict = None):
+    """带连接池的 requests.Session，多线程共享以复用 TCP/HTTP 连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+# 逻辑主机 -> 限速参数 (rate: 每秒请求数, burst: 突发量, max_concurrency: 并发上限)
+HOSTS = {
+    'eastmoney': dict(rate=10, burst=10, max_concurrency=16),       # push2: 快照、盘口、板块、个股信息
+    'eastmoney_hist': dict(rate=10, burst=10, max_concurrency=16),  # push2his: 日线、指数、资金流
+    'ths': dict(rate=2, burst=2, max_concurrency=2),                 # 同花顺财务摘要
+    'cninfo': dict(rate=3, burst=3, max_concurrency=8),              # 巨潮查询接口
+    'cninfo_static': dict(rate=6, burst=6, max_concurrency=8),       # 巨潮公告文件
+    'exchanges': dict(rate=2, burst=2, max_concurrency=2),           # 交易所股票列表
+    'sina': dict(rate=1, burst=1, max_concurrency=1),                # 新浪交易日历
+    'sina_quote': dict(rate=5, burst=5, max_concurrency=4),          # 新浪实时行情 (盘口采样)
+}
+DEFAULT_HOST = dict(rate=5, burst=5, max_concurrency=8)
+
+# 域名 -> 逻辑主机 (按顺序匹配，更具体的域名在前)
+URL_HOSTS = (
+    ('push2his.eastmoney.com', 'eastmoney_hist'),
+    ('eastmoney.com', 'eastmoney'),
+    ('static.cninfo.com.cn', 'cninfo_static'),
+    ('cninfo.com.cn', 'cninfo'),
+    ('hq.sinajs.cn', 'sina_quote'),
+)
+
+RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 16.0
+FAILURE_THRESHOLD = 8       # 连续失败次数达到该值时熔断
+COOLDOWN = 30.0             # 熔断冷却时间 (秒)
+MAX_WAIT = 60.0             # 熔断期间调用方最多等待的时间 (秒)
+DECREASE_INTERVAL = 1.0     # 并发上限两次减半之间的最小间隔，避免一波失败把上限压到底
+
+# 视为限流 / 暂时性故障的状态码
+THROTTLE_STATUS = {403, 429, 500, 502, 503, 504}
+
+class UpstreamError(Exception):
+    """重试耗尽后仍失败的上游请求"""
+
+class CircuitOpenError(UpstreamError):
+    """主机处于熔断状态，等待超过 max_wait 仍未恢复"""
+
+class ThrottledError(Exception):
+    """上游返回了限流 / 服务端错误状态码"""
+    def __init__(self, status, url):
+        super().__init__(f"HTTP {status}: {url}")
+        self.status = status
+
+# 可重试的异常：连接 / 超时 / 传输中断与限流状态码
+# 解析失败 (KeyError / TypeError / JSON 解码错误，含 requests 的 JSONDecodeError) 与非限流的 HTTP 错误 (404 等)
+# 多为接口变更或个别代码的数据问题，重试无益，按不可重试的错误直接抛出，且不影响该主机的并发上限与熔断状态
+RETRYABLE = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+             ConnectionError, TimeoutError, ThrottledError)
+
+def is_retryable(exc: BaseException):
+    """异常是否视为网络故障 / 限流 (akshare 内部 raise_for_status 抛出的限流状态码同样可重试)"""
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in THROTTLE_STATUS
+    return isinstance(exc, RETRYABLE)
+
+def backoff_delay(attempt: int):
+    """第 attempt 次重试前的等待时间：指数增长，后一半随机抖动以错开并发线程"""
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class HostClient:
+    """单个上游主机的限速、自适应并发、重试与熔断"""
+    def __init__(self, name, rate, burst=1, max_concurrency=8, min_concurrency=1,
+                 failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.limit = float(max_concurrency)
+        self.stats = {"calls": 0, "ok": 0, "retries": 0, "throttled": 0, "failed": 0, "errors": 0,
+                      "circuit_opens": 0}
+        self._active = 0
+        self._failures = 0
+        self._open_until = 0.0   # 非 0 表示已熔断；到期后进入半开状态
+        self._probing = False
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def state(self):
+        if not self._open_until:
+            return "closed"
+        return "half-open" if time.monotonic() >= self._open_until else "open"
+
+    def _enter(self, deadline):
+        """占用一个并发名额，返回是否为半开状态下的探测请求"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._open_until:
+                    if now >= self._open_until and not self._probing:
+                        self._probing = True
+                        self._active += 1
+                        return True
+                    if now >= deadline:
+                        raise CircuitOpenError(f"{self.name} 熔断中，等待 {MAX_WAIT:.0f}s 后仍未恢复")
+                    wait = min(max(self._open_until - now, 0.05), deadline - now)
+                elif self._active < max(int(self.limit), self.min_concurrency):
+                    self._active += 1
+                    return False
+                else:
+                    wait = None
+                self._cond.wait(wait)
+
+    def _exit(self, probe, outcome):
+        with self._cond:
+            self._active -= 1
+            if probe:
+                self._probing = False
+            now = time.monotonic()
+            if outcome == "throttled":
+                self.stats["throttled"] += 1
+                self._failures += 1
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+                if probe or (not self._open_until and self._failures >= self.failure_threshold):
+                    if not self._open_until:
+                        self.stats["circuit_opens"] += 1
+                        print(f"WARNING: {self.name} 连续失败 {self._failures} 次，暂停请求 {self.cooldown:.0f}s",
+                              file=sys.stderr)
+                    self._open_until = now + self.cooldown
+            elif outcome == "ok":
+                # 成功：恢复熔断，增加并发上限
+                self._failures = 0
+                self._open_until = 0.0
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            else:
+                # 不可重试的错误 (解析失败、参数错误等) 与主机健康无关：并发上限与熔断状态保持不变
+                self.stats["errors"] += 1
+            self._cond.notify_all()
+
+    def call(self, func, *args, retries=RETRIES, max_wait=MAX_WAIT, **kwargs):
+        """调用 func(*args, **kwargs)，可重试的异常按退避重试，耗尽后抛出 UpstreamError"""
+        with self._cond:
+            self.stats["calls"] += 1
+        deadline = time.monotonic() + max_wait
+        for attempt in range(retries + 1):
+            # 所在的分析阶段已超时被放弃时不再发出请求 (见 quant.pipeline.run_stages)
+            check_cancelled()
+            try:
+                probe = self._enter(deadline)
+            except CircuitOpenError:
+                with self._cond:
+                    self.stats["failed"] += 1
+                raise
+            self.bucket.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._exit(probe, "error")
+                    raise
+                self._exit(probe, "throttled")
+                if attempt == retries:
+                    with self._cond:
+                        self.stats["failed"] += 1
+                    raise UpstreamError(f"{self.name} 请求重试 {retries} 次后仍失败: {str(e)}") from e
+                with self._cond:
+                    self.stats["retries"] += 1
+                time.sleep(backoff_delay(attempt))
+                continue
+            self._exit(probe, "ok")
+            with self._cond:
+                self.stats["ok"] += 1
+            return result
+
+_clients = {}
+_clients_guard = threading.Lock()
+_default_session = None
+
+def client(host: str):
+    """逻辑主机对应的客户端 (进程内单例)"""
+    with _clients_guard:
+        if host not in _clients:
+            _clients[host] = HostClient(host, **HOSTS.get(host, DEFAULT_HOST))
+        return _clients[host]
+
+def call(host: str, func, *args, **kwargs):
+    """经由 host 的客户端调用 func (通常为 akshare 接口)"""
+    return client(host).call(func, *args, **kwargs)
+
+def host_of(url: str):
+    netloc = urlsplit(url).netloc.split(':')[0]
+    for domain, host in URL_HOSTS:
+        if netloc == domain or netloc.endswith('.' + domain):
+            return host
+    return netloc
+
+def check_status(response):
+    """限流 / 服务端错误状态码抛出 ThrottledError (可重试)，其余错误状态码抛出 HTTPError"""
+    if response.status_code in THROTTLE_STATUS:
+        response.close()
+        raise ThrottledError(response.status_code, response.url)
+    response.raise_for_status()
+    return response
+
+def request(method: str, url: str, session=None, host: str = None, retries=RETRIES, **kwargs):
+    """经由 URL 所属主机的客户端发出 HTTP 请求，返回状态正常的 Response"""
+    global _default_session
+    if session is None:
+        with _clients_guard:
+            if _default_session is None:
+                _default_session = make_session()
+        session = _default_session
+    return call(host or host_of(url), lambda: check_status(session.request(method, url, **kwargs)),
+                retries=retries)
+
+def stats():
+    """各主机的请求统计、当前并发上限与熔断状态"""
+    with _clients_guard:
+        clients = list(_clients.values())
+    return {
+        c.name: dict(c.stats, concurrency=round(c.limit, 1), state=c.state)
+        for c in clients
+    }
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+def build_price_panel(frames: dict, field: str = '收盘', date_col: str = '日期'):
+    """
+    将多只标的的行情 DataFrame 按交易日对齐为二维矩阵 (标的 × 交易日)
+    返回 (codes, dates, panel)，缺失 (停牌/未上市) 处为 NaN，交易日升序
+    """
+    codes = [code for code, df in frames.items() if df is not None and not df.empty]
+    if not codes:
+        return [], np.array([], dtype='<U10'), np.empty((0, 0))
+
+    date_arrays = [frames[code][date_col].astype(str).to_numpy() for code in codes]
+    dates = np.unique(np.concatenate(date_arrays))
+
+    panel = np.full((len(codes), len(dates)), np.nan)
+    for i, code in enumerate(codes):
+        cols = np.searchsorted(dates, date_arrays[i])
+        panel[i, cols] = pd.to_numeric(frames[code][field], errors='coerce').to_numpy(dtype=np.float64)
+    return codes, dates, panel
+
+def valid_counts(panel: np.ndarray):
+    """每个标的截至各交易日的有效 K 线数量 (累计)"""
+    return np.cumsum(~np.isnan(panel), axis=1)
+
+def last_valid_index(panel: np.ndarray):
+    """每个标的最后一根有效 K 线所在的列，全为空时为 -1"""
+    valid = ~np.isnan(panel)
+    idx = panel.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    return np.where(valid.any(axis=1), idx, -1)
+
+def take_last(values: np.ndarray, index: np.ndarray, fill=False):
+    """按 last_valid_index 的结果逐行取值，index 为 -1 的行填充 fill"""
+    rows = np.arange(values.shape[0])
+    picked = values[rows, np.maximum(index, 0)]
+    return np.where(index >= 0, picked, fill)
+
+def right_align(values: np.ndarray, k: int = None):
+    """
+    把每行的有效值压缩并右对齐 (剔除停牌等缺失列)，只保留最近 k 个 (缺省为全部)
+    返回 (N × k 矩阵，不足处左侧为 NaN；各位置对应的原始列号，无效处为 -1)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n, t = values.shape
+    k = t if k is None else k
+    out = np.full((n, k), np.nan)
+    cols_out = np.full((n, k), -1, dtype=np.int64)
+    if t == 0 or k == 0:
+        return out, cols_out
+    valid = ~np.isnan(values)
+    # 倒序后稳定排序：有效值在前且保持由近及远的顺序
+    order = np.argsort(~valid[:, ::-1], axis=1, kind='stable')[:, :k]
+    cols = t - 1 - order
+    picked_valid = np.take_along_axis(valid, cols, axis=1)
+    picked = np.where(picked_valid, np.take_along_axis(values, cols, axis=1), np.nan)
+    width = picked.shape[1]
+    out[:, k - width:] = picked[:, ::-1]
+    cols_out[:, k - width:] = np.where(picked_valid, cols, -1)[:, ::-1]
+    return out, cols_out
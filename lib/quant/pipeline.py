@@ -0,0 +1,195 @@
+import sys
+import time
+import threading
+import contextvars
+import concurrent.futures
+
+class ContextThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    在提交方的 contextvars 上下文中执行任务的线程池
+    常驻 worker 以上下文变量记录当前任务，池内线程的输出因此仍能归属到提交它的任务
+    """
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+# 所有 run_stages 共用的阶段线程池上限：超时的阶段线程无法强制终止，
+# 共用有界线程池使常驻 worker 中滞留的线程数有上限
+STAGE_WORKERS = 32
+
+class StageCancelled(Exception):
+    """阶段已超时被放弃，其后续的上游请求不再发出"""
+
+# 当前阶段的取消事件 (在阶段线程的上下文中设置)；quant.net 在每次请求前检查
+current_cancel = contextvars.ContextVar('stage_cancel', default=None)
+
+def check_cancelled():
+    """所在阶段已被放弃时抛出 StageCancelled，供耗时的阶段在循环或请求之间调用"""
+    cancel = current_cancel.get()
+    if cancel is not None and cancel.is_set():
+        raise StageCancelled("阶段已超时，放弃后续请求")
+
+class Stage:
+    """
+    分析流水线中的一个阶段
+    func 以依赖阶段的结果作为关键字参数调用：func(**{dep: result})
+    超时或异常时使用 fallback；required=True 的阶段失败会直接抛出
+    """
+    def __init__(self, name, func, deps=(), timeout=30.0, fallback=None, required=False, message=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.required = required
+        self.message = message
+
+class StageReport:
+    """单个阶段的执行情况：status 为 ok / timeout / error / skipped，elapsed 为墙钟耗时 (秒)"""
+    def __init__(self, name, status, elapsed, error=None):
+        self.name = name
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+            "error": self.error
+        }
+
+class TierStats:
+    """
+    两级流水线中一个层级 (取数 / 计算) 的负载统计，多线程累加安全
+    busy 为各 worker 实际工作时间之和，blocked 为因下游队列已满而等待的时间之和
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, blocked=0.0, items=1):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.blocked += blocked
+
+    def utilization(self, elapsed):
+        capacity = self.workers * elapsed
+        return self.busy / capacity if capacity > 0 else 0.0
+
+    def to_dict(self, elapsed):
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_s": round(self.busy, 3),
+            "blocked_s": round(self.blocked, 3),
+            "utilization": round(self.utilization(elapsed), 3)
+        }
+
+_stage_pool = None
+_stage_pool_guard = threading.Lock()
+_abandoned = set()   # 已超时放弃、线程仍在运行的阶段 future
+
+def _get_stage_pool():
+    global _stage_pool
+    with _stage_pool_guard:
+        if _stage_pool is None:
+            _stage_pool = ContextThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+        return _stage_pool
+
+def _run_stage(func, cancel, kwargs):
+    current_cancel.set(cancel)
+    return func(**kwargs)
+
+def _abandon(stage, future, cancel):
+    """放弃超时的阶段：通知其停止后续请求，并记录仍在运行的线程数"""
+    cancel.set()
+    if future.cancel():
+        return
+    with _stage_pool_guard:
+        _abandoned.difference_update([f for f in _abandoned if f.done()])
+        _abandoned.add(future)
+        count = len(_abandoned)
+    print(f"WARNING: 阶段 {stage.name} 超时 ({stage.timeout}s)，线程仍在后台运行 "
+          f"(共 {count} 个未结束，线程池上限 {STAGE_WORKERS})", file=sys.stderr)
+
+def run_stages(stages, max_workers=None, log=None):
+    """
+    按依赖关系并发执行各阶段：依赖全部完成的阶段立即提交，互不依赖的阶段同时运行
+    各阶段在共用的有界线程池中执行，max_workers 限制本次同时运行的阶段数
+    超时的阶段被放弃：其取消事件被置位，阶段内经 quant.net 的后续请求抛出 StageCancelled
+    返回 (results, reports)，均以阶段名为键
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        for dep in s.deps:
+            if dep not in by_name:
+                raise ValueError(f"阶段 {s.name} 依赖未知阶段 {dep}")
+
+    results = {}
+    reports = {}
+    pending = dict(by_name)
+    running = {}  # future -> (stage, started_at, cancel)
+
+    executor = _get_stage_pool()
+    limit = max_workers or len(stages) or 1
+    try:
+        while pending or running:
+            # 1. 提交所有依赖已就绪的阶段
+            for name in list(pending):
+                stage = pending[name]
+                if len(running) >= limit:
+                    break
+                if all(dep in results for dep in stage.deps):
+                    del pending[name]
+                    if log and stage.message:
+                        log(stage.message)
+                    kwargs = {dep: results[dep] for dep in stage.deps}
+                    cancel = threading.Event()
+                    future = executor.submit(_run_stage, stage.func, cancel, kwargs)
+                    running[future] = (stage, time.perf_counter(), cancel)
+
+            if not running:
+                # 剩余阶段的依赖无法满足 (存在环)
+                raise ValueError(f"阶段依赖无法满足: {sorted(pending)}")
+
+            # 2. 等待最早完成或最早超时的阶段
+            now = time.perf_counter()
+            next_deadline = min(started + stage.timeout for stage, started, _ in running.values())
+            done, _ = concurrent.futures.wait(
+                list(running), timeout=max(0.0, next_deadline - now),
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            now = time.perf_counter()
+            for future in list(running):
+                stage, started, cancel = running[future]
+                if future in done:
+                    del running[future]
+                    try:
+                        results[stage.name] = future.result()
+                        reports[stage.name] = StageReport(stage.name, "ok", now - started)
+                    except Exception as e:
+                        if stage.required:
+                            raise
+                        results[stage.name] = stage.fallback
+                        reports[stage.name] = StageReport(stage.name, "error", now - started, str(e))
+                elif now - started >= stage.timeout:
+                    # 线程无法强制终止，放弃等待并使用兜底值
+                    del running[future]
+                    _abandon(stage, future, cancel)
+                    if stage.required:
+                        raise TimeoutError(f"阶段 {stage.name} 超时 ({stage.timeout}s)")
+                    results[stage.name] = stage.fallback
+                    reports[stage.name] = StageReport(stage.name, "timeout", now - started)
+    finally:
+        # 异常退出时放弃仍在运行的阶段
+        for future, (stage, _, cancel) in running.items():
+            cancel.set()
+            future.cancel()
+
+    return results, reports
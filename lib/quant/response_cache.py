@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from . import net
+from .trade_calendar import get_calendar
+
+# akshare 接口的本地响应缓存 (SQLite，zlib 压缩的 pickle)
+#
+# 以 接口名 + 规整后的参数 为键；每类数据有各自的新鲜度策略 (见 POLICIES)：
+#   quote      盘口等实时数据，QUOTE_TTL 秒
+#   daily      日线、资金流、个股信息等，到下一个交易日收盘落定为止 (按交易日历，跳过周末与节假日)
+#   financial  财务摘要，财报披露季内按 daily 处理，非披露季缓存到下一个披露季开始
+# 总大小超过 max_bytes 时按最近访问时间淘汰 (LRU)
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "responses.db")
+MAX_BYTES = 256 * 1024 * 1024
+QUOTE_TTL = 5
+
+# 定期报告披露季 ((起始月, 日), (截止月, 日))：年报与一季报、半年报、三季报
+REPORT_SEASONS = (((1, 1), (4, 30)), ((7, 1), (8, 31)), ((10, 1), (10, 31)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    data_class TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at);
+"""
+
+def next_close(now: datetime):
+    """下一次收盘落定时刻"""
+    return get_calendar().next_close(now)
+
+def next_report_season(now: datetime):
+    """披露季内返回下一次收盘；否则返回下一个披露季的开始时刻"""
+    for (m1, d1), (m2, d2) in REPORT_SEASONS:
+        if (m1, d1) <= (now.month, now.day) <= (m2, d2):
+            return next_close(now)
+    for (m1, d1), _ in REPORT_SEASONS:
+        if (now.month, now.day) < (m1, d1):
+            return datetime(now.year, m1, d1)
+    return datetime(now.year + 1, *REPORT_SEASONS[0][0])
+
+# 数据类别 -> 过期时刻
+POLICIES = {
+    'quote': lambda now: now + timedelta(seconds=QUOTE_TTL),
+    'daily': next_close,
+    'financial': next_report_season,
+}
+
+def make_key(endpoint: str, params: dict):
+    """接口名 + 规整后的参数 (按键排序，字符串去除首尾空白) 的摘要"""
+    normalized = {k: v.strip() if isinstance(v, str) else v for k, v in sorted(params.items())}
+    raw = json.dumps([endpoint, normalized], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """带新鲜度策略与 LRU 淘汰的响应缓存，多线程共享"""
+    def __init__(self, path: str = None, max_bytes: int = MAX_BYTES):
+        self.path = path or CACHE_PATH
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._stats = {}
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def _count(self, data_class, field, n=1):
+        stats = self._stats.setdefault(data_class, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+        stats[field] += n
+
+    def get(self, key: str, data_class: str):
+        """未过期时返回缓存的对象，否则返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self._count(data_class, "misses")
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._count(data_class, "hits")
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, endpoint: str, data_class: str, obj, expires_at: float):
+        payload = zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, endpoint, data_class, payload, size, created_at, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, endpoint, data_class, payload, len(payload), now, expires_at, now)
+                )
+            self._count(data_class, "stores")
+            self._evict(now)
+
+    def _evict(self, now):
+        """清除过期条目；总大小仍超过上限时按最近访问时间淘汰到上限的 90%"""
+        with self._conn:
+            self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        victims = []
+        for key, data_class, size in self._conn.execute(
+                "SELECT key, data_class, size FROM responses ORDER BY accessed_at"):
+            victims.append((key,))
+            self._count(data_class, "evictions")
+            target -= size
+            if target <= 0:
+                break
+        with self._conn:
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def clear(self, data_class: str = None):
+        with self._lock, self._conn:
+            if data_class:
+                self._conn.execute("DELETE FROM responses WHERE data_class = ?", (data_class,))
+            else:
+                self._conn.execute("DELETE FROM responses")
+
+    def info(self):
+        """条目数、占用字节与各数据类别的命中统计"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = {k: dict(v) for k, v in self._stats.items()}
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "stats": stats}
+
+_cache = None
+_cache_guard = threading.Lock()
+
+def get_cache():
+    """进程内单例"""
+    global _cache
+    with _cache_guard:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def cached_call(data_class: str, host: str, func, **params):
+    """
+    带缓存的上游调用：命中且未过期时不访问网络，否则经 net.call 请求并写入缓存
+    空结果 (None / 空表) 不缓存
+    """
+    if data_class not in POLICIES:
+        raise ValueError(f"未知的数据类别: {data_class}")
+    cache = get_cache()
+    endpoint = getattr(func, '__name__', str(func))
+    key = make_key(endpoint, params)
+    result = cache.get(key, data_class)
+    if result is not None:
+        return result
+
+    result = net.call(host, func, **params)
+    if result is not None and not getattr(result, 'empty', False):
+        expires_at = POLICIES[data_class](datetime.now()).timestamp()
+        cache.put(key, endpoint, data_class, result, expires_at)
+    return result
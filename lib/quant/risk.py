@@ -2,40 +2,55 @@ import numpy as np
 import pandas as pd
 import akshare as ak
 
+from .response_cache import cached_call
+from .volatility import volatility_panel
+from .depth_sampler import DEPTH_THRESHOLD, sampled_liquidity
+
 def calculate_hv(df: pd.DataFrame, window: int = 20):
     """
-    计算历史年化波动率 (HV)
+    计算历史年化波动率 (HV)，取最近 window 个交易日
+    """
+    return calculate_hv_windows(df, (window,))[0]
+
+def calculate_hv_windows(df: pd.DataFrame, windows=(20, 60)):
+    """
+    一次计算多个窗口的历史年化波动率，按 windows 顺序返回 (数据不足的窗口为 None)
+    行情按日期升序排列后再计算 (get_history_detail 返回的是倒序数据)
     """
-    if df is None or len(df) < window + 1:
-        return None
+    if df is None or df.empty:
+        return tuple(None for _ in windows)
     try:
+        if '日期' in df.columns:
+            df = df.sort_values('日期')
         # 确保收盘价是数值型
-        prices = pd.to_numeric(df['收盘'], errors='coerce').dropna()
-        # 计算对数收益率
-        log_returns = np.log(prices / prices.shift(1))
-        # 计算滚动标准差并年化
-        vol = log_returns.rolling(window=window).std() * np.sqrt(252)
-        return vol.iloc[-1]
+        prices = pd.to_numeric(df['收盘'], errors='coerce').dropna().to_numpy(dtype=np.float64)
+        series = volatility_panel({'收盘': prices[None, :]}, windows=windows, aligned=True)
+        result = []
+        for window in windows:
+            vol = series[('hv', window)][0, -1] if len(prices) else np.nan
+            result.append(None if np.isnan(vol) else float(vol))
+        return tuple(result)
     except Exception:
-        return None
+        return tuple(None for _ in windows)
 
-def analyze_liquidity(symbol: str):
+def analyze_liquidity(symbol: str, sampler=None):
     """
     分析流动性与盘口深度
+    盘口采样器 (quant.depth_sampler) 中该标的样本充足时使用滑动统计，否则取一次五档快照
     """
+    sampled = sampled_liquidity(symbol, sampler)
+    if sampled is not None:
+        return sampled
     try:
-        # 获取五档委买委卖
-        tick_data = ak.stock_bid_ask_em(symbol=symbol)
-        
-        ask_vols = [f'sell_{i}_vol' for i in range(1, 6)]
-        bid_vols = [f'buy_{i}_vol' for i in range(1, 6)]
-        
-        total_ask = tick_data[tick_data['item'].isin(ask_vols)]['value'].sum()
-        total_bid = tick_data[tick_data['item'].isin(bid_vols)]['value'].sum()
-        
-        # 评分逻辑：挂单量大于 10000 手视为充裕（根据实际市场情况可调整）
-        assessment = "充裕" if (total_ask + total_bid) > 20000 else "中/低"
-        
+        # 获取五档委买委卖 (item / value 长表，按 item 建索引后直接取值)
+        tick_data = cached_call('quote', 'eastmoney', ak.stock_bid_ask_em, symbol=symbol)
+        values = pd.to_numeric(tick_data.set_index('item')['value'], errors='coerce')
+        total_ask = values.reindex([f'sell_{i}_vol' for i in range(1, 6)]).sum()
+        total_bid = values.reindex([f'buy_{i}_vol' for i in range(1, 6)]).sum()
+
+        # 评分逻辑：买卖五档合计挂单量超过阈值视为充裕（根据实际市场情况可调整）
+        assessment = "充裕" if (total_ask + total_bid) > DEPTH_THRESHOLD else "中/低"
+
         return {
             "bid_depth": int(total_bid),
             "ask_depth": int(total_ask),
@@ -43,7 +58,7 @@ def analyze_liquidity(symbol: str):
         }
     except Exception:
         return {
-            "total_ask_depth": 0,
-            "total_bid_depth": 0,
-            "assessment": "未知"
+            "bid_depth": 0,
+            "ask_depth": 0,
+            "score": "未知"
         }
@@ -0,0 +1,452 @@
+import re
+import operator
+import threading
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from . import calculators, panel, extrema
+from .history import get_history_detail
+from .pipeline import ContextThreadPoolExecutor
+
+# 规则组合筛选
+#
+# 表达式由信号名、快照字段比较与 AND / OR / NOT / 括号组成，例如：
+#   macd_zero_cross AND ma5_up AND turnover > 3
+#   (macd_golden_cross OR bottom_divergence) AND NOT change < -5
+# 求值分两步：
+#   1. 只用实时快照字段做三值 (真 / 假 / 未知) 求值，结果已确定的标的不再拉取历史行情
+#   2. 剩余标的拉取行情后对齐为矩阵，各指标按需计算一次并被所有规则共享
+
+# 最少需要的 K 线数量 (与 MACD 慢线周期匹配)
+MIN_BARS = 30
+
+COMPARATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|(>=|<=|==|!=|>|<)|(-?\d+(?:\.\d+)?)|([A-Za-z_][A-Za-z0-9_]*))")
+
+class RuleError(ValueError):
+    """规则表达式无法解析或引用了未知的信号 / 字段"""
+
+# ---------- 指标缓存 ----------
+
+class IndicatorCache:
+    """
+    一组标的 (行情已对齐为 标的 × 交易日 矩阵) 的指标缓存：每个指标只计算一次，
+    信号取各标的最后一根有效 K 线上的值
+    """
+    def __init__(self, frames: dict):
+        self.frames = frames
+        self.codes, self.dates, self.close = panel.build_price_panel(frames)
+        self.row = {code: i for i, code in enumerate(self.codes)}
+        self.last_idx = panel.last_valid_index(self.close)
+        self.bars = np.isfinite(self.close).sum(axis=1)
+        self._values = {}
+        # 指标之间可以相互依赖 (如背离依赖 MACD)，使用可重入锁
+        self._lock = threading.RLock()
+
+    def get(self, key, builder):
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = builder()
+            return self._values[key]
+
+    def macd(self):
+        return self.get('macd', lambda: calculators.calculate_macd_panel(self.close))
+
+    def last(self, values):
+        return panel.take_last(values, self.last_idx, fill=np.nan if values.dtype.kind == 'f' else False)
+
+    def ma_up(self, window):
+        def _build():
+            closes, _ = panel.right_align(self.close, window + 1)
+            with np.errstate(invalid='ignore'):
+                up = closes[:, 1:].mean(axis=1) > closes[:, :-1].mean(axis=1)
+            return up & ~np.isnan(closes).any(axis=1)
+        return self.get(('ma_up', window), _build)
+
+    def divergence(self, kind):
+        return self.get(('divergence', kind), lambda: extrema.macd_divergence(self.close, kind, macd=self.macd()))
+
+# 信号名 -> 计算函数 (IndicatorCache -> 布尔数组，按 cache.codes 顺序)
+SIGNALS = {
+    'macd_golden_cross': lambda c: c.last(c.macd()['golden_cross']),
+    'macd_zero_cross': lambda c: c.last(c.macd()['zero_golden_cross']),
+    'macd_below_zero': lambda c: c.last(c.macd()['below_zero']),
+    'ma5_up': lambda c: c.ma_up(5),
+    'ma10_up': lambda c: c.ma_up(10),
+    'ma20_up': lambda c: c.ma_up(20),
+    'bottom_divergence': lambda c: c.divergence('bottom'),
+    'top_divergence': lambda c: c.divergence('top'),
+}
+
+# 可用于比较的指标数值字段 (需要历史行情)
+INDICATOR_FIELDS = {
+    'macd_diff': lambda c: c.last(c.macd()['diff']),
+    'macd_dea': lambda c: c.last(c.macd()['dea']),
+    'macd_hist': lambda c: c.last(c.macd()['hist']),
+    'bars': lambda c: c.bars.astype(np.float64),
+}
+
+# 盘中可由增量 MACD 状态直接求值的信号与指标 (名称 -> provisional_macd 的列)
+INTRADAY_SIGNALS = {
+    'macd_golden_cross': 'golden_cross',
+    'macd_zero_cross': 'zero_golden_cross',
+    'macd_below_zero': 'below_zero',
+}
+INTRADAY_FIELDS = {
+    'macd_diff': 'diff',
+    'macd_dea': 'dea',
+    'macd_hist': 'hist',
+    'bars': 'bars',
+}
+
+# ---------- 表达式 ----------
+
+class _Node:
+    def signals(self):
+        return set()
+
+    def fields(self):
+        return set()
+
+class _Signal(_Node):
+    def __init__(self, name):
+        if name not in SIGNALS:
+            raise RuleError(f"未知信号: {name}")
+        self.name = name
+
+    def truth(self, env):
+        value = env.signal(self.name)
+        if value is None:
+            return env.unknown()
+        known = env.known(self.name)
+        return value & known, ~value & known
+
+    def signals(self):
+        return {self.name}
+
+class _Compare(_Node):
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def truth(self, env):
+        values = env.field(self.field)
+        if values is None:
+            return env.unknown()
+        with np.errstate(invalid='ignore'):
+            true = COMPARATORS[self.op](values, self.value) & ~np.isnan(values)
+        # 缺失值 ('-') 视为不满足
+        known = env.known(self.field)
+        return true & known, ~true & known
+
+    def fields(self):
+        return {self.field}
+
+class _And(_Node):
+    def __init__(self, children):
+        self.children = children
+
+    def truth(self, env):
+        parts = [c.truth(env) for c in self.children]
+        return np.logical_and.reduce([t for t, _ in parts]), np.logical_or.reduce([f for _, f in parts])
+
+    def signals(self):
+        return set().union(*(c.signals() for c in self.children))
+
+    def fields(self):
+        return set().union(*(c.fields() for c in self.children))
+
+class _Or(_And):
+    def truth(self, env):
+        parts = [c.truth(env) for c in self.children]
+        return np.logical_or.reduce([t for t, _ in parts]), np.logical_and.reduce([f for _, f in parts])
+
+class _Not(_Node):
+    def __init__(self, child):
+        self.child = child
+
+    def truth(self, env):
+        true, false = self.child.truth(env)
+        return false, true
+
+    def signals(self):
+        return self.child.signals()
+
+    def fields(self):
+        return self.child.fields()
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise RuleError(f"无法解析规则: {text[pos:]!r}")
+        lparen, rparen, op, number, word = m.groups()
+        if lparen or rparen:
+            tokens.append(('paren', lparen or rparen))
+        elif op:
+            tokens.append(('op', op))
+        elif number is not None:
+            tokens.append(('number', float(number)))
+        elif word.upper() in ('AND', 'OR', 'NOT'):
+            tokens.append(('keyword', word.upper()))
+        else:
+            tokens.append(('name', word))
+        pos = m.end()
+    return tokens
+
+class _Parser:
+    """递归下降：or := and (OR and)* ; and := not (AND not)* ; not := NOT not | atom"""
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            raise RuleError(f"规则 {self.text!r} 在第 {self.pos + 1} 个记号处不完整或有误")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise RuleError(f"规则 {self.text!r} 存在多余内容: {self.tokens[self.pos][1]}")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == ('keyword', 'OR'):
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else _Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() == ('keyword', 'AND'):
+            self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else _And(children)
+
+    def parse_not(self):
+        if self.peek() == ('keyword', 'NOT'):
+            self.take()
+            return _Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.peek()
+        if kind == 'paren' and value == '(':
+            self.take()
+            node = self.parse_or()
+            self.take('paren', ')')
+            return node
+        _, name = self.take('name')
+        if self.peek()[0] == 'op':
+            _, op = self.take()
+            _, number = self.take('number')
+            return _Compare(name, op, number)
+        return _Signal(name)
+
+class Rule:
+    """解析后的筛选规则"""
+    def __init__(self, text: str):
+        self.text = text
+        self.node = _Parser(text).parse()
+
+    @property
+    def signals(self):
+        return self.node.signals()
+
+    @property
+    def fields(self):
+        return self.node.fields()
+
+    def __repr__(self):
+        return f"Rule({self.text!r})"
+
+def parse_rule(text):
+    return text if isinstance(text, Rule) else Rule(text)
+
+# ---------- 求值环境 ----------
+
+class _SnapshotEnv:
+    """第一步：只有快照字段可用，信号与指标字段均为未知"""
+    def __init__(self, snapshot: pd.DataFrame):
+        self.snapshot = snapshot
+
+    def unknown(self):
+        n = len(self.snapshot)
+        return np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+
+    def field(self, name):
+        if name in self.snapshot.columns:
+            return pd.to_numeric(self.snapshot[name], errors='coerce').to_numpy(dtype=np.float64)
+        if name in INDICATOR_FIELDS:
+            return None
+        raise RuleError(f"未知字段: {name}")
+
+    def signal(self, name):
+        return None
+
+    def known(self, name):
+        """各行上该信号 / 字段的值是否已确定"""
+        return np.ones(len(self.snapshot), dtype=bool)
+
+class _IntradayEnv(_SnapshotEnv):
+    """
+    盘中：快照字段 + 由增量 MACD 状态与最新价试算的当日 MACD (见 indicator_state.provisional_macd)
+    状态不可用的标的、以及其他需要历史行情的信号 / 指标仍为未知
+    """
+    def __init__(self, snapshot: pd.DataFrame, macd: pd.DataFrame):
+        super().__init__(snapshot)
+        self.macd = macd
+
+    def field(self, name):
+        if name in INTRADAY_FIELDS:
+            return self.macd[INTRADAY_FIELDS[name]].to_numpy(dtype=np.float64)
+        return super().field(name)
+
+    def signal(self, name):
+        if name in INTRADAY_SIGNALS:
+            return self.macd[INTRADAY_SIGNALS[name]].to_numpy(dtype=bool)
+        return None
+
+    def known(self, name):
+        if name in INTRADAY_SIGNALS or name in INTRADAY_FIELDS:
+            return self.macd['valid'].to_numpy(dtype=bool)
+        return super().known(name)
+
+class _HistoryEnv(_SnapshotEnv):
+    """第二步：快照字段 + 指标缓存，按 codes 顺序取值；行情不足的标的信号为假、指标为 NaN"""
+    def __init__(self, snapshot: pd.DataFrame, cache: IndicatorCache):
+        super().__init__(snapshot)
+        self.cache = cache
+        codes = snapshot['code'].astype(str).to_numpy()
+        rows = np.array([cache.row.get(code, -1) for code in codes], dtype=np.int64)
+        enough = np.zeros(len(codes), dtype=bool)
+        has_row = rows >= 0
+        enough[has_row] = cache.bars[rows[has_row]] >= MIN_BARS
+        self.rows = np.where(enough, rows, 0)
+        self.enough = enough
+
+    def field(self, name):
+        if name in self.snapshot.columns:
+            return super().field(name)
+        if name in INDICATOR_FIELDS:
+            values = INDICATOR_FIELDS[name](self.cache)[self.rows].astype(np.float64)
+            return np.where(self.enough, values, np.nan)
+        raise RuleError(f"未知字段: {name}")
+
+    def signal(self, name):
+        return SIGNALS[name](self.cache)[self.rows].astype(bool) & self.enough
+
+def prefilter(rule, snapshot: pd.DataFrame, intraday: pd.DataFrame = None):
+    """
+    仅用快照字段求值，返回 (必然命中, 必然不命中) 两个布尔数组；两者皆假的标的需要历史行情
+    intraday 为 indicator_state.provisional_macd 的结果时，MACD 类信号与指标也参与求值
+    """
+    rule = parse_rule(rule)
+    env = _SnapshotEnv(snapshot) if intraday is None else _IntradayEnv(snapshot, intraday)
+    return rule.node.truth(env)
+
+def evaluate(rule, snapshot: pd.DataFrame, cache: IndicatorCache):
+    """在快照字段与指标缓存上完整求值，返回布尔数组 (与 snapshot 行对应)"""
+    rule = parse_rule(rule)
+    if len(snapshot) == 0:
+        return np.zeros(0, dtype=bool)
+    true, _ = rule.node.truth(_HistoryEnv(snapshot, cache))
+    return true
+
+# ---------- 多规则会话 ----------
+
+class ScreeningSession:
+    """
+    同一份实时快照上的多次筛选：历史行情与指标在会话内只获取 / 计算一次，
+    每条规则先用快照字段剪枝，只为结果未定的标的拉取行情
+    """
+    def __init__(self, snapshot, loader=None, days=60, max_workers=30):
+        if not isinstance(snapshot, pd.DataFrame):
+            snapshot = pd.DataFrame(list(snapshot))
+        snapshot = snapshot.copy()
+        snapshot['code'] = snapshot['code'].astype(str)
+        self.snapshot = snapshot.drop_duplicates('code').reset_index(drop=True)
+        self.loader = loader or (lambda code: get_history_detail(code, days=days))
+        self.max_workers = max_workers
+        self.frames = {}
+        self._missing = set()
+        self._cache = None
+        # 常驻 worker 中同一会话可能被并发任务共用，筛选串行执行
+        self._lock = threading.Lock()
+
+    def _ensure_history(self, codes):
+        todo = [c for c in codes if c not in self.frames and c not in self._missing]
+        if not todo:
+            return
+        with ContextThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_code = {executor.submit(self.loader, code): code for code in todo}
+            for future in concurrent.futures.as_completed(future_to_code):
+                code = future_to_code[future]
+                try:
+                    df = future.result()
+                except Exception:
+                    df = None
+                if df is not None and not df.empty:
+                    self.frames[code] = df.sort_values('日期')
+                else:
+                    self._missing.add(code)
+        # 新增标的后整体重建矩阵与指标 (向量化计算，代价远小于行情获取)
+        self._cache = None
+
+    def cache(self):
+        if self._cache is None:
+            self._cache = IndicatorCache(self.frames)
+        return self._cache
+
+    def screen_many(self, rules: dict):
+        """
+        同时执行多条规则 {名称: 表达式}，返回 {名称: 命中的快照行 (DataFrame)}
+        所有规则需要的行情合并后一次获取，指标共享
+        """
+        parsed = {name: parse_rule(text) for name, text in rules.items()}
+        with self._lock:
+            return self._screen_many(parsed)
+
+    def _screen_many(self, parsed):
+        undecided = {}
+        need = set()
+        for name, rule in parsed.items():
+            true, false = prefilter(rule, self.snapshot)
+            undecided[name] = (true, false)
+            need.update(self.snapshot['code'][~true & ~false])
+
+        self._ensure_history(sorted(need))
+        results = {}
+        for name, rule in parsed.items():
+            true, false = undecided[name]
+            mask = true.copy()
+            pending = ~true & ~false
+            if pending.any():
+                mask[pending] = evaluate(rule, self.snapshot[pending], self.cache())
+            results[name] = self.snapshot[mask].reset_index(drop=True)
+        return results
+
+    def screen(self, rule):
+        return self.screen_many({'rule': rule})['rule']
@@ -0,0 +1,235 @@
+import os
+import sys
+import threading
+from datetime import datetime
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+
+from . import net
+from .trade_calendar import get_calendar, settle_ts
+from .indicator_state import update_state
+
+# 本地 K 线仓库：cache/bars/<复权方式>/<代码>.npz，每个标的一个列式文件
+STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "bars")
+
+# 与 ak.stock_zh_a_hist 返回的数值列保持一致
+BAR_COLUMNS = ['开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _symbol_lock(symbol: str, adjust: str):
+    """同一标的的读写串行化，不同标的互不阻塞"""
+    key = (symbol, adjust)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+        return lock
+
+
+def _store_path(symbol: str, adjust: str):
+    return os.path.join(STORE_DIR, adjust or "none", f"{symbol}.npz")
+
+
+def _to_day(value):
+    """YYYYMMDD / YYYY-MM-DD / datetime -> numpy datetime64[D]"""
+    return np.datetime64(pd.to_datetime(str(value)).date(), 'D')
+
+
+def _empty_bars():
+    bars = {'日期': np.array([], dtype='datetime64[D]')}
+    for col in BAR_COLUMNS:
+        bars[col] = np.array([], dtype=np.float64)
+    return bars
+
+
+def load_bars(symbol: str, adjust: str = "qfq"):
+    """
+    读取本地仓库中的全部 K 线 (按日期升序)，不存在或损坏时返回 None
+    返回 dict：'日期' + BAR_COLUMNS 列数组，以及元信息 'synced_at' / 'head'
+    """
+    path = _store_path(symbol, adjust)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            bars = {key: data[key] for key in data.files}
+        bars['synced_at'] = float(bars['synced_at'])
+        bars['head'] = bars['head'].astype('datetime64[D]')[()]
+        return bars
+    except Exception:
+        return None
+
+
+def _save_bars(symbol: str, adjust: str, bars: dict):
+    """原子写入：先写临时文件再 rename，避免并发读到半个文件"""
+    path = _store_path(symbol, adjust)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    arrays = {key: bars[key] for key in ['日期'] + BAR_COLUMNS}
+    arrays['synced_at'] = np.float64(bars['synced_at'])
+    arrays['head'] = np.datetime64(bars['head'], 'D')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def _frame_to_bars(df: pd.DataFrame):
+    dates = pd.to_datetime(df['日期']).to_numpy().astype('datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    bars = {'日期': dates[order]}
+    for col in BAR_COLUMNS:
+        bars[col] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)[order]
+    return bars
+
+
+def _slice_bars(bars: dict, mask):
+    return {key: bars[key][mask] for key in ['日期'] + BAR_COLUMNS}
+
+
+def _concat_bars(left: dict, right: dict):
+    """拼接两段 K 线，日期重叠部分以 right 为准"""
+    if len(right['日期']) == 0:
+        return _slice_bars(left, slice(None))
+    keep = left['日期'] < right['日期'][0]
+    tail = left['日期'] > right['日期'][-1]
+    return {
+        key: np.concatenate([left[key][keep], right[key], left[key][tail]])
+        for key in ['日期'] + BAR_COLUMNS
+    }
+
+
+def bars_to_frame(bars: dict, symbol: str):
+    """转换为与 ak.stock_zh_a_hist 相同列布局的 DataFrame (升序，日期为字符串)"""
+    df = pd.DataFrame({'日期': np.datetime_as_string(bars['日期'], unit='D')})
+    df['股票代码'] = symbol
+    for col in BAR_COLUMNS:
+        df[col] = bars[col]
+    return df
+
+
+def _fetch(symbol: str, start, end, adjust: str):
+    df = net.call(
+        'eastmoney_hist', ak.stock_zh_a_hist,
+        symbol=symbol,
+        period="daily",
+        start_date=pd.to_datetime(str(start)).strftime("%Y%m%d"),
+        end_date=pd.to_datetime(str(end)).strftime("%Y%m%d"),
+        adjust=adjust
+    )
+    if df is None or df.empty:
+        return _empty_bars()
+    return _frame_to_bars(df)
+
+
+def _is_fresh(bars: dict, end_day):
+    """
+    判断本地数据是否已覆盖到 end_day (按交易日历，周末与节假日不会产生新 K 线)：
+    - 在 end_day 之前 (含) 最后一个交易日收盘之后同步过，视为最新
+    - 该交易日就是今天且尚未收盘时，今天同步过即视为最新 (与旧的按日缓存行为一致)
+    """
+    synced_at = bars['synced_at']
+    session = get_calendar().last_session(end_day)
+    if session is None:
+        return True
+    settle = settle_ts(session)
+    if synced_at >= settle:
+        return True
+    now = datetime.now()
+    if now.timestamp() < settle:
+        return datetime.fromtimestamp(synced_at).date() == now.date()
+    return False
+
+
+def sync_bars(symbol: str, start_date=None, end_date=None, adjust: str = "qfq", strict: bool = False):
+    """
+    增量同步本地 K 线并返回全部数据 (dict，升序)
+    - 本地为空：按 [start_date, end_date] 全量拉取
+    - 起点早于本地已覆盖的范围：只补拉缺失的前段
+    - 终点晚于上次同步：从倒数第二根 K 线开始拉取增量并追加；
+      若重叠 K 线的收盘价变化 (除权导致前复权价整体调整)，则整段重新拉取
+    网络失败时返回本地已有数据；本地也没有时返回 None (strict=True 时抛出异常，以区分上游失败与无数据)
+    """
+    end_day = _to_day(end_date or datetime.now().strftime("%Y%m%d"))
+    start_day = _to_day(start_date) if start_date else None
+
+    with _symbol_lock(symbol, adjust):
+        bars = load_bars(symbol, adjust)
+        changed = False
+        try:
+            if bars is None or len(bars['日期']) == 0:
+                if start_day is None:
+                    start_day = end_day - np.timedelta64(365, 'D')
+                fetched = _fetch(symbol, start_day, end_day, adjust)
+                if len(fetched['日期']) == 0:
+                    return None
+                bars = fetched
+                bars['head'] = start_day
+                bars['synced_at'] = datetime.now().timestamp()
+                changed = True
+            else:
+                dates = bars['日期']
+                meta = {'synced_at': bars['synced_at'], 'head': bars['head']}
+
+                # 1. 向前补齐
+                if start_day is not None and start_day < meta['head']:
+                    if start_day < dates[0]:
+                        front = _fetch(symbol, start_day, dates[0] - np.timedelta64(1, 'D'), adjust)
+                        bars = _concat_bars(front, bars)
+                    meta['head'] = start_day
+                    changed = True
+
+                # 2. 向后增量
+                if not _is_fresh(meta, end_day):
+                    dates = bars['日期']
+                    anchor = dates[-2] if len(dates) >= 2 else dates[-1]
+                    delta = _fetch(symbol, anchor, end_day, adjust)
+                    old_close = bars['收盘'][dates == anchor]
+                    new_close = delta['收盘'][delta['日期'] == anchor]
+                    if len(new_close) == 0 or not np.allclose(old_close, new_close, rtol=1e-6):
+                        # 复权基准变化，整段重建
+                        bars = _fetch(symbol, meta['head'], end_day, adjust)
+                        if len(bars['日期']) == 0:
+                            raise ValueError("重建复权数据时返回为空")
+                    else:
+                        bars = _concat_bars(bars, delta)
+                    meta['synced_at'] = datetime.now().timestamp()
+                    changed = True
+
+                bars.update(meta)
+
+            if changed:
+                _save_bars(symbol, adjust, bars)
+        except Exception as e:
+            print(f"WARNING: 同步 {symbol} K 线失败: {e}", file=sys.stderr)
+            bars = load_bars(symbol, adjust)
+            if bars is None and strict:
+                raise
+            return bars
+
+        # K 线落盘后递推增量 MACD 状态 (失败不影响行情读取)
+        try:
+            update_state(symbol, adjust, bars)
+        except Exception as e:
+            print(f"WARNING: 更新 {symbol} 指标状态失败: {e}", file=sys.stderr)
+        return bars
+
+
+def read_history(symbol: str, start_date=None, end_date=None, adjust: str = "qfq", strict: bool = False):
+    """
+    先同步再从本地仓库读取 [start_date, end_date] 区间的 K 线 (升序 DataFrame)
+    """
+    bars = sync_bars(symbol, start_date, end_date, adjust, strict)
+    if bars is None or len(bars['日期']) == 0:
+        return pd.DataFrame()
+
+    mask = np.ones(len(bars['日期']), dtype=bool)
+    if start_date:
+        mask &= bars['日期'] >= _to_day(start_date)
+    if end_date:
+        mask &= bars['日期'] <= _to_day(end_date)
+    return bars_to_frame(_slice_bars(bars, mask), symbol)
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import bisect
+import difflib
+import threading
+import unicodedata
+
+import akshare as ak
+
+from . import net
+
+# 本地标的主数据：代码 / 名称 / 市场 / 板块 / 行业 / 巨潮 orgId
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "symbols.json")
+
+# 代码-名称列表每天刷新一次 (ST 摘帽、更名)，行业一个月刷新一次，orgId 长期有效
+LIST_TTL = 24 * 3600
+INDUSTRY_TTL = 30 * 24 * 3600
+# 刷新失败 (离线) 后的重试间隔，期间直接使用本地旧数据
+RETRY_INTERVAL = 600
+
+CNINFO_STOCK_LIST_URL = "http://www.cninfo.com.cn/new/data/szse_stock.json"
+CNINFO_SEARCH_URL = "http://www.cninfo.com.cn/new/information/topSearch/query"
+CNINFO_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+}
+
+# 巨潮公告查询的 column 参数
+CNINFO_COLUMNS = {
+    ('sh', 'main'): 'shmb', ('sh', 'star'): 'shmb', ('sh', 'b'): 'shmb',
+    ('sz', 'main'): 'szmb', ('sz', 'b'): 'szmb', ('sz', 'chinext'): 'szcy',
+    ('bj', 'bse'): 'bj',
+}
+
+
+def classify_market(code: str):
+    """
+    统一的 A 股市场/板块判定，返回 (market, board)
+    market: sh / sz / bj；board: main 主板 / star 科创板 / chinext 创业板 / bse 北交所 / b B股
+    无法识别时返回 ('', '')
+    """
+    code = str(code).strip()[:6]
+    if code.startswith(('688', '689')):
+        return 'sh', 'star'
+    if code.startswith('900'):
+        return 'sh', 'b'
+    if code.startswith('6'):
+        return 'sh', 'main'
+    if code.startswith(('300', '301', '302')):
+        return 'sz', 'chinext'
+    if code.startswith('200'):
+        return 'sz', 'b'
+    if code.startswith(('000', '001', '002', '003', '004')):
+        return 'sz', 'main'
+    if code.startswith(('4', '8', '92')):
+        return 'bj', 'bse'
+    return '', ''
+
+
+def cninfo_column(code: str):
+    """巨潮公告查询所需的 (column, plate)，无法识别时均为空 (搜索全市场)"""
+    market, board = classify_market(code)
+    return CNINFO_COLUMNS.get((market, board), ''), market
+
+
+def _normalize(name: str):
+    """全角转半角、去空白，使 '万 科Ａ' 与 '万科A' 可互相匹配"""
+    return ''.join(unicodedata.normalize('NFKC', str(name)).split()).upper()
+
+
+class SymbolRegistry:
+    """
+    持久化的标的注册表，按代码 / 名称建立字典索引，按排序数组支持前缀检索
+    """
+    def __init__(self, path: str = None):
+        self.path = path or REGISTRY_PATH
+        self._lock = threading.RLock()
+        self._records = {}
+        self._listed_at = 0.0
+        self._orgs_at = 0.0
+        self._list_retry_at = 0.0
+        self._orgs_retry_at = 0.0
+        self._industries_at = 0.0
+        self._industries_retry_at = 0.0
+        self._by_name = {}
+        self._sorted_codes = []
+        self._sorted_names = []
+        self._load()
+
+    # ---------- 持久化 ----------
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._records = data.get('records', {})
+            self._listed_at = data.get('listed_at', 0.0)
+            self._orgs_at = data.get('orgs_at', 0.0)
+            self._industries_at = data.get('industries_at', 0.0)
+        except Exception:
+            self._records = {}
+        self._reindex()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'listed_at': self._listed_at,
+                'orgs_at': self._orgs_at,
+                'industries_at': self._industries_at,
+                'records': self._records
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _reindex(self):
+        self._by_name = {}
+        for code, rec in self._records.items():
+            if rec.get('name'):
+                self._by_name[_normalize(rec['name'])] = code
+        self._sorted_codes = sorted(self._records)
+        self._sorted_names = sorted(self._by_name)
+
+    # ---------- 刷新 ----------
+    def refresh(self, force: bool = False):
+        """代码-名称列表过期 (或 force) 时从 akshare 重新拉取，保留已缓存的 orgId / 行业"""
+        with self._lock:
+            if not force and self._records and time.time() - self._listed_at < LIST_TTL:
+                return
+            try:
+                stock_list = net.call('exchanges', ak.stock_info_a_code_name)
+            except Exception as e:
+                print(f"WARNING: 刷新股票列表失败: {str(e)}", file=sys.stderr)
+                self._list_retry_at = time.time() + RETRY_INTERVAL
+                return
+            for code, name in zip(stock_list['code'].astype(str), stock_list['name'].astype(str)):
+                market, board = classify_market(code)
+                rec = self._records.setdefault(code, {})
+                rec.update({'code': code, 'name': name, 'market': market, 'board': board})
+            self._listed_at = time.time()
+            self._reindex()
+            self._save()
+
+    def refresh_org_ids(self, force: bool = False):
+        """从巨潮批量下载全市场 orgId 列表 (一次请求)，替代逐只搜索"""
+        with self._lock:
+            now = time.time()
+            if not force and (now - self._orgs_at < LIST_TTL or now < self._orgs_retry_at):
+                return
+            try:
+                res = net.request('GET', CNINFO_STOCK_LIST_URL, headers=CNINFO_HEADERS, timeout=15)
+                stock_list = res.json().get('stockList', [])
+            except Exception as e:
+                print(f"WARNING: 获取巨潮 orgId 列表失败: {str(e)}", file=sys.stderr)
+                self._orgs_retry_at = now + RETRY_INTERVAL
+                return
+            for item in stock_list:
+                code = str(item.get('code', ''))
+                if code in self._records and item.get('orgId'):
+                    self._records[code]['org_id'] = item['orgId']
+                    self._records[code]['pinyin'] = item.get('pinyin', '')
+            self._orgs_at = time.time()
+            self._save()
+
+    def refresh_industries(self, force: bool = False):
+        """按行业板块成分股批量刷新全市场的行业归属 (约百次请求，替代逐只查询个股信息)"""
+        with self._lock:
+            now = time.time()
+            if not force and (now - self._industries_at < INDUSTRY_TTL or now < self._industries_retry_at):
+                return
+            try:
+                boards = net.call('eastmoney', ak.stock_board_industry_name_em)['板块名称'].astype(str).tolist()
+                members = {}
+                for board in boards:
+                    cons = net.call('eastmoney', ak.stock_board_industry_cons_em, symbol=board)
+                    for code in cons['代码'].astype(str):
+                        members[code] = board
+            except Exception as e:
+                print(f"WARNING: 刷新行业成分失败: {str(e)}", file=sys.stderr)
+                self._industries_retry_at = now + RETRY_INTERVAL
+                return
+            for code, board in members.items():
+                market, board_type = classify_market(code)
+                rec = self._records.setdefault(code, {'code': code, 'market': market, 'board': board_type})
+                rec['industry'] = board
+                rec['industry_at'] = now
+            self._industries_at = now
+            self._reindex()
+            self._save()
+
+    def codes(self):
+        """全部已知代码 (升序)"""
+        self._ensure()
+        return list(self._sorted_codes)
+
+    def _ensure(self):
+        now = time.time()
+        if now < self._list_retry_at:
+            return
+        if not self._records or now - self._listed_at >= LIST_TTL:
+            self.refresh()
+
+    # ---------- 查询 ----------
+    def get(self, code: str):
+        """按代码取完整记录，未知代码返回 None"""
+        self._ensure()
+        return self._records.get(str(code).strip().zfill(6))
+
+    def by_name(self, name: str):
+        self._ensure()
+        code = self._by_name.get(_normalize(name))
+        return self._records.get(code) if code else None
+
+    def resolve(self, symbol: str):
+        """代码或名称 -> (code, name)，无法识别时原样返回"""
+        symbol = str(symbol).strip()
+        rec = self.get(symbol) if symbol.isdigit() else self.by_name(symbol)
+        if rec:
+            return rec['code'], rec.get('name') or rec['code']
+        return symbol, symbol
+
+    def name(self, code: str, default: str = ""):
+        rec = self.get(code)
+        if rec is None:
+            # 列表中没有 (新股或列表刷新失败)，通过个股信息接口补录
+            self.industry(code)
+            rec = self.get(code)
+        return rec['name'] if rec and rec.get('name') else default
+
+    def search(self, query: str, limit: int = 10):
+        """代码前缀 / 名称前缀 / 拼音首字母前缀 / 模糊名称检索"""
+        self._ensure()
+        query = _normalize(query)
+        if not query:
+            return []
+        # 在锁内取一致的快照，刷新线程替换或修改索引时检索不受影响
+        with self._lock:
+            records = dict(self._records)
+            by_name = dict(self._by_name)
+            sorted_codes = list(self._sorted_codes)
+            sorted_names = list(self._sorted_names)
+        found = []
+
+        def _prefix(sorted_keys, key):
+            i = bisect.bisect_left(sorted_keys, key)
+            keys = []
+            while i < len(sorted_keys) and sorted_keys[i].startswith(key) and len(keys) < limit:
+                keys.append(sorted_keys[i])
+                i += 1
+            return keys
+
+        if query.isdigit():
+            found.extend(records[c] for c in _prefix(sorted_codes, query))
+        else:
+            found.extend(records[by_name[n]] for n in _prefix(sorted_names, query))
+            if len(found) < limit:
+                seen = {r['code'] for r in found}
+                for rec in records.values():
+                    if rec['code'] not in seen and str(rec.get('pinyin', '')).upper().startswith(query):
+                        found.append(rec)
+                        if len(found) >= limit:
+                            break
+            if len(found) < limit:
+                seen = {r['code'] for r in found}
+                for n in difflib.get_close_matches(query, sorted_names, n=limit, cutoff=0.5):
+                    rec = records[by_name[n]]
+                    if rec['code'] not in seen:
+                        found.append(rec)
+        return found[:limit]
+
+    def org_id(self, code: str):
+        """巨潮 orgId，返回 (org_id, plate)；本地没有时先批量同步，再逐只搜索并缓存"""
+        code = str(code).strip().zfill(6)
+        rec = self.get(code)
+        if rec is None or not rec.get('org_id'):
+            self.refresh_org_ids()
+            rec = self.get(code)
+        if rec is not None and rec.get('org_id'):
+            return rec['org_id'], rec.get('market') or 'szsh'
+
+        org_id, plate = _search_cninfo_org_id(code)
+        if org_id:
+            with self._lock:
+                market, board = classify_market(code)
+                rec = self._records.setdefault(code, {'code': code, 'market': market, 'board': board})
+                rec['org_id'] = org_id
+                self._reindex()
+                self._save()
+        return org_id, plate
+
+    def industry(self, code: str, fetch: bool = True):
+        """所属行业 (东方财富口径)，按 INDUSTRY_TTL 缓存；fetch=False 时只读本地"""
+        code = str(code).strip().zfill(6)
+        rec = self.get(code)
+        if rec and rec.get('industry') and (not fetch or time.time() - rec.get('industry_at', 0) < INDUSTRY_TTL):
+            return rec['industry']
+        if not fetch:
+            return None
+        try:
+            info = net.call('eastmoney', ak.stock_individual_info_em, symbol=code)
+            values = dict(zip(info['item'], info['value']))
+        except Exception:
+            return rec.get('industry') if rec else None
+
+        with self._lock:
+            market, board = classify_market(code)
+            rec = self._records.setdefault(code, {'code': code, 'market': market, 'board': board})
+            if values.get('股票简称'):
+                rec.setdefault('name', str(values['股票简称']))
+            if values.get('行业'):
+                rec['industry'] = str(values['行业'])
+                rec['industry_at'] = time.time()
+            self._reindex()
+            self._save()
+        return rec.get('industry')
+
+
+def _search_cninfo_org_id(code: str):
+    """通过巨潮搜索接口获取单只股票的 orgId (注册表未命中时的兜底)"""
+    params = {
+        "keyWord": code,
+        "maxNum": 10
+    }
+    try:
+        res = net.request('POST', CNINFO_SEARCH_URL, data=params, headers=CNINFO_HEADERS, timeout=10)
+        for item in res.json() or []:
+            # 巨潮搜索结果中的 code 可能是 "000981", 也可能是 "000981 sz"
+            if code in item.get('code', ''):
+                return item.get('orgId'), item.get('plate', 'szsh')
+    except Exception as e:
+        print(f"ERROR: 获取 orgId 失败: {str(e)}", file=sys.stderr)
+    return None, None
+
+
+_registry = None
+_registry_guard = threading.Lock()
+
+
+def get_registry():
+    """进程内单例"""
+    global _registry
+    with _registry_guard:
+        if _registry is None:
+            _registry = SymbolRegistry()
+        return _registry
+
+
+def resolve_symbol(symbol: str):
+    return get_registry().resolve(symbol)
+
+
+def lookup_name(code: str, default: str = ""):
+    return get_registry().name(code, default)
+
+
+def search_symbols(query: str, limit: int = 10):
+    return get_registry().search(query, limit)
+
+
+def get_org_id(code: str):
+    return get_registry().org_id(code)
+
+
+def get_industry(code: str):
+    return get_registry().industry(code)
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import akshare as ak
+
+from . import net
+
+# A 股交易日历 (本地缓存 cache/trade_calendar.npz)
+#
+# 交易日来自新浪交易日历 (覆盖到当年年末)，CALENDAR_TTL 内不重复下载；
+# 下载失败且本地没有缓存时，以及日期超出日历覆盖范围时，按工作日近似。
+# 日期 -> 交易日序号的映射用 searchsorted 向量化完成。
+CALENDAR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "..", "cache", "trade_calendar.npz")
+CALENDAR_TTL = 30 * 24 * 3600
+
+# 当日数据落定的时间 (收盘后)
+SETTLE_TIME = (15, 30)
+
+def _to_day(value):
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[D]')
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
+
+def settle_ts(day):
+    """某个交易日数据落定的时间戳"""
+    d = pd.Timestamp(day).to_pydatetime()
+    return d.replace(hour=SETTLE_TIME[0], minute=SETTLE_TIME[1], second=0, microsecond=0).timestamp()
+
+class TradingCalendar:
+    """
+    sessions 为升序的交易日数组 (datetime64[D])；覆盖范围之外按工作日外推
+    """
+    def __init__(self, sessions):
+        self.sessions = np.unique(np.asarray(sessions, dtype='datetime64[D]'))
+        if len(self.sessions) == 0:
+            raise ValueError("交易日历为空")
+        self.first = self.sessions[0]
+        self.last = self.sessions[-1]
+
+    def _extended(self, until):
+        """覆盖到 until 的交易日数组 (超出部分按工作日外推)"""
+        if until <= self.last:
+            return self.sessions
+        extra = np.arange(self.last + 1, until + 1, dtype='datetime64[D]')
+        return np.concatenate([self.sessions, extra[np.is_busday(extra)]])
+
+    def session_index(self, dates):
+        """
+        向量化：每个日期对应的 "不晚于该日的最后一个交易日" 的序号 (早于日历起点为 -1)
+        """
+        days = np.asarray(dates, dtype='datetime64[D]')
+        sessions = self._extended(days.max()) if days.size else self.sessions
+        return np.searchsorted(sessions, days, side='right') - 1
+
+    def is_session(self, day):
+        day = _to_day(day)
+        sessions = self._extended(day)
+        i = np.searchsorted(sessions, day)
+        return bool(i < len(sessions) and sessions[i] == day)
+
+    def last_session(self, day):
+        """不晚于 day 的最后一个交易日"""
+        day = _to_day(day)
+        sessions = self._extended(day)
+        i = np.searchsorted(sessions, day, side='right') - 1
+        return sessions[i] if i >= 0 else None
+
+    def next_session(self, day):
+        """晚于 day 的第一个交易日"""
+        day = _to_day(day)
+        sessions = self._extended(day + 30)
+        while True:
+            i = np.searchsorted(sessions, day, side='right')
+            if i < len(sessions):
+                return sessions[i]
+            sessions = self._extended(sessions[-1] + 30)
+
+    def sessions_between(self, start, end):
+        """[start, end] 区间内的交易日数组 (含两端)"""
+        start, end = _to_day(start), _to_day(end)
+        sessions = self._extended(end)
+        return sessions[(sessions >= start) & (sessions <= end)]
+
+    def start_for(self, n: int, end=None):
+        """截至 end (含，缺省为今天) 的最近 n 个交易日中的第一个"""
+        end = _to_day(end or datetime.now())
+        sessions = self._extended(end)
+        i = np.searchsorted(sessions, end, side='right') - n
+        return sessions[max(i, 0)]
+
+    def last_closed_session(self, now: datetime = None):
+        """数据已落定的最近一个交易日"""
+        now = now or datetime.now()
+        day = self.last_session(now)
+        if day is not None and now.timestamp() < settle_ts(day):
+            day = self.last_session(day - 1)
+        return day
+
+    def next_close(self, now: datetime = None):
+        """下一次收盘落定时刻 (datetime)；今天是交易日且尚未落定时为今天"""
+        now = now or datetime.now()
+        today = _to_day(now)
+        day = today if self.is_session(today) and now.timestamp() < settle_ts(today) else self.next_session(today)
+        return datetime.fromtimestamp(settle_ts(day))
+
+    def has_new_session(self, synced_at: float, now: datetime = None):
+        """synced_at 之后是否有交易日收盘落定 (即是否可能存在新的日线)"""
+        now = now or datetime.now()
+        return self.next_close(datetime.fromtimestamp(synced_at)) <= now
+
+def _fetch_sessions():
+    df = net.call('sina', ak.tool_trade_date_hist_sina)
+    return pd.to_datetime(df['trade_date']).to_numpy().astype('datetime64[D]')
+
+def _weekday_sessions():
+    days = np.arange(np.datetime64('2000-01-01'), np.datetime64(f'{datetime.now().year}-12-31') + 1)
+    return days[np.is_busday(days)]
+
+def load_calendar(path: str = None, refresh: bool = False):
+    """
+    读取本地交易日历，过期 (或 refresh) 时重新下载；下载失败时沿用本地缓存，都没有时按工作日近似
+    """
+    path = path or CALENDAR_PATH
+    cached = None
+    if os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                cached = data['sessions'].astype('datetime64[D]')
+                fetched_at = float(data['fetched_at'])
+        except Exception:
+            cached = None
+
+    if cached is not None and not refresh and time.time() - fetched_at < CALENDAR_TTL:
+        return TradingCalendar(cached)
+
+    try:
+        sessions = _fetch_sessions()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, sessions=sessions.astype('datetime64[D]'), fetched_at=time.time())
+        os.replace(tmp, path)
+        return TradingCalendar(sessions)
+    except Exception as e:
+        print(f"WARNING: 获取交易日历失败: {str(e)}", file=sys.stderr)
+        return TradingCalendar(cached if cached is not None else _weekday_sessions())
+
+_calendar = None
+_calendar_guard = threading.Lock()
+
+def get_calendar():
+    """进程内单例"""
+    global _calendar
+    with _calendar_guard:
+        if _calendar is None:
+            _calendar = load_calendar()
+        return _calendar
@@ -0,0 +1,248 @@
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from . import panel
+from .store import read_history
+from .symbols import get_registry
+from .trade_calendar import get_calendar
+from .correlation import _load_frames
+
+# 全市场多窗口波动率
+#
+# 对 (标的 × 交易日) 的 OHLC 矩阵一次性计算各窗口的年化波动率：
+#   hv         收盘价对数收益率的样本标准差 (与 pandas rolling(window).std() 一致)
+#   parkinson  基于最高 / 最低价：mean(ln(H/L)^2) / (4 ln2)
+#   gk         Garman-Klass：mean(0.5 ln(H/L)^2 - (2 ln2 - 1) ln(C/O)^2)
+# 停牌等缺失列先剔除并右对齐 (panel.right_align)，各窗口均取每只标的最近 window 根有效 K 线；
+# 滚动矩用累计和相减得到，每个窗口 O(N × T)，与窗口长度无关。
+# OnlineVolatility 为增量版本：环形缓冲 + 各窗口的滑动和，新 K 线到来时每只标的 O(窗口数) 更新。
+WINDOWS = (5, 10, 20, 60, 120)
+TRADING_DAYS = 252
+ESTIMATORS = ('hv', 'parkinson', 'gk')
+
+LN2 = np.log(2.0)
+GK_OC = 2 * LN2 - 1
+
+# 每 RESYNC_EVERY 次增量更新后由缓冲区重算滑动和，抵消加减累积的浮点误差
+RESYNC_EVERY = 1000
+
+def rolling_mean(values: np.ndarray, window: int):
+    """
+    逐行滚动均值 (累计和相减)，窗口内必须全部有效，否则为 NaN；返回与输入同形的矩阵
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n, t = values.shape
+    out = np.full((n, t), np.nan)
+    if window <= 0 or t < window:
+        return out
+    mask = ~np.isnan(values)
+    total = np.zeros((n, t + 1))
+    count = np.zeros((n, t + 1), dtype=np.int64)
+    np.cumsum(np.where(mask, values, 0.0), axis=1, out=total[:, 1:])
+    np.cumsum(mask, axis=1, out=count[:, 1:])
+    s = total[:, window:] - total[:, :-window]
+    c = count[:, window:] - count[:, :-window]
+    out[:, window - 1:] = np.where(c == window, s / window, np.nan)
+    return out
+
+def rolling_std(values: np.ndarray, window: int):
+    """
+    逐行滚动样本标准差 (ddof=1)，先按行去均值再由一、二阶矩得到方差，避免大数相减的精度损失
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if window < 2:
+        return np.full(values.shape, np.nan)
+    # 由 nansum / 有效数得到行均值：整行缺失 (长期停牌) 时记为 0，不触发 nanmean 的空切片警告
+    count = (~np.isnan(values)).sum(axis=1, keepdims=True)
+    mean = np.nansum(values, axis=1, keepdims=True) / np.maximum(count, 1)
+    centered = values - mean
+    m1 = rolling_mean(centered, window)
+    m2 = rolling_mean(centered * centered, window)
+    var = np.maximum(m2 - m1 * m1, 0.0) * window / (window - 1)
+    return np.sqrt(var)
+
+def range_terms(open_: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray):
+    """各根 K 线的 Parkinson 项 ln(H/L)^2 与 Garman-Klass 项 (价格非正时为 NaN)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hl = np.log(high / low) ** 2
+        co = np.log(close / open_) ** 2
+    return hl / (4 * LN2), 0.5 * hl - GK_OC * co
+
+def aligned_bars(prices: dict, k: int = None):
+    """
+    OHLC 矩阵按收盘价有效列压缩并右对齐，只保留最近 k 根；返回 (对齐后的 dict, 各位置的原始列号)
+    """
+    close, cols = panel.right_align(prices['收盘'], k)
+    out = {'收盘': close}
+    for field in ('开盘', '最高', '最低'):
+        values = np.asarray(prices.get(field, np.full(close.shape, np.nan)), dtype=np.float64)
+        picked = np.take_along_axis(values, np.maximum(cols, 0), axis=1) if values.size else values
+        out[field] = np.where(cols >= 0, picked, np.nan)
+    return out, cols
+
+def bar_terms(bars: dict):
+    """
+    对齐后的 OHLC -> (对数收益率, Parkinson 项, Garman-Klass 项)，缺少开 / 高 / 低价时后两者为 NaN
+    三者只在有前收盘的 K 线上有效 (首根 K 线不计入)，保证各估计量覆盖同一组 K 线
+    """
+    close = bars['收盘']
+    ret = np.full(close.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret[:, 1:] = np.log(close[:, 1:] / close[:, :-1])
+    missing = np.full(close.shape, np.nan)
+    pk, gk = range_terms(*(bars.get(field, missing) for field in ('开盘', '最高', '最低')), close)
+    has_prev = ~np.isnan(ret)
+    return ret, np.where(has_prev, pk, np.nan), np.where(has_prev, gk, np.nan)
+
+def volatility_panel(prices: dict, windows=WINDOWS, aligned: bool = False):
+    """
+    全部标的、各窗口的滚动年化波动率序列
+    prices 为 build_price_panel 得到的 OHLC 矩阵 dict (aligned=True 表示已经右对齐)
+    返回 {(估计量, 窗口): N × T 矩阵}，列与 (对齐后的) 输入一致
+    """
+    bars = prices if aligned else aligned_bars(prices)[0]
+    ret, pk, gk = bar_terms(bars)
+    annual = np.sqrt(TRADING_DAYS)
+    result = {}
+    for window in windows:
+        result[('hv', window)] = rolling_std(ret, window) * annual
+        with np.errstate(invalid='ignore'):
+            result[('parkinson', window)] = np.sqrt(np.maximum(rolling_mean(pk, window), 0) * TRADING_DAYS)
+            result[('gk', window)] = np.sqrt(np.maximum(rolling_mean(gk, window), 0) * TRADING_DAYS)
+    return result
+
+def _ranked(table: pd.DataFrame, values: dict, windows):
+    """追加各估计量 / 窗口的波动率列，并对这些列一次性做全市场百分位排名 (_pct，NaN 不参与)"""
+    names = [f'{name}_{window}' for window in windows for name in ESTIMATORS]
+    for window in windows:
+        for name in ESTIMATORS:
+            table[f'{name}_{window}'] = values[(name, window)]
+    ranks = table[names].rank(pct=True)
+    ranks.columns = [f'{c}_pct' for c in names]
+    return pd.concat([table, ranks], axis=1).sort_values('代码').reset_index(drop=True)
+
+def volatility_table(codes, dates, prices: dict, windows=WINDOWS):
+    """
+    每只标的最近一根 K 线上的各窗口波动率，以及 hv / parkinson / gk 在全市场的百分位排名 (_pct，越大越波动)
+    返回 DataFrame，每只标的一行
+    """
+    bars, cols = aligned_bars(prices, max(windows) + 1)
+    series = volatility_panel(bars, windows, aligned=True)
+    last = cols[:, -1]
+    dates = np.asarray(dates)
+    table = pd.DataFrame({
+        '代码': list(codes),
+        '日期': np.where(last >= 0, dates[np.maximum(last, 0)] if len(dates) else '', ''),
+    })
+    return _ranked(table, {key: values[:, -1] for key, values in series.items()}, windows)
+
+def market_volatility_table(codes=None, windows=WINDOWS, max_workers=16):
+    """
+    全市场各窗口波动率与排名 (行情来自本地 K 线仓库)；codes 缺省为注册表中的全部 A 股
+    """
+    if codes is None:
+        codes = get_registry().codes()
+    end_date = datetime.now().strftime("%Y%m%d")
+    # 收益率需要多一个交易日的收盘价
+    start_date = pd.Timestamp(get_calendar().start_for(max(windows) + 1)).strftime("%Y%m%d")
+
+    print(f"INFO: 正在加载 {len(codes)} 只个股行情...", file=sys.stderr)
+    frames = _load_frames(lambda c: read_history(c, start_date, end_date), codes, max_workers)
+    if not frames:
+        return pd.DataFrame()
+    prices = {}
+    for field in ('开盘', '收盘', '最高', '最低'):
+        names, dates, prices[field] = panel.build_price_panel(frames, field=field)
+    return volatility_table(names, dates, prices, windows)
+
+class OnlineVolatility:
+    """
+    增量多窗口波动率：每只标的保存最近 max(windows) 根 K 线的 (收益率, 收益率平方, Parkinson 项, GK 项)
+    环形缓冲与各窗口的滑动和；update 传入一根新 K 线 (各标的一个值，NaN 表示停牌)，按标的向量化更新
+    """
+    def __init__(self, codes, windows=WINDOWS):
+        self.codes = list(codes)
+        self.windows = tuple(windows)
+        self.size = max(self.windows)
+        n, k = len(self.codes), len(self.windows)
+        self._buf = np.full((4, n, self.size), np.nan)
+        self._sums = np.zeros((4, n, k))
+        self._counts = np.zeros((4, n, k), dtype=np.int64)
+        self._pushed = np.zeros(n, dtype=np.int64)
+        self._last_close = np.full(n, np.nan)
+        self._updates = 0
+
+    @classmethod
+    def from_prices(cls, codes, prices: dict, windows=WINDOWS):
+        """用历史 OHLC 矩阵 (build_price_panel 的结果) 初始化，只回放最近 max(windows) + 1 根有效 K 线"""
+        state = cls(codes, windows)
+        bars, _ = aligned_bars(prices, state.size + 1)
+        for j in range(bars['收盘'].shape[1]):
+            state.update(bars['收盘'][:, j], bars['最高'][:, j], bars['最低'][:, j], bars['开盘'][:, j])
+        return state
+
+    def update(self, close, high=None, low=None, open_=None):
+        """推进一根 K 线；close 等为与 codes 对应的数组"""
+        close = np.asarray(close, dtype=np.float64)
+        nan = np.full(close.shape, np.nan)
+        high = nan if high is None else np.asarray(high, dtype=np.float64)
+        low = nan if low is None else np.asarray(low, dtype=np.float64)
+        open_ = nan if open_ is None else np.asarray(open_, dtype=np.float64)
+
+        has_bar = ~np.isnan(close)
+        idx = np.flatnonzero(has_bar & ~np.isnan(self._last_close))
+        if len(idx):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ret = np.log(close[idx] / self._last_close[idx])
+            pk, gk = range_terms(open_[idx], high[idx], low[idx], close[idx])
+            self._push(idx, np.vstack([ret, ret * ret, pk, gk]))
+        self._last_close[has_bar] = close[has_bar]
+
+        self._updates += 1
+        if self._updates % RESYNC_EVERY == 0:
+            self._resync()
+
+    def _push(self, idx, terms):
+        pos = self._pushed[idx] % self.size
+        for j, window in enumerate(self.windows):
+            # 先移出离开窗口的一项 (window == size 时与写入位置相同，需在覆盖前读取)
+            leaving = self._pushed[idx] >= window
+            rows = idx[leaving]
+            if len(rows):
+                old = self._buf[:, rows, (self._pushed[rows] - window) % self.size]
+                self._sums[:, rows, j] -= np.nan_to_num(old)
+                self._counts[:, rows, j] -= ~np.isnan(old)
+            self._sums[:, idx, j] += np.nan_to_num(terms)
+            self._counts[:, idx, j] += ~np.isnan(terms)
+        self._buf[:, idx, pos] = terms
+        self._pushed[idx] += 1
+
+    def _resync(self):
+        n = len(self.codes)
+        for j, window in enumerate(self.windows):
+            offsets = np.arange(1, window + 1)
+            pos = (self._pushed[:, None] - offsets[None, :]) % self.size
+            inside = offsets[None, :] <= self._pushed[:, None]
+            recent = np.where(inside[None], self._buf[:, np.arange(n)[:, None], pos], np.nan)
+            self._sums[:, :, j] = np.nansum(recent, axis=2)
+            self._counts[:, :, j] = (~np.isnan(recent)).sum(axis=2)
+
+    def values(self):
+        """{(估计量, 窗口): 各标的当前的年化波动率}，窗口未满的为 NaN"""
+        result = {}
+        for j, window in enumerate(self.windows):
+            s1, s2, pk, gk = self._sums[:, :, j]
+            full = self._counts[:, :, j] == window
+            with np.errstate(invalid='ignore'):
+                var = np.maximum(s2 - s1 * s1 / window, 0) / (window - 1) if window > 1 else np.full(s1.shape, np.nan)
+                result[('hv', window)] = np.where(full[1], np.sqrt(var * TRADING_DAYS), np.nan)
+                result[('parkinson', window)] = np.where(full[2], np.sqrt(np.maximum(pk / window, 0) * TRADING_DAYS), np.nan)
+                result[('gk', window)] = np.where(full[3], np.sqrt(np.maximum(gk / window, 0) * TRADING_DAYS), np.nan)
+        return result
+
+    def table(self):
+        """与 volatility_table 相同列 (不含日期) 的当前结果"""
+        return _ranked(pd.DataFrame({'代码': self.codes}), self.values(), self.windows)
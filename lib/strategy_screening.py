@@ -2,151 +2,418 @@ import sys
 import json
 import argparse
 import os
+import time
+import signal
+import queue
+import threading
+import multiprocessing
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
 import concurrent.futures
-import akshare as ak
 from functools import lru_cache
 
 # 添加模块路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import quant
-from quant import calculators
+from quant import channel, indicator_state, net, rules
 
-# 简单的本地缓存目录
-CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "history")
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR, exist_ok=True)
+# 旧版按日 JSON 缓存目录 (已由 quant.store 的本地 K 线仓库取代)
+LEGACY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "history")
+
+def purge_legacy_cache():
+    """
+    清理旧版 {code}_{YYYYMMDD}.json 缓存文件
+    """
+    if not os.path.isdir(LEGACY_CACHE_DIR):
+        return 0
+    removed = 0
+    for entry in os.scandir(LEGACY_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith('.json'):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
 
 def get_cached_history(stock_code, days=60):
     """
-    带有本地文件缓存的历史数据获取
+    带有本地 K 线仓库的历史数据获取 (每日仅增量拉取新 K 线)
+    上游失败 (重试耗尽) 时抛出异常，由调用方计为失败而不是无数据
     """
-    today = datetime.now().strftime("%Y%m%d")
-    cache_file = os.path.join(CACHE_DIR, f"{stock_code}_{today}.json")
-    
-    # 1. 尝试从缓存读取
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return pd.DataFrame(data)
-        except:
-            pass
-            
-    # 2. 缓存不存在或失效，从网络抓取
-    df = quant.get_history_detail(stock_code, days=days)
-    if not df.empty:
-        # 存入缓存
-        try:
-            # 转换为字典列表存储
-            df.to_json(cache_file, orient='records', force_ascii=False)
-        except:
-            pass
-    return df
+    return quant.get_history_detail(stock_code, days=days, strict=True)
+
+# 默认策略：排除大跌中的金叉，只保留 MACD 零下金叉
+DEFAULT_RULE = "change > -5 AND macd_zero_cross"
 
-def screen_stock(stock_code, stock_name, volume_ratio, start_date=None, end_date=None):
+def _macd_status(cache, row):
+    """命中标的的 MACD 状态说明"""
+    if row < 0:
+        return "-"
+    if rules.SIGNALS['macd_zero_cross'](cache)[row]:
+        return "Zero-Cross"
+    if rules.SIGNALS['macd_golden_cross'](cache)[row]:
+        return "Golden-Cross"
+    return "-"
+
+# 流式筛选：已取到的行情每攒够一批或每隔一小段时间就向量化计算一次，命中立即输出
+FLUSH_BATCH = 64
+FLUSH_INTERVAL = 0.2
+
+# 两级流水线：取数层 (线程池，I/O 密集) -> 有界队列 -> 计算层 (进程池，不受 GIL 限制)
+FETCH_WORKERS = 30
+COMPUTE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+FETCH_QUEUE_SIZE = FLUSH_BATCH * 4   # 计算层跟不上时取数线程阻塞在队列上 (背压)
+COMPUTE_QUEUE_BATCHES = 2            # 每个计算 worker 最多排队的批数
+INLINE_THRESHOLD = 200               # 候选少于此数时在本进程内计算，省去子进程启动开销
+
+def _intraday_status(macd):
+    """盘中模式下各行的 MACD 状态说明"""
+    return np.where(macd['zero_golden_cross'], "Zero-Cross",
+                    np.where(macd['golden_cross'], "Golden-Cross", "-")).tolist()
+
+def _hit(stock, rule, status="-"):
+    res = {
+        "code": stock['code'],
+        "name": stock.get('name', ''),
+        "macd_status": status
+    }
+    # 合并实时快照中的其他数据
+    res.update(stock)
+    res["rule"] = rule.text
+    return res
+
+def _evaluate_batch(frames, stock_by_code, rule):
+    """对一批已取到的行情按规则求值 (指标在批内共享)，返回命中列表"""
+    cache = rules.IndicatorCache(frames)
+    if not cache.codes:
+        return []
+    snapshot = pd.DataFrame([stock_by_code[code] for code in cache.codes])
+    snapshot['code'] = cache.codes
+    mask = rules.evaluate(rule, snapshot, cache)
+    return [
+        _hit(stock_by_code[code], rule, _macd_status(cache, cache.row[code]))
+        for code, hit in zip(cache.codes, mask) if hit
+    ]
+
+def _emit_summary(out, results, partial, reason, screened, failed, total):
     """
-    对单个股票进行策略验证
+    输出最终结果 (SUCCESS / result 帧)：命中列表连同是否为部分结果一并给出，
+    时限、取消等提前结束的情况调用方无需依赖 worker 的 done 帧即可识别
     """
-    try:
-        # 获取历史数据 (优先使用缓存)
-        df = get_cached_history(stock_code, days=60)
-        if df.empty or len(df) < 30:
-            return None
-            
-        # 按照日期升序排列以便计算指标
-        df = df.sort_values('日期', ascending=True)
+    out.result(channel.Payload({"partial": partial, "reason": reason, "screened": screened, "failed": failed,
+                                "total": total, "results": results}))
 
-        # 检查 MACD “零下金叉” (仅保留金叉和零下判定)
-        if not calculators.check_macd_zero_golden_cross(df):
-            return None
-        
-        # 返回符合条件的结果
-        return {
-            "code": stock_code,
-            "name": stock_name,
-            "macd_status": "Zero-Cross"
-        }
-    except Exception as e:
-        return None
+@lru_cache(maxsize=32)
+def _parsed_rule(text):
+    return rules.parse_rule(text)
+
+def _compute_batch(frames, stock_by_code, rule_text):
+    """计算层任务 (在子进程中执行)：返回 (命中列表, 计算耗时)"""
+    started = time.perf_counter()
+    hits = _evaluate_batch(frames, stock_by_code, _parsed_rule(rule_text))
+    return hits, time.perf_counter() - started
+
+_compute_pool = None
+_compute_pool_workers = 0
+_compute_pool_guard = threading.Lock()
+
+def _get_compute_pool(workers):
+    """
+    计算层进程池 (进程内复用，常驻 worker 多次筛选不必重复启动子进程)
+    使用 spawn 启动子进程：常驻 worker 是多线程进程，fork 可能复制其他线程持有的锁而死锁
+    """
+    global _compute_pool, _compute_pool_workers
+    with _compute_pool_guard:
+        if _compute_pool is None or _compute_pool_workers != workers:
+            if _compute_pool is not None:
+                _compute_pool.shutdown(wait=False)
+            _compute_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _compute_pool_workers = workers
+        return _compute_pool
 
-def run_strategy_screening(stocks_json_path):
+def _reset_compute_pool():
+    global _compute_pool
+    with _compute_pool_guard:
+        if _compute_pool is not None:
+            _compute_pool.shutdown(wait=False)
+            _compute_pool = None
+
+def run_strategy_screening(stocks_json_path, deadline=None, cancel=None, rule=DEFAULT_RULE,
+                           fetch_workers=FETCH_WORKERS, compute_workers=None, intraday=False):
     """
-    运行全市场筛选
+    运行全市场筛选：命中逐条输出 (RESULT / item 帧)，最后输出
+    {"partial", "reason", "screened", "failed", "total", "results": 全部命中} (SUCCESS / result 帧)
+    rule 为规则表达式 (见 quant.rules)，只用快照字段即可确定结果的标的不拉取历史行情
+    deadline 为整体时限 (秒)，cancel 为 threading.Event；任一触发时不再等待新的行情，
+    已在进行中的请求结束后仍参与计算，结果标记为部分结果
+    fetch_workers 为取数线程数，compute_workers 为计算进程数 (0 表示在本进程内计算，缺省按候选数量决定)
+    intraday=True 时 MACD 类条件用增量指标状态与快照最新价求值 (见 quant.indicator_state)，
+    只有状态不可用或规则含其他历史指标的标的才拉取行情
+    返回 {"hits", "partial", "reason", "screened", "failed", "total", "stages"}
+    failed 为上游重试耗尽仍未取到行情的标的数，stages 为各层的负载统计与各上游主机的请求统计
     """
-    print(f"INFO: 开始全市场 MACD 金叉筛选 (并发加速版)...", file=sys.stderr)
+    print(f"INFO: 开始全市场规则筛选: {rule}", file=sys.stderr)
+    out = channel.get_channel()
+    deadline_at = time.monotonic() + deadline if deadline else None
+
+    def _stop_reason():
+        if cancel is not None and cancel.is_set():
+            return "cancelled"
+        if deadline_at is not None and time.monotonic() >= deadline_at:
+            return "deadline"
+        return None
     
     try:
+        rule = rules.parse_rule(rule)
+        removed = purge_legacy_cache()
+        if removed:
+            print(f"INFO: 已清理 {removed} 个旧版缓存文件", file=sys.stderr)
+
         # 加载实时快照数据
         with open(stocks_json_path, 'r', encoding='utf-8') as f:
             all_stocks = json.load(f)
             
-        # 1. 初步筛选：涨跌幅过滤
-        # 排除大跌中的金叉
-        candidates = [
-            s for s in all_stocks 
-            if s.get('change', 0) > -5
-        ]
-        
-        if not candidates and all_stocks:
-            candidates = all_stocks[:100]
-            print(f"INFO: 初筛无结果，自动选取前 100 只", file=sys.stderr)
+        # 1. 初步筛选：只用快照字段三值求值，必然不命中的标的直接排除
+        results = []
+        candidates = []
+        if all_stocks:
+            snapshot = pd.DataFrame(all_stocks)
+            snapshot['code'] = snapshot['code'].astype(str)
+            macd = None
+            if intraday:
+                # 盘中模式：MACD 类条件由增量状态与最新价直接求值，不拉取历史行情
+                macd = indicator_state.provisional_macd(snapshot)
+                print(f"INFO: 盘中模式: {int(macd['valid'].sum())}/{len(snapshot)} 只标的使用增量 MACD 状态",
+                      file=sys.stderr)
+            decided_true, decided_false = rules.prefilter(rule, snapshot, macd)
+            statuses = _intraday_status(macd) if macd is not None else ["-"] * len(all_stocks)
+            for stock, true, false, status in zip(all_stocks, decided_true, decided_false, statuses):
+                if true:
+                    res = _hit(stock, rule, status)
+                    results.append(res)
+                    out.item(channel.Payload(res))
+                elif not false:
+                    candidates.append(stock)
         
-        print(f"INFO: 初筛候选标的: {len(candidates)} 只", file=sys.stderr)
+        if not candidates and not results and all_stocks:
+            # 快照字段已判定全部标的不命中；完整求值同样会被这些条件排除，拉取行情不可能产生命中
+            print(f"INFO: 初筛已排除全部 {len(all_stocks)} 只标的 (快照字段条件均不满足)，不再拉取行情",
+                  file=sys.stderr)
         
-        results = []
-        # 显著增加并发线程数。对于网络 I/O 密集型任务，30-50 个线程通常没问题
-        max_workers = 30
+        print(f"INFO: 初筛候选标的: {len(candidates)} 只 (无需行情即命中 {len(results)} 只)", file=sys.stderr)
         
-        # 预先计算日期
-        end_date = datetime.now().strftime("%Y%m%d")
-        start_date = (datetime.now() - timedelta(days=120)).strftime("%Y%m%d")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_stock = {
-                executor.submit(
-                    screen_stock, 
-                    s['code'], 
-                    s['name'], 
-                    s.get('volume_ratio', 0),
-                    start_date,
-                    end_date
-                ): s for s in candidates
-            }
-            
-            count = 0
-            total = len(candidates)
-            if total == 0:
-                print(f"SUCCESS: []", file=sys.stderr)
-                return
-
-            for future in concurrent.futures.as_completed(future_to_stock):
-                count += 1
-                if count % 10 == 0 or count == total:
-                    print(f"PROGRESS: {int(count/total * 100)}", file=sys.stderr)
-                    
+        total = len(candidates)
+        if total == 0:
+            _emit_summary(out, results, False, None, 0, 0, 0)
+            return {"hits": results, "partial": False, "reason": None, "screened": 0, "failed": 0, "total": 0,
+                    "stages": {}}
+
+        if compute_workers is None:
+            compute_workers = COMPUTE_WORKERS if total >= INLINE_THRESHOLD else 0
+        inline = compute_workers <= 0
+        fetch_stats = quant.TierStats("fetch", fetch_workers)
+        compute_stats = quant.TierStats("compute", 1 if inline else compute_workers)
+        max_inflight = compute_stats.workers * COMPUTE_QUEUE_BATCHES
+
+        stock_by_code = {s['code']: s for s in candidates}
+        fetched = queue.Queue(maxsize=FETCH_QUEUE_SIZE)
+        computed = queue.Queue()
+        inflight = {}   # 计算中的批次: future -> (frames, stocks)
+        pending = {}
+        count = 0
+        failed = 0
+        reason = None
+
+        def _fetch(code):
+            started = time.perf_counter()
+            try:
+                df = get_cached_history(code, 60)
+            except Exception as e:
+                df = e
+            fetched_at = time.perf_counter()
+            fetched.put((code, df))
+            fetch_stats.add(busy=fetched_at - started, blocked=time.perf_counter() - fetched_at)
+
+        def _submit(frames):
+            stocks = {code: stock_by_code[code] for code in frames}
+            pool = inline_pool if inline else _get_compute_pool(compute_workers)
+            future = pool.submit(_compute_batch, frames, stocks, rule.text)
+            inflight[future] = (frames, stocks)
+            future.add_done_callback(computed.put)
+
+        def _handle(future):
+            # 2. 计算层返回的命中立即输出
+            frames, stocks = inflight.pop(future)
+            try:
+                hits, busy = future.result()
+            except Exception as e:
+                # 子进程异常退出等情况：该批在本进程内重算，进程池下次使用时重建
+                print(f"WARNING: 计算进程执行失败，改为本进程计算: {str(e)}", file=sys.stderr)
+                if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                    _reset_compute_pool()
+                hits, busy = _compute_batch(frames, stocks, rule.text)
+            compute_stats.add(busy=busy, items=len(frames))
+            for res in hits:
+                results.append(res)
+                out.item(channel.Payload(res))
+
+        inline_pool = quant.ContextThreadPoolExecutor(max_workers=1) if inline else None
+        executor = quant.ContextThreadPoolExecutor(max_workers=fetch_workers)
+        started_at = time.perf_counter()
+        fetch_futures = [executor.submit(_fetch, s['code']) for s in candidates]
+        expected = total
+
+        last_flush = time.monotonic()
+        try:
+            while count < expected:
+                while True:
+                    try:
+                        _handle(computed.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if len(inflight) >= max_inflight:
+                    # 计算层已排满：暂停消费取数结果，取数线程随之阻塞在有界队列上
+                    try:
+                        _handle(computed.get(timeout=FLUSH_INTERVAL))
+                    except queue.Empty:
+                        pass
+                else:
+                    timeout = FLUSH_INTERVAL
+                    if deadline_at is not None and reason is None:
+                        timeout = max(0.0, min(timeout, deadline_at - time.monotonic()))
+                    try:
+                        code, df = fetched.get(timeout=timeout)
+                        count += 1
+                        if isinstance(df, Exception):
+                            failed += 1
+                        elif df is not None and len(df) >= 30:
+                            pending[code] = df
+                        if count % 10 == 0 or count == total:
+                            out.progress(int(count / total * 100))
+                    except queue.Empty:
+                        pass
+
+                    now = time.monotonic()
+                    if pending and (len(pending) >= FLUSH_BATCH or now - last_flush >= FLUSH_INTERVAL):
+                        _submit(pending)
+                        pending = {}
+                        last_flush = now
+
+                if reason is None:
+                    reason = _stop_reason()
+                    if reason:
+                        # 3. 提前结束：取消尚未开始的请求，进行中的请求取到后仍参与计算
+                        expected = total - sum(f.cancel() for f in fetch_futures)
+
+            if pending:
+                _submit(pending)
+            while inflight:
+                _handle(computed.get())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            # 异常退出时取数线程可能阻塞在已满的队列上，排空队列使其结束
+            while not all(f.done() for f in fetch_futures):
                 try:
-                    res = future.result()
-                    if res:
-                        # 合并实时快照中的其他数据
-                        stock_data = future_to_stock[future]
-                        res.update(stock_data)
-                        results.append(res)
-                except:
-                    continue
-
-        print(f"SUCCESS: {json.dumps(results, ensure_ascii=False)}", file=sys.stderr)
+                    fetched.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            if inline_pool is not None:
+                inline_pool.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - started_at
+        stages = {"fetch": fetch_stats.to_dict(elapsed), "compute": compute_stats.to_dict(elapsed)}
+        print(f"INFO: 阶段负载 取数 {stages['fetch']['utilization']:.0%} ({fetch_workers} 线程, "
+              f"背压等待 {fetch_stats.blocked:.1f}s) / 计算 {stages['compute']['utilization']:.0%} "
+              f"({compute_stats.workers} {'线程' if inline else '进程'})", file=sys.stderr)
+
+        partial = count < total
+        if partial:
+            print(f"WARNING: 筛选提前结束 ({reason})，仅返回部分结果: 已筛 {count}/{total} 只", file=sys.stderr)
+        if failed:
+            print(f"WARNING: {failed} 只标的行情获取失败 (上游重试耗尽)，未参与计算", file=sys.stderr)
+        stages["upstream"] = net.stats()
+        _emit_summary(out, results, partial, reason if partial else None, count, failed, total)
+        return {"hits": results, "partial": partial, "reason": reason if partial else None,
+                "screened": count, "failed": failed, "total": total, "stages": stages}
         
     except Exception as e:
         import traceback
-        print(f"ERROR: {traceback.format_exc()}", file=sys.stderr)
+        out.error(traceback.format_exc())
+        sys.exit(1)
+
+# 多规则会话：同一份快照 (同一文件、同一天) 上的多次筛选共用已取到的行情与已计算的指标
+SESSION_LIMIT = 4
+_sessions = {}
+_sessions_guard = threading.Lock()
+
+def get_session(stocks_json_path):
+    """
+    按 (快照文件, 修改时间, 日期) 复用 quant.ScreeningSession；快照文件更新或跨日后重建
+    常驻 worker 中只保留最近 SESSION_LIMIT 个会话
+    """
+    path = os.path.abspath(stocks_json_path)
+    key = (path, os.path.getmtime(path), time.strftime('%Y%m%d'))
+    with _sessions_guard:
+        session = _sessions.pop(key, None)
+        if session is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                session = quant.ScreeningSession(json.load(f), loader=lambda code: get_cached_history(code, 60),
+                                                 max_workers=FETCH_WORKERS)
+        _sessions[key] = session
+        while len(_sessions) > SESSION_LIMIT:
+            _sessions.pop(next(iter(_sessions)))
+        return session
+
+def run_rule_session(stocks_json_path, rule_map):
+    """
+    在同一快照上同时执行多条规则 {名称: 表达式}，行情与指标在会话内共享，并跨调用复用
+    输出并返回 {"results": {名称: 命中列表}, "fetched": 会话内已取到行情的标的数}
+    """
+    print(f"INFO: 开始多规则筛选: {', '.join(rule_map)}", file=sys.stderr)
+    out = channel.get_channel()
+    try:
+        session = get_session(stocks_json_path)
+        matched = session.screen_many(rule_map)
+        cache = session.cache() if session.frames else None
+        results = {}
+        for name, frame in matched.items():
+            rule = _parsed_rule(rule_map[name])
+            results[name] = [
+                _hit(stock, rule, _macd_status(cache, cache.row.get(stock['code'], -1)) if cache else "-")
+                for stock in frame.to_dict(orient='records')
+            ]
+            print(f"INFO: 规则 {name}: 命中 {len(results[name])} 只", file=sys.stderr)
+        summary = {"results": results, "fetched": len(session.frames)}
+        out.result(channel.Payload(summary))
+        return summary
+    except Exception as e:
+        import traceback
+        out.error(traceback.format_exc())
         sys.exit(1)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='MACD Strategy Screening')
     parser.add_argument('--stocks_path', type=str, required=True, help='Path to stocks snapshot JSON')
+    parser.add_argument('--deadline', type=float, default=None, help='Overall time limit in seconds')
+    parser.add_argument('--fetch-workers', dest='fetch_workers', type=int, default=FETCH_WORKERS, help='Threads in the fetch tier')
+    parser.add_argument('--compute-workers', dest='compute_workers', type=int, default=None, help='Processes in the compute tier (0 = in-process)')
+    parser.add_argument('--intraday', action='store_true', help='Evaluate MACD conditions from persisted state and live prices')
+    parser.add_argument('--rule', type=str, default=DEFAULT_RULE, help='Rule expression, e.g. "macd_zero_cross AND ma5_up AND turnover > 3"')
+    parser.add_argument('--rules', type=str, default=None, help='JSON object {name: rule}; runs all rules on shared history and indicators')
     
     args = parser.parse_args()
-    run_strategy_screening(args.stocks_path)
+    if args.rules:
+        run_rule_session(args.stocks_path, json.loads(args.rules))
+        sys.exit(0)
+
+    # SIGINT / SIGTERM 视为取消：停止等待新的行情，输出已确认的部分结果后退出
+    cancel_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: cancel_event.set())
+    run_strategy_screening(args.stocks_path, deadline=args.deadline, cancel=cancel_event, rule=args.rule,
+                           fetch_workers=args.fetch_workers, compute_workers=args.compute_workers,
+                           intraday=args.intraday)
@@ -0,0 +1,283 @@
+import sys
+import io
+import os
+import json
+import argparse
+import threading
+import traceback
+import contextvars
+import concurrent.futures
+
+# 添加模块路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 常驻进程：启动时一次性导入 pandas / numpy / akshare 及各脚本模块，
+# 之后每个请求直接在进程内调度，不再为每次点击重新拉起解释器。
+#
+# 协议 (stdin/stdout，每帧一行 UTF-8 JSON)：
+#   请求: {"id": "job-1", "method": "analysis", "params": {"symbol": "000001", "path": "data"}}
+#   响应: {"id": "job-1", "type": "progress", "data": 30}
+#         {"id": "job-1", "type": "info", "data": "..."}
+#         {"id": "job-1", "type": "success", "data": "<原 SUCCESS: 之后的文本>"}
+#         {"id": "job-1", "type": "result", "data": "<批量模式下每只标的的结果>"}
+#         {"id": "job-1", "type": "done", "data": {"ok": true, "result": ...}}
+#   取消: {"id": "c-1", "method": "cancel", "params": {"id": "job-1"}} -> {"id": "job-1", "type": "cancelling"}
+#         支持取消的任务 (screening) 会尽快结束并在 done 中返回部分结果
+#   多规则筛选: screening 的 params 含 rules ({名称: 表达式}) 时在共享会话上同时求值，
+#         同一快照文件当天的后续调用复用已取到的行情与指标
+#   脚本原有的 PROGRESS:/INFO:/WARNING:/ERROR:/SUCCESS: 行按前缀转换为对应类型的帧，
+#   其他输出作为 "log" 帧。任务 id 以 contextvars 记录，任务内经 quant.ContextThreadPoolExecutor
+#   提交的线程继承该 id；无法归属到任务的输出 (如常驻采样线程) id 为 null。
+#   取消未知或已结束的任务返回 error 帧。
+#   设置 CRANEPOINT_RESULT_FD 时结果通道的二进制帧头同样带有任务 id (见 quant.channel)。
+#   盘口采样: depth_start (symbols / watchlist_file, interval, capacity, quote_url) 启动后台采样器，
+#         depth_stats 返回各标的的滑动统计，depth_stop 停止；采样期间 analysis 的流动性使用滑动统计
+
+import data_analysis
+import finance_fetching
+import strategy_screening
+import quant
+from quant import channel
+
+LINE_PREFIXES = ('PROGRESS', 'INFO', 'WARNING', 'ERROR', 'SUCCESS', 'RESULT', 'DEBUG')
+
+_out = None
+_replaced = None
+_out_lock = threading.Lock()
+_job_id = channel.current_job   # 与二进制结果通道共用，帧头中的任务 id 与 JSON 帧一致
+_job_cancel = contextvars.ContextVar('job_cancel', default=None)
+_cancel_events = {}   # 已排队或运行中的任务 id -> 取消事件
+_cancel_lock = threading.Lock()
+
+
+def emit(job_id, frame_type, data=None):
+    """向真实 stdout 写出一帧"""
+    frame = json.dumps({"id": job_id, "type": frame_type, "data": data},
+                       ensure_ascii=False, cls=data_analysis.MyEncoder)
+    with _out_lock:
+        _out.write(frame + "\n")
+        _out.flush()
+
+
+def current_job():
+    return _job_id.get()
+
+
+def parse_line(line: str):
+    """把脚本的一行输出转换为 (类型, 数据)"""
+    head, sep, rest = line.partition(':')
+    if sep and head in LINE_PREFIXES:
+        frame_type = head.lower()
+        payload = rest.strip()
+        if frame_type == 'progress':
+            try:
+                return frame_type, int(payload)
+            except ValueError:
+                return 'log', line
+        return frame_type, payload
+    return 'log', line
+
+
+class JobStream(io.TextIOBase):
+    """
+    替换 sys.stdout / sys.stderr：按线程缓冲到整行，再以当前上下文所属任务的 id 转发为帧
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        buf = getattr(self._local, 'buf', '') + text
+        *lines, rest = buf.split('\n')
+        self._local.buf = rest
+        for line in lines:
+            line = line.rstrip('\r')
+            if line.strip():
+                emit(current_job(), *parse_line(line))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _run_analysis(params):
+    return data_analysis.run_analysis(params['symbol'], params.get('path', 'data'))
+
+
+def _run_batch(params):
+    symbols = params.get('symbols')
+    if isinstance(symbols, list):
+        symbols = ','.join(symbols)
+    symbols = data_analysis.load_watchlist(symbols, params.get('watchlist_file'))
+    return data_analysis.run_batch_analysis(symbols, params.get('path', 'data'), params.get('concurrency', 4))
+
+
+def _run_history(params):
+    include_index = params.get('include_index', True)
+    if isinstance(include_index, str):
+        include_index = include_index.lower() == 'true'
+    return data_analysis.download_history(
+        params['symbol'], params['start'], params['end'], params.get('path', 'data'),
+        params.get('level', 'standard'), include_index
+    )
+
+
+def _run_finance(params):
+    years = params['years']
+    types = params['types']
+    if isinstance(years, str):
+        years = [y.strip() for y in years.split(',')]
+    if isinstance(types, str):
+        types = [t.strip() for t in types.split(',')]
+    return finance_fetching.get_cninfo_reports(params['symbol'], years, types, params.get('path', 'downloads/finance'))
+
+
+def _run_screening(params):
+    if params.get('rules'):
+        # 多规则：同一快照上的会话在 worker 内复用，后续筛选不再重复取行情与计算指标
+        return strategy_screening.run_rule_session(params['stocks_path'], params['rules'])
+    return strategy_screening.run_strategy_screening(
+        params['stocks_path'], deadline=params.get('deadline'), cancel=_job_cancel.get(),
+        rule=params.get('rule') or strategy_screening.DEFAULT_RULE,
+        fetch_workers=params.get('fetch_workers') or strategy_screening.FETCH_WORKERS,
+        compute_workers=params.get('compute_workers'),
+        intraday=bool(params.get('intraday'))
+    )
+
+
+def _run_depth_start(params):
+    """启动常驻的盘口采样器 (已在运行时按新的自选股重启)，之后的 analysis 使用滑动盘口统计"""
+    symbols = params.get('symbols')
+    if isinstance(symbols, list):
+        symbols = ','.join(symbols)
+    symbols = data_analysis.load_watchlist(symbols, params.get('watchlist_file'))
+    options = {k: params[k] for k in ('interval', 'capacity') if params.get(k)}
+    if params.get('quote_url'):
+        options['url'] = params['quote_url']
+    sampler = quant.start_sampler(symbols, **options)
+    return {"symbols": len(sampler.symbols), "interval": sampler.interval, "capacity": sampler.capacity}
+
+
+def _run_depth_stats(params):
+    sampler = quant.get_sampler()
+    if sampler is None:
+        return {"running": False, "stats": []}
+    table = sampler.stats().reset_index()
+    return {
+        "running": sampler.running,
+        "rounds": sampler.rounds,
+        "failures": sampler.failures,
+        "stats": table.astype(object).where(table.notna(), None).to_dict(orient='records')
+    }
+
+
+def _run_depth_stop(params):
+    quant.stop_sampler()
+    return {"running": False}
+
+
+METHODS = {
+    'analysis': _run_analysis,
+    'batch': _run_batch,
+    'history': _run_history,
+    'finance': _run_finance,
+    'screening': _run_screening,
+    'depth_start': _run_depth_start,
+    'depth_stats': _run_depth_stats,
+    'depth_stop': _run_depth_stop,
+}
+
+
+def run_job(job_id, method, params):
+    """在工作线程中执行一个任务 (于独立的上下文副本中)，所有输出都带上该任务的 id"""
+    _job_id.set(job_id)
+    with _cancel_lock:
+        _job_cancel.set(_cancel_events[job_id])
+    ok, result = True, None
+    try:
+        result = METHODS[method](params)
+    except SystemExit as e:
+        # 原脚本在出错时调用 sys.exit(1)
+        ok = e.code in (None, 0)
+    except Exception:
+        ok = False
+        emit(job_id, 'error', traceback.format_exc())
+    finally:
+        sys.stdout.write('\n')
+        sys.stderr.write('\n')
+        emit(job_id, 'done', {"ok": ok, "result": result})
+        with _cancel_lock:
+            _cancel_events.pop(job_id, None)
+
+
+def serve(max_jobs=4):
+    """读取 stdin 请求直到 EOF 或 shutdown，并发执行任务"""
+    global _out, _replaced
+    # finance_fetching 在导入时已把 sys.stdout 换成 UTF-8 包装器；保留引用，避免其被回收时关闭底层缓冲区
+    _replaced = (sys.stdout, sys.stderr)
+    _out = io.TextIOWrapper(sys.__stdout__.buffer, encoding='utf-8', line_buffering=True)
+    stdin = io.TextIOWrapper(sys.__stdin__.buffer, encoding='utf-8')
+    sys.stdout = JobStream()
+    sys.stderr = JobStream()
+
+    emit(None, 'ready', {"pid": os.getpid(), "methods": sorted(METHODS)})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        for raw in stdin:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                request = json.loads(raw)
+                job_id = request.get('id')
+                method = request.get('method')
+            except Exception as e:
+                emit(None, 'error', f"无法解析请求: {e}")
+                continue
+
+            if method == 'shutdown':
+                break
+            if method == 'ping':
+                emit(job_id, 'pong')
+                continue
+            if method == 'cancel':
+                target = (request.get('params') or {}).get('id')
+                with _cancel_lock:
+                    # 已排队的任务在提交时即已登记，开始后立即结束
+                    event = _cancel_events.get(target)
+                    if event is not None:
+                        event.set()
+                if event is None:
+                    emit(job_id, 'error', f"未知或已结束的任务: {target}")
+                else:
+                    emit(target, 'cancelling')
+                continue
+            if method not in METHODS:
+                emit(job_id, 'error', f"未知方法: {method}")
+                emit(job_id, 'done', {"ok": False, "result": None})
+                continue
+
+            with _cancel_lock:
+                duplicate = job_id in _cancel_events
+                if not duplicate:
+                    _cancel_events[job_id] = threading.Event()
+            if duplicate:
+                emit(job_id, 'error', f"任务 id 已在执行: {job_id}")
+                continue
+            # 每个任务在独立的上下文副本中运行，任务 id 不会泄漏到复用同一线程的后续任务
+            executor.submit(contextvars.copy_context().run, run_job, job_id, method, request.get('params') or {})
+
+    emit(None, 'shutdown')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CranePoint Python worker (stdin/stdout JSON lines)')
+    parser.add_argument('--jobs', type=int, default=4, help='Max concurrent jobs')
+    args = parser.parse_args()
+    serve(args.jobs)